@@ -37,6 +37,11 @@ def save_automation():
     try:
         for key, value in updates.items():
             save_config_value(key, value)
+        
+        if ingest_enabled:
+            # Check the inbox now rather than at the next interval
+            from app.services.background_tasks import trigger_email_check
+            trigger_email_check()
             
         flash("Automation settings saved successfully.")
     except Exception as e:
@@ -3,6 +3,7 @@ Admin Update System Routes
 Handles version checking and GitHub-based updates.
 """
 import os
+import functools
 import logging
 import shutil
 import tempfile
@@ -75,6 +76,7 @@ def get_latest_version(branch='main'):
     return None
 
 
+@functools.lru_cache(maxsize=256)
 def version_is_newer(remote_version, local_version):
     """Compare semantic versions. Returns True if remote > local.
     
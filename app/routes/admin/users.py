@@ -3,25 +3,36 @@ Admin User Management Routes
 Handles user CRUD operations, password resets, and admin promotion.
 """
 import logging
+import re
 from flask import request, redirect, url_for, session, flash
 from flask_login import current_user
-from werkzeug.security import generate_password_hash
 
 from app.routes.admin import admin_bp, require_admin
-from app.services.auth import create_user, delete_user, update_user_password, update_user_admin_status
+from app.services.auth import (
+    create_user, delete_user, update_user_password, update_user_admin_status, hash_password,
+    invalidate_users_cache
+)
 
 logger = logging.getLogger(__name__)
 
 
+# Unicode-aware (str patterns): a letter is a word character that is not a
+# digit or underscore, in any script; a number or symbol is a decimal digit in
+# any script, or anything that is not a word character
+_LETTER_RE = re.compile(r'[^\W\d_]')
+_DIGIT_OR_SYMBOL_RE = re.compile(r'[\d\W_]')
+
+
 def validate_password(password: str) -> tuple[bool, str]:
     """Validate password meets complexity requirements.
     Returns (is_valid, error_message).
     """
     if len(password) < 8:
         return False, "Password must be at least 8 characters long."
-    if not any(c.isupper() for c in password):
+    letters = ''.join(_LETTER_RE.findall(password))
+    if letters == letters.lower():
         return False, "Password must contain at least one uppercase letter."
-    if not any(c.isdigit() or not c.isalnum() for c in password):
+    if not _DIGIT_OR_SYMBOL_RE.search(password):
         return False, "Password must contain at least one number or symbol."
     return True, ""
 
@@ -47,7 +58,7 @@ def add_user_action():
         return redirect(url_for('admin.admin_panel', tab='settings'))
     
     try:
-        pw_hash = generate_password_hash(password)
+        pw_hash = hash_password(password)
         create_user(username, pw_hash, is_admin=False)
         flash(f"User {username} created.")
 
@@ -92,7 +103,7 @@ def reset_password_action(username):
         return redirect(url_for('admin.admin_panel', tab='settings'))
         
     try:
-        pw_hash = generate_password_hash(new_pass)
+        pw_hash = hash_password(new_pass)
         update_user_password(username, pw_hash)
         flash(f"Password for {username} updated.")
     except Exception as e:
@@ -166,11 +177,12 @@ def set_user_pin(username):
     
     try:
         from app.services.db import get_db_connection
-        pin_hash = generate_password_hash(pin)
+        pin_hash = hash_password(pin)
         conn = get_db_connection()
         conn.execute('UPDATE users SET pin_hash = ? WHERE username = ?', (pin_hash, username))
         conn.commit()
         conn.close()
+        invalidate_users_cache()
         flash(f"PIN set for {username}.")
     except Exception as e:
         logger.error(f"Set PIN Error: {e}")
@@ -207,6 +219,7 @@ def set_badge_id(username):
                      (badge_id if badge_id else None, username))
         conn.commit()
         conn.close()
+        invalidate_users_cache()
         
         if badge_id:
             flash(f"Badge ID set for {username}.")
@@ -267,6 +280,7 @@ def set_user_roles(username):
                      (json.dumps(roles), 1 if is_admin else 0, username))
         conn.commit()
         conn.close()
+        invalidate_users_cache()
         
         flash(f"Roles for {username} updated: {', '.join(roles)}")
     except Exception as e:
@@ -3,13 +3,14 @@ Inventory Alerts Module
 Routes for stock alert management.
 """
 import logging
-from flask import request, redirect, url_for, flash, render_template
+from flask import request, redirect, url_for, flash, stream_template, Response
 from flask_login import login_required, current_user
 from app.utils.permissions import require_permission
 
 from app.routes.inventory import inventory_bp
 from app.services.db import get_db_connection
 from app.services.data_manager import load_config, save_config
+from app.services.csrf import generate_csrf_token
 
 logger = logging.getLogger(__name__)
 
@@ -18,21 +19,33 @@ logger = logging.getLogger(__name__)
 @login_required
 @require_permission('inventory.manage')
 def alerts_page():
-    """Manage stock alerts for all items."""
+    """Manage stock alerts for all items.
+    
+    Rows are streamed straight from the cursor into the template instead of
+    being materialized with fetchall(). The connection has to outlive this
+    function, so it is closed when the response finishes streaming.
+    The CSRF token is generated up front: the session cookie goes out with
+    the headers, before the template body (and its csrf_token() calls) runs.
+    """
     conn = get_db_connection()
     try:
         items = conn.execute('''
             SELECT id, name, sku, quantity, alert_enabled, alert_threshold
             FROM inventory_items
             ORDER BY name ASC
-        ''').fetchall()
+        ''')
         
         conf = load_config()
         low_threshold = int(conf.get('LOW_STOCK_THRESHOLD', 5))
         
-        return render_template('inventory/alerts.html', items=items, low_threshold=low_threshold)
-    finally:
+        generate_csrf_token()  # memoized for the template's csrf_token()
+        response = Response(stream_template('inventory/alerts.html', items=items, low_threshold=low_threshold))
+    except Exception:
         conn.close()
+        raise
+    
+    response.call_on_close(conn.close)
+    return response
 
 
 @inventory_bp.route('/alerts/config', methods=['POST'])
@@ -12,6 +12,17 @@ from app.services.db import get_db_connection
 
 logger = logging.getLogger(__name__)
 
+# Display location ("Area / Aisle / Shelf / Bin", empty parts skipped) built in SQL
+# so the scan-path lookups don't have to filter and join the parts per response.
+LOCATION_SQL = """
+    SUBSTR(
+        COALESCE(' / ' || NULLIF(location_area, ''), '') ||
+        COALESCE(' / ' || NULLIF(location_aisle, ''), '') ||
+        COALESCE(' / ' || NULLIF(location_shelf, ''), '') ||
+        COALESCE(' / ' || NULLIF(location_bin, ''), ''),
+    4) AS location
+"""
+
 # Rate limit decorator helper - applied to each API route
 def get_api_limiter():
     """Get limiter with API rate limit (100 per minute per IP)."""
@@ -29,9 +40,8 @@ def match_asin(asin):
     
     conn = get_db_connection()
     try:
-        item = conn.execute('''
-            SELECT id, sku, name, quantity, location_area, location_aisle, 
-                   location_shelf, location_bin 
+        item = conn.execute(f'''
+            SELECT id, sku, name, quantity, {LOCATION_SQL}
             FROM inventory_items 
             WHERE asin = ?
         ''', (asin,)).fetchone()
@@ -44,12 +54,7 @@ def match_asin(asin):
                     "sku": item['sku'],
                     "name": item['name'],
                     "quantity": item['quantity'],
-                    "location": ' / '.join(filter(None, [
-                        item['location_area'],
-                        item['location_aisle'],
-                        item['location_shelf'],
-                        item['location_bin']
-                    ]))
+                    "location": item['location']
                 }
             })
         else:
@@ -94,28 +99,29 @@ def api_add_quantity(item_id):
     if not is_inventory_enabled():
         return jsonify({"error": "Inventory not enabled"}), 400
     
-    data = request.get_json() or {}
+    data = request.get_json(silent=True, cache=True) or {}
     quantity = int(data.get('quantity', 1))
     tracking = data.get('tracking', '')
+    user = session.get('user')
     
     conn = get_db_connection()
     try:
-        conn.execute('''
+        # RETURNING hands back the new quantity, no follow-up SELECT needed
+        item = conn.execute('''
             UPDATE inventory_items 
             SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP
             WHERE id = ?
-        ''', (quantity, item_id))
+            RETURNING quantity
+        ''', (quantity, item_id)).fetchone()
         
         conn.execute('''
             INSERT INTO inventory_transactions 
             (inventory_item_id, quantity_change, reason, user_id, source_tracking)
             VALUES (?, ?, ?, ?, ?)
-        ''', (item_id, quantity, 'Received from Scan', session.get('user'), tracking))
+        ''', (item_id, quantity, 'Received from Scan', user, tracking))
         
         conn.commit()
         
-        item = conn.execute('SELECT quantity FROM inventory_items WHERE id = ?', (item_id,)).fetchone()
-        
         return jsonify({
             "success": True,
             "new_quantity": item['quantity'] if item else 0
@@ -135,9 +141,8 @@ def lookup_sku(sku):
     
     conn = get_db_connection()
     try:
-        item = conn.execute('''
-            SELECT id, sku, name, quantity, image_url, sell_price,
-                   location_area, location_aisle, location_shelf, location_bin
+        item = conn.execute(f'''
+            SELECT id, sku, name, quantity, image_url, sell_price, {LOCATION_SQL}
             FROM inventory_items 
             WHERE sku = ?
         ''', (sku,)).fetchone()
@@ -152,12 +157,7 @@ def lookup_sku(sku):
                     "quantity": item['quantity'],
                     "image_url": item['image_url'],
                     "sell_price": item['sell_price'],
-                    "location": ' / '.join(filter(None, [
-                        item['location_area'],
-                        item['location_aisle'],
-                        item['location_shelf'],
-                        item['location_bin']
-                    ]))
+                    "location": item['location']
                 }
             })
         else:
@@ -172,9 +172,10 @@ def quick_adjust(item_id):
     if not is_inventory_enabled():
         return jsonify({"error": "Inventory not enabled"}), 400
     
-    data = request.get_json() or {}
+    data = request.get_json(silent=True, cache=True) or {}
     change = int(data.get('change', 0))
     action = data.get('action', '')  # 'oos' for mark out of stock
+    user = session.get('user')
     
     conn = get_db_connection()
     try:
@@ -206,7 +207,7 @@ def quick_adjust(item_id):
                 INSERT INTO inventory_transactions 
                 (inventory_item_id, quantity_change, reason, user_id)
                 VALUES (?, ?, ?, ?)
-            ''', (item_id, change, reason, session.get('user')))
+            ''', (item_id, change, reason, user))
         
         conn.commit()
         
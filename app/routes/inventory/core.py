@@ -3,12 +3,13 @@ Inventory Core Module
 Helper functions, before_request hooks, and overview routes.
 """
 import logging
+import time
 from datetime import datetime, date, timedelta
 from flask import request, redirect, url_for, flash, render_template, jsonify
 from flask_login import login_required, current_user
 
 from app.routes.inventory import inventory_bp, CATEGORY_CODES
-from app.services.db import get_db_connection, get_request_db
+from app.services.db import get_db_connection, get_request_db, get_db_path
 from app.services.data_manager import load_config
 
 logger = logging.getLogger(__name__)
@@ -68,6 +69,68 @@ def generate_sku(category='ATO'):
         conn.close()
 
 
+# Name index for fuzzy package -> inventory matching on the scan page.
+# Rebuilt only when the inventory_items signature (count / max id / last update)
+# changes. The signature itself is re-read at most every _NAME_INDEX_RECHECK
+# seconds, or straight away when a lookup finds no match. Held as one immutable
+# (db_path, signature, checked_at, ids, names) tuple and replaced with a single
+# assignment, so concurrent request threads always see ids and names from the
+# same build.
+_NAME_INDEX = None
+_NAME_INDEX_RECHECK = 5  # seconds
+
+
+def _name_index(conn, recheck=False):
+    global _NAME_INDEX
+    index = _NAME_INDEX
+    path = get_db_path()
+    now = time.monotonic()
+    if (not recheck and index is not None and index[0] == path
+            and now - index[2] < _NAME_INDEX_RECHECK):
+        return index
+    
+    signature = tuple(conn.execute(
+        'SELECT count(*), max(id), max(updated_at) FROM inventory_items'
+    ).fetchone())
+    if index is not None and index[0] == path and index[1] == signature:
+        index = (path, signature, now, index[3], index[4])
+    else:
+        rows = conn.execute('SELECT id, LOWER(name) FROM inventory_items').fetchall()
+        index = (path, signature, now, tuple(r[0] for r in rows), tuple(r[1] or '' for r in rows))
+    _NAME_INDEX = index
+    return index
+
+
+def match_inventory_by_name(name, conn, score_cutoff=80):
+    """Return the id of the inventory item whose name best matches `name`, or None.
+    
+    Uses RapidFuzz WRatio (handles truncation / word reordering / typos) over a
+    cached name list. Falls back to a name-prefix LIKE if RapidFuzz is unavailable.
+    """
+    name = (name or '').strip().lower()
+    if not name:
+        return None
+    
+    try:
+        from rapidfuzz import process, fuzz
+    except ImportError:
+        prefix = name[:30].rstrip('.').rstrip()
+        row = conn.execute(
+            'SELECT id FROM inventory_items WHERE LOWER(name) LIKE ? LIMIT 1', (f'{prefix}%',)
+        ).fetchone()
+        return row['id'] if row else None
+    
+    _, _, _, ids, names = _name_index(conn)  # one snapshot for both lists
+    best = process.extractOne(name, names, scorer=fuzz.WRatio, score_cutoff=score_cutoff)
+    if best is None:
+        # No match: make sure it isn't just an item added since the last check
+        _, _, _, fresh_ids, fresh_names = _name_index(conn, recheck=True)
+        if fresh_names is not names:
+            ids, names = fresh_ids, fresh_names
+            best = process.extractOne(name, names, scorer=fuzz.WRatio, score_cutoff=score_cutoff)
+    return ids[best[2]] if best else None
+
+
 def validate_location(area, aisle, shelf, bin_loc):
     """Validate that at least one location field is provided."""
     return any([area, aisle, shelf, bin_loc])
@@ -313,7 +376,7 @@ def overview():
             FROM inventory_transactions 
             WHERE quantity_change < 0 
               AND reason = 'Sold/Consumed'
-              AND date(created_at) >= ?
+              AND created_at >= ?
             GROUP BY date(created_at)
         ''', (thirty_days_ago,)).fetchall()
         
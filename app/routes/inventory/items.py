@@ -14,6 +14,7 @@ from app.utils.permissions import require_permission
 from werkzeug.utils import secure_filename
 import base64
 import uuid
+import urllib3
 
 from app.routes.inventory import inventory_bp, CATEGORY_CODES
 from app.routes.inventory.core import generate_sku, validate_location
@@ -26,6 +27,10 @@ logger = logging.getLogger(__name__)
 MAX_IMAGE_SIZE = (1280, 720)  # Max resolution (720p)
 JPEG_QUALITY = 85
 
+# Shared keep-alive pool for stock alert webhooks (Discord/Slack), so repeated
+# alerts reuse the TCP/TLS connection instead of handshaking on every POST.
+_webhook_http = urllib3.PoolManager(num_pools=4, maxsize=8, retries=False, timeout=5.0)
+
 
 def optimize_image(image_data, max_size=MAX_IMAGE_SIZE, quality=JPEG_QUALITY):
     """
@@ -972,6 +977,7 @@ def adjust_quantity(item_id):
     quantity_change = int(request.form.get('quantity_change', 0))
     reason = request.form.get('reason', 'Sold/Consumed').strip()
     source_tracking = request.form.get('source_tracking', '').strip() or None
+    user = session.get('user')
     
     if quantity_change == 0:
         flash("No change specified.")
@@ -986,17 +992,20 @@ def adjust_quantity(item_id):
                 conn.close()
                 return redirect(request.referrer or url_for('inventory.list_items'))
         
-        conn.execute('''
+        # RETURNING gives the post-update row for the stock alert check below,
+        # so there is no separate SELECT after the commit
+        item = conn.execute('''
             UPDATE inventory_items 
             SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP
             WHERE id = ?
-        ''', (quantity_change, item_id))
+            RETURNING name, sku, quantity, alert_enabled, alert_threshold
+        ''', (quantity_change, item_id)).fetchone()
         
         conn.execute('''
             INSERT INTO inventory_transactions 
             (inventory_item_id, quantity_change, reason, user_id, source_tracking)
             VALUES (?, ?, ?, ?, ?)
-        ''', (item_id, quantity_change, reason, session.get('user'), source_tracking))
+        ''', (item_id, quantity_change, reason, user, source_tracking))
         
         conn.commit()
         
@@ -1005,11 +1014,6 @@ def adjust_quantity(item_id):
             from app.services.data_manager import load_config
             from app.utils.helpers import reveal_string
             
-            item = conn.execute('''
-                SELECT name, sku, quantity, alert_enabled, alert_threshold 
-                FROM inventory_items WHERE id = ?
-            ''', (item_id,)).fetchone()
-            
             if item and item['alert_enabled']:
                 new_qty = item['quantity']
                 threshold = item['alert_threshold'] or 0
@@ -1042,9 +1046,6 @@ def adjust_quantity(item_id):
                     if conf.get('WEBHOOK_ENABLED_INVENTORY') and conf.get('WEBHOOK_URL_INVENTORY'):
                         def send_stock_alert():
                             try:
-                                import urllib.request
-                                import json
-                                
                                 url = reveal_string(conf['WEBHOOK_URL_INVENTORY'], conf.get('SECRET_KEY', 'dev_key'))
                                 if not url.startswith('http'):
                                     return
@@ -1053,12 +1054,13 @@ def adjust_quantity(item_id):
                                 msg = f"📦 **{status}**: {item['name']} (SKU: {item['sku']})"
                                 
                                 payload = {"content": msg, "text": msg}
-                                req = urllib.request.Request(
-                                    url,
-                                    data=json.dumps(payload).encode('utf-8'),
+                                resp = _webhook_http.request(
+                                    'POST', url,
+                                    body=json.dumps(payload).encode('utf-8'),
                                     headers={'Content-Type': 'application/json', 'User-Agent': 'RSCP-Bot'}
                                 )
-                                urllib.request.urlopen(req, timeout=5)
+                                if resp.status >= 400:
+                                    raise urllib3.exceptions.HTTPError(f"HTTP Error {resp.status}")
                                 logger.info(f"Stock alert sent for {item['sku']}")
                             except Exception as e:
                                 logger.error(f"Stock alert webhook error: {e}")
@@ -1092,9 +1094,10 @@ def add_stock(item_id):
             qty_to_add = int(request.form.get('qty', 1))
             tracking = request.form.get('tracking', '')
             
-            new_qty = item['quantity'] + qty_to_add
-            conn.execute('UPDATE inventory_items SET quantity = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                         (new_qty, item_id))
+            # Increment in SQL and commit both writes together; the row read
+            # above is only for the GET form, not re-used for the new quantity
+            conn.execute('UPDATE inventory_items SET quantity = quantity + ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (qty_to_add, item_id))
             
             conn.execute('''
                 INSERT INTO inventory_transactions (inventory_item_id, quantity_change, reason, source_tracking)
@@ -1,11 +1,11 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, g, current_app
-from werkzeug.security import check_password_hash, generate_password_hash
 import datetime
 import os
 import time
 import json
 import secrets
 import logging
+from urllib.parse import urlparse
 
 logger = logging.getLogger(__name__)
 
@@ -13,29 +13,128 @@ from flask_login import current_user, login_required
 from app.utils.permissions import has_permission
 
 # DB Services
-from app.services.db import get_db_connection, DB_PATH, get_request_db
-from app.services.auth import create_user, BASE_DIR # load_users shim used for login selection
+from app.services.db import get_db_connection, DB_PATH, get_request_db, write_transaction
+from app.services.auth import create_user, hash_password, has_users, BASE_DIR # load_users shim used for login selection
 from app.services.data_manager import (
     get_dashboard_stats, sync_manifest, log_receipt, load_config, MANIFEST_FILE,
-    get_scan_count, get_file_age, check_history
+    get_scan_count, get_file_age, check_history, get_analytics_stats,
+    get_cached_stats, invalidate_stats_cache
 )
 from app.utils.helpers import sanitize_for_csv
+from app.routes.inventory.core import match_inventory_by_name
 from app.services.file_handler import atomic_write # Still used for config?
 from app.services.logger import log_error
 
 main_bp = Blueprint('main', __name__)
 CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+# Rows per page for the returns / refunded / past due lists
+PAGE_SIZE = 100
+
+# History page SQL: one frozen query per filter combination, built at import so
+# every request reuses an identical (statement-cached) string.
+# Display fallbacks and the "Qty: N" extraction are done in SQL so rows
+# go straight to the template without a per-row Python pass.
+_HISTORY_BASE = '''
+    SELECT h.timestamp as Timestamp, h.action,
+           COALESCE(u.username, 'Unknown') as User,
+           COALESCE(p.tracking_number, 'Deleted Package') as Tracking,
+           COALESCE(p.item_name, 'Unknown') as ItemName,
+           CASE WHEN instr(h.details, 'Qty:') > 0 THEN
+               CASE WHEN instr(substr(h.details, instr(h.details, ': ') + 2), ': ') > 0
+                    THEN substr(substr(h.details, instr(h.details, ': ') + 2), 1,
+                                instr(substr(h.details, instr(h.details, ': ') + 2), ': ') - 1)
+                    ELSE substr(h.details, instr(h.details, ': ') + 2) END
+           ELSE '1' END as Quantity
+    FROM history h
+    LEFT JOIN users u ON h.user_id = u.id
+    LEFT JOIN packages p ON h.package_id = p.id
+    WHERE 1=1
+'''
+# Bit order: start_date, end_date, user_filter, search_term
+_HISTORY_FILTERS = (
+    " AND date(h.timestamp) >= ?",
+    " AND date(h.timestamp) <= ?",
+    " AND u.username = ?",
+    " AND (p.tracking_number LIKE ? OR p.item_name LIKE ?)",
+)
+_HISTORY_TODAY = " AND date(h.timestamp, 'localtime') = date('now', 'localtime')"
+
+def _build_history_sql():
+    queries = {}
+    for mask in range(1 << len(_HISTORY_FILTERS)):
+        clauses = ''.join(c for bit, c in enumerate(_HISTORY_FILTERS) if mask & (1 << bit))
+        # Only Limit if No Filters (to show full search results); 500 is a safety cap for search
+        limit = " ORDER BY h.timestamp DESC LIMIT 500" if mask else " ORDER BY h.timestamp DESC LIMIT 100"
+        queries[(mask, False)] = _HISTORY_BASE + clauses + limit
+        queries[(mask, True)] = _HISTORY_BASE + clauses + _HISTORY_TODAY + limit
+    return queries
+
+HISTORY_SQL = _build_history_sql()
+
+# Receive-mode scan result defaults; each POST overrides only what it found
+_SCAN_CONTEXT = {
+    'mode': 'receive',
+    'message': "Scan Failed",
+    'color': "",
+    'items': (),
+    'priority_alert': False,
+    'inventory_enabled': False,
+    'inventory_match': None,
+}
+
+def _page_args():
+    """Return (page, offset) from the ?page= query arg (1-based)."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    return page, (page - 1) * PAGE_SIZE
+
+# Longest carrier tracking number we try to find inside a long barcode scan
+MAX_TRACKING_SUFFIX = 40
+_SUFFIX_SLOTS = MAX_TRACKING_SUFFIX - 6  # suffixes of 7+ chars
+
+# Scan-path SQL, built once at import. Passing the same strings on every scan
+# lets sqlite3's per-connection statement cache skip re-parsing them.
+SCAN_SQL = {
+    'pkg_by_tracking': """
+        SELECT p.*, EXISTS(SELECT 1 FROM history h WHERE h.package_id = p.id) AS in_history
+        FROM packages p WHERE p.tracking_number = ? COLLATE NOCASE
+    """,
+    # Fixed number of slots (unused ones bound to NULL) so the text never changes
+    'pkg_by_suffix': f"""
+        SELECT p.*, EXISTS(SELECT 1 FROM history h WHERE h.package_id = p.id) AS in_history
+        FROM packages p
+        WHERE p.tracking_number = (
+            SELECT tracking_number FROM packages
+            WHERE tracking_number COLLATE NOCASE IN ({','.join('?' * _SUFFIX_SLOTS)})
+            ORDER BY length(tracking_number) DESC
+            LIMIT 1
+        )
+    """,
+    # Package SKU (from Manifest) or product mapping, then ASIN; strongest match wins
+    'inv_match': """
+        WITH target AS (
+            SELECT COALESCE(
+                NULLIF(:sku, ''),
+                (SELECT inventory_sku FROM product_mappings WHERE package_name = :name LIMIT 1)
+            ) AS sku
+        )
+        SELECT id, name, sku, quantity, image_url FROM (
+            SELECT i.id, i.name, i.sku, i.quantity, i.image_url, 0 AS match_rank
+            FROM inventory_items i, target t WHERE i.sku = t.sku
+            UNION ALL
+            SELECT id, name, sku, quantity, image_url, 1
+            FROM inventory_items WHERE :asin != '' AND asin = :asin
+        )
+        ORDER BY match_rank
+        LIMIT 1
+    """,
+    'inv_by_id': "SELECT id, name, sku, quantity, image_url FROM inventory_items WHERE id = ?",
+}
 
 @main_bp.route('/')
 def index():
     # Setup Check (Check if users table has admin?)
-    conn = get_db_connection()
-    try:
-        user_count = conn.execute("SELECT count(*) as c FROM users").fetchone()['c']
-        if user_count == 0:
-            return redirect(url_for('main.setup_wizard'))
-    finally:
-        conn.close()
+    if not has_users(get_request_db()):
+        return redirect(url_for('main.setup_wizard'))
     
     if not current_user.is_authenticated:
         logger.info(f"[Index] No user in session. Redirecting to login.")
@@ -56,9 +155,9 @@ def receiving_dashboard():
         flash("You don't have access to the Receiving module.")
         return redirect(url_for('main.index'))
     
-    stats = get_dashboard_stats()
-    scans = get_scan_count(14)
-    m_age = get_file_age(MANIFEST_FILE)
+    stats = get_cached_stats(get_dashboard_stats)
+    scans = get_cached_stats(get_scan_count, 14)
+    m_age = get_cached_stats(get_file_age, MANIFEST_FILE)
     
     refresh_info = []
     if m_age == 999:
@@ -74,18 +173,14 @@ def receiving_dashboard():
 @main_bp.route('/setup', methods=['GET', 'POST'])
 def setup_wizard():
     # Check if users exist to prevent re-setup
-    conn = get_db_connection()
-    try:
-        if conn.execute("SELECT count(*) as c FROM users").fetchone()['c'] > 0:
-            return redirect(url_for('auth.login'))
-    finally:
-        conn.close()
+    if has_users(get_request_db()):
+        return redirect(url_for('auth.login'))
     
     if request.method == 'POST':
         # Save Config
         config_data = {
             "ORG_NAME": request.form.get('org_name', ''),
-            "ADMIN_HASH": generate_password_hash(request.form.get('admin_pass')),
+            "ADMIN_HASH": hash_password(request.form.get('admin_pass')),
             "SECRET_KEY": secrets.token_hex(16),
             "AUTO_TRIM": False
         }
@@ -122,11 +217,15 @@ def report_issue():
     flash("Issue Reported. Admins have been notified.")
     # Redirect back to source if valid, otherwise index
     # Security: Validate redirect URL to prevent open redirect attacks
-    from urllib.parse import urlparse
     if source_url:
+        # Common case: a site-relative path needs no parsing ('//' and '/\\' are
+        # protocol-relative to browsers, so they go through the full check)
+        if source_url.startswith('/') and not source_url.startswith(('//', '/\\')):
+            return redirect(source_url)
         parsed = urlparse(source_url)
-        # Only allow same-origin redirects (no host means relative URL)
-        if parsed.netloc == '' or parsed.netloc == urlparse(request.host_url).netloc:
+        # Only allow same-origin redirects (no host means relative URL;
+        # request.host is the host_url netloc without re-parsing it)
+        if parsed.netloc == request.host or (parsed.netloc == '' and not source_url.startswith('/\\')):
             return redirect(source_url)
     return redirect(url_for('main.index'))
 
@@ -144,6 +243,9 @@ def scan_page_legacy():
         # Extracting logic is best, but for now, inline.
         
         conn = get_request_db()
+        # Read config once per scan (inventory SKU lookup + inventory match below)
+        config = load_config()
+        inv_enabled = config.get('INVENTORY_ENABLED', False) if config else False
         msg = "Scan Failed"
         color = ""
         items = []
@@ -158,44 +260,31 @@ def scan_page_legacy():
 
             
             # 2. Try Exact Match (Case Insensitive)
-            rows = conn.execute("SELECT * FROM packages WHERE tracking_number = ? COLLATE NOCASE", (tracking_clean,)).fetchall()
+            # in_history folds the duplicate check into the same round-trip
+            rows = conn.execute(SCAN_SQL['pkg_by_tracking'], (tracking_clean,)).fetchall()
 
             
-            # 3. Fallback: Substring Search (for FedEx/Long barcodes)
+            # 3. Fallback: Suffix Search (for FedEx/Long barcodes)
+            # The real tracking number is usually at the END of the scan, so look up
+            # every suffix (7+ chars) by equality on the NOCASE index instead of
+            # scanning the whole table with instr(). Longest suffix wins.
             if not rows and len(tracking_clean) > 8:
-                # Find valid tracking numbers that are substrings of the scan OR vice versa
-                # Reverse check: Is the DB tracking inside the Scan?
-                candidates = conn.execute("""
-                    SELECT * FROM packages 
-                    WHERE length(tracking_number) > 5 
-                    AND instr(UPPER(?), UPPER(tracking_number)) > 0
-                """, (tracking_clean,)).fetchall()
-                
-                best_match = None
-                for c in candidates:
-                    t = c['tracking_number']
-                    # Pick the longest match that is at the END of the scan (common barcode format)
-                    if len(t) > 6:
-                        # Check strict suffix first
-                        if tracking_clean.upper().endswith(t.upper()):
-                             if best_match is None or len(t) > len(best_match['tracking_number']):
-                                 best_match = c
+                scan = tracking_clean[-MAX_TRACKING_SUFFIX:]
+                suffixes = [scan[i:] for i in range(len(scan) - 6)]
+                suffixes += [None] * (_SUFFIX_SLOTS - len(suffixes))
+                rows = conn.execute(SCAN_SQL['pkg_by_suffix'], suffixes).fetchall()
                 
-                if best_match:
+                if rows:
                     # Found a match from the long string!
-                    real_tracking = best_match['tracking_number']
-                    # Fetch ALL items for this found tracking number
-                    rows = conn.execute("SELECT * FROM packages WHERE tracking_number = ?", (real_tracking,)).fetchall()
                     # Update tracking variable for logging references
-                    tracking = real_tracking
+                    tracking = rows[0]['tracking_number']
             
             # Logic: Receive
             if not rows:
                  # Inventory Lookup (Legacy)
                  inv_item = None
                  try:
-                     conf = load_config()
-                     if conf and conf.get('INVENTORY_ENABLED'):
+                     if inv_enabled:
                          from app.routes.inventory import get_inventory_item
                          inv_item = get_inventory_item(tracking, conn=conn)
                  except Exception as e:
@@ -218,9 +307,12 @@ def scan_page_legacy():
                      color = "#ff6961" # Red
             
             else:
+                # packages columns (some are added by migrations), from this result
+                pkg_cols = rows[0].keys()
+                
                 # Check status BEFORE processing (to detect duplicates)
                 all_received = all(r['date_scanned'] for r in rows)
-                already_in_history = check_history(tracking, conn=conn)
+                already_in_history = any(r['in_history'] for r in rows)
                 
                 if all_received and already_in_history:
                      msg = f"Duplicate: {len(rows)} Items"
@@ -231,7 +323,7 @@ def scan_page_legacy():
                      log_receipt(tracking, rows[0]['item_name'], str(rows[0]['quantity']), current_user.username, conn=conn)
                      
                      # Check Priority (If ANY item is priority)
-                     is_priority = any((r['priority'] for r in rows if 'priority' in r.keys() and r['priority']))
+                     is_priority = any(r['priority'] for r in rows)
                      
                      if is_priority:
                          msg = "PRIORITY RECEIVED"
@@ -240,7 +332,9 @@ def scan_page_legacy():
                          msg = f"Received: {len(rows)} Items"
                          color = "#77dd77" # Green
                 
-                # Build Item List
+                # Build Item List (optional columns resolved once per process, not per row)
+                has_asin = 'asin' in pkg_cols
+                has_source_url = 'source_url' in pkg_cols
                 items = []
                 for r in rows:
                     items.append({
@@ -249,8 +343,8 @@ def scan_page_legacy():
                         "subtext": tracking,
                         "qty": r['quantity'] or 1,
                         "image_url": r['image_url'],
-                        "asin": r['asin'] if 'asin' in r.keys() else '',
-                        "source_url": r['source_url'] if 'source_url' in r.keys() else ''
+                        "asin": r['asin'] if has_asin else '',
+                        "source_url": r['source_url'] if has_source_url else ''
                     })
             
         except Exception as e:
@@ -262,8 +356,6 @@ def scan_page_legacy():
         
         # Check if inventory is enabled for Add to Inventory button
         inventory_match = None
-        config = load_config()
-        inv_enabled = config.get('INVENTORY_ENABLED', False) if config else False
         
         # V1.16.1: Check if received package matches existing inventory item
         if inv_enabled and color == "#77dd77" and items:
@@ -271,49 +363,28 @@ def scan_page_legacy():
                 pkg_asin = items[0].get('asin', '') or ''
                 pkg_name = items[0].get('name', '') or ''
                 
-                # 1. Try SKU Match (if package has one from Manifest or Mapping)
-                # We need to fetch the SKU from the package row we just fetched if it exists
-                pkg_sku = None
-                if rows and 'sku' in rows[0].keys():
-                    pkg_sku = rows[0]['sku']
+                pkg_sku = rows[0]['sku'] if 'sku' in pkg_cols else None
+                match = conn.execute(SCAN_SQL['inv_match'], {
+                    'sku': pkg_sku or '',
+                    'name': pkg_name,
+                    'asin': pkg_asin.strip(),
+                }).fetchone()
                 
-                # If no SKU on package, check product_mappings (Real-time check)
-                if not pkg_sku:
-                    mapping = conn.execute("SELECT inventory_sku FROM product_mappings WHERE package_name = ?", (pkg_name,)).fetchone()
-                    if mapping: pkg_sku = mapping['inventory_sku']
-
-                if pkg_sku:
-                    match = conn.execute("SELECT id, name, sku, quantity, image_url FROM inventory_items WHERE sku = ?", (pkg_sku,)).fetchone()
-                    if match:
-                        inventory_match = dict(match)
-
-                # 2. Try ASIN match (exact)
-                if not inventory_match and pkg_asin and pkg_asin.strip():
-                    match = conn.execute(
-                        "SELECT id, name, sku, quantity, image_url FROM inventory_items WHERE asin = ?",
-                        (pkg_asin.strip(),)
-                    ).fetchone()
-                    if match:
-                        inventory_match = dict(match)
+                # Fall back to a fuzzy name match (handles truncated / reordered names)
+                if not match:
+                    item_id = match_inventory_by_name(pkg_name, conn)
+                    if item_id:
+                        match = conn.execute(SCAN_SQL['inv_by_id'], (item_id,)).fetchone()
                 
-                # 3. Try name match (fuzzy - case insensitive contains)
-                if not inventory_match and pkg_name and pkg_name.strip():
-                    # Use first 30 chars for matching (handles truncated names)
-                    search_prefix = pkg_name[:30].lower().rstrip('.').rstrip()
-                    match = conn.execute(
-                        """SELECT id, name, sku, quantity, image_url FROM inventory_items 
-                           WHERE LOWER(name) LIKE ? 
-                           LIMIT 1""",
-                        (f'{search_prefix}%',)
-                    ).fetchone()
-                    if match:
-                        inventory_match = dict(match)
+                # Row is mapping-compatible; the template only reads a few fields
+                inventory_match = match
             except Exception as e:
                 logger.error(f"Error checking inventory match: {e}")
             
-        return render_template('scan.html', message=msg, color=color, items=items, mode='receive', 
-                               priority_alert=is_priority, inventory_enabled=inv_enabled,
-                               inventory_match=inventory_match)
+        context = dict(_SCAN_CONTEXT, message=msg, color=color, items=items,
+                       priority_alert=is_priority, inventory_enabled=inv_enabled,
+                       inventory_match=inventory_match)
+        return render_template('scan.html', **context)
         
     return scan_page('receive') 
 
@@ -331,12 +402,10 @@ def handle_scan():
 @main_bp.route('/api/dashboard_stats')
 @login_required
 def api_dashboard_stats():
-    from app.services.data_manager import get_dashboard_stats, get_scan_count, get_analytics_stats
-    
     return {
-        "stats": get_dashboard_stats(),
-        "scans": get_scan_count(14),
-        "graph": get_analytics_stats(14)
+        "stats": get_cached_stats(get_dashboard_stats),
+        "scans": get_cached_stats(get_scan_count, 14),
+        "graph": get_cached_stats(get_analytics_stats, 14)
     }
     
     data = request.json
@@ -369,69 +438,39 @@ def api_dashboard_stats():
 @login_required
 def history_view():
     
-    conn = get_db_connection()
+    conn = get_request_db()
     try:
         # Fetch Users for Filter
         user_list = conn.execute("SELECT username FROM users ORDER BY username").fetchall()
         users = [u['username'] for u in user_list]
         
-        # Base Query
-        query = '''
-            SELECT h.timestamp as Timestamp, h.action, u.username as User, p.tracking_number as Tracking, p.item_name as ItemName, h.details
-            FROM history h
-            LEFT JOIN users u ON h.user_id = u.id
-            LEFT JOIN packages p ON h.package_id = p.id
-            WHERE 1=1
-        '''
-        params = []
-        
         # Filters
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         user_filter = request.args.get('user_filter')
         search_term = request.args.get('search_term')
         
-        if start_date:
-            query += " AND date(h.timestamp) >= ?"
-            params.append(start_date)
-        if end_date:
-            query += " AND date(h.timestamp) <= ?"
-            params.append(end_date)
-        if user_filter:
-            query += " AND u.username = ?"
-            params.append(user_filter)
-        if search_term:
-            query += " AND (p.tracking_number LIKE ? OR p.item_name LIKE ?)"
-            params.append(f"%{search_term}%")
-            params.append(f"%{search_term}%")
-            
-        if request.args.get('filter') == 'today': # Legacy support / specific button
-             query += " AND date(h.timestamp, 'localtime') = date('now', 'localtime')"
-
-        # Only Limit if No Filters (to show full search results)
-        if not (start_date or end_date or user_filter or search_term):
-            query += " ORDER BY h.timestamp DESC LIMIT 100"
-        else:
-            query += " ORDER BY h.timestamp DESC LIMIT 500" # Safety cap for search
-
-        rows = conn.execute(query, params).fetchall()
+        # Pick the prebuilt query for this filter combination; params follow
+        # the same order as _HISTORY_FILTERS
+        mask = 0
+        params = []
+        for bit, value in enumerate((start_date, end_date, user_filter, search_term)):
+            if value:
+                mask |= 1 << bit
+                if bit == 3:
+                    params += [f"%{value}%", f"%{value}%"]
+                else:
+                    params.append(value)
         
-        history = []
-        for r in rows:
-            history.append({
-                "Timestamp": r['Timestamp'],
-                "User": r['User'] or "Unknown",
-                "Tracking": r['Tracking'] or "Deleted Package",
-                "ItemName": r['ItemName'] or "Unknown",
-                "Quantity": r['details'].split(': ')[1] if r['details'] and 'Qty:' in r['details'] else '1' # Extract simple qty or pass details
-            })
+        today_only = request.args.get('filter') == 'today' # Legacy support / specific button
+        query = HISTORY_SQL[(mask, today_only)]
+
+        history = conn.execute(query, params).fetchall()
             
         return render_template('history.html', history=history, users=users)
     except Exception as e:
         logger.error(f"History Error: {e}")
         return render_template('history.html', history=[], users=[])
-    finally:
-        conn.close()
 
 @main_bp.route('/return_mode', methods=['GET', 'POST'])
 @login_required
@@ -440,60 +479,38 @@ def return_mode():
     message = None
     candidates = []
     
-    conn = get_db_connection()
-    try:
-        if request.args.get('track'):
-            t = request.args.get('track')
-            item = conn.execute("SELECT * FROM packages WHERE tracking_number=?", (t,)).fetchone()
-            if item:
-                found_item = dict(item)
-                found_item['tracking'] = item['tracking_number']
-                found_item['name'] = item['item_name']
-
-        elif request.method == 'POST':
-            search_term = request.form.get('search_term', '').strip()
-            if search_term:
-                # Search by Name or Tracking
-                st = f"%{search_term}%"
-                rows = conn.execute('''
-                    SELECT * FROM packages 
-                    WHERE (item_name LIKE ? OR tracking_number LIKE ?)
-                    AND status NOT IN ('refunded', 'return_pending')
-                ''', (st, st)).fetchall()
-                
-                if len(rows) == 1:
-                    item = rows[0]
-                    found_item = dict(item)
-                    found_item['tracking'] = item['tracking_number']
-                    found_item['name'] = item['item_name']
-                elif len(rows) > 1:
-                    candidates = []
-                    for r in rows:
-                        c = dict(r)
-                        c['tracking'] = r['tracking_number']
-                        c['name'] = r['item_name']
-                        candidates.append(c)
-                    message = f"Found {len(candidates)} matches. Please select one."
-                else:
-                    message = "Item not found."
-
-        # Recent Items
-        recents = conn.execute('''
-            SELECT * FROM packages 
-            WHERE status NOT IN ('return_pending', 'refunded') 
-            ORDER BY date_expected DESC LIMIT 50
-        ''').fetchall()
-        
-        recent_items = []
-        for r in recents:
-            row = dict(r)
-            row['tracking'] = row['tracking_number']
-            row['name'] = row['item_name']
-            row['date'] = row['date_expected']
-            recent_items.append(row)
-            
-    finally:
-        conn.close()
+    conn = get_request_db()
+    if request.args.get('track'):
+        t = request.args.get('track')
+        found_item = conn.execute(
+            "SELECT item_name AS name, tracking_number AS tracking FROM packages WHERE tracking_number=?", (t,)
+        ).fetchone()
+
+    elif request.method == 'POST':
+        search_term = request.form.get('search_term', '').strip()
+        if search_term:
+            # Search by Name or Tracking
+            st = f"%{search_term}%"
+            rows = conn.execute('''
+                SELECT item_name AS name, tracking_number AS tracking FROM packages 
+                WHERE (item_name LIKE ? OR tracking_number LIKE ?)
+                AND status NOT IN ('refunded', 'return_pending')
+            ''', (st, st)).fetchall()
+
+            if len(rows) == 1:
+                found_item = rows[0]
+            elif len(rows) > 1:
+                candidates = rows
+                message = f"Found {len(candidates)} matches. Please select one."
+            else:
+                message = "Item not found."
+
+    # Recent Items (served from idx_pkg_returnable_expected)
+    recent_items = conn.execute('''
+        SELECT item_name AS name, tracking_number AS tracking, date_expected AS date FROM packages 
+        WHERE status NOT IN ('return_pending', 'refunded') 
+        ORDER BY date_expected DESC LIMIT 50
+    ''').fetchall()
 
     return render_template('return_mode.html', item=found_item, message=message, candidates=candidates, recent_items=recent_items)
 
@@ -505,106 +522,95 @@ def process_return():
     reason = request.form.get('reason')
     
     if original_tracking:
-        conn = get_db_connection()
+        conn = get_request_db()
         try:
-             conn.execute('''
-                 UPDATE packages SET 
-                 status='return_pending'
-                 WHERE tracking_number=?
-             ''', (original_tracking,))
-             # Store reason? (packages doesn't have reason column, HistoryLog does!)
-             # We should log this action.
-             
-             # Need package ID
-             res = conn.execute("SELECT id FROM packages WHERE tracking_number=?", (original_tracking,)).fetchone()
-             if res:
-                 pid = res['id']
-                 conn.execute('''
-                     INSERT INTO history (package_id, user_id, action, details)
-                     VALUES (?, (SELECT id FROM users WHERE username=?), ?, ?)
-                 ''', (pid, session.get('user'), 'return_initiated', f"Reason: {reason}, New Track: {return_tracking}"))
-                 
-             conn.commit()
-             flash("Return Initiated")
+            # One write transaction: status update + history row built from the
+            # same package lookup (no SELECT id round-trip in between)
+            with write_transaction(conn):
+                conn.execute("UPDATE packages SET status='return_pending' WHERE tracking_number=?", (original_tracking,))
+                conn.execute('''
+                    INSERT INTO history (package_id, user_id, action, details)
+                    SELECT id, (SELECT id FROM users WHERE username=?), 'return_initiated', ?
+                    FROM packages WHERE tracking_number=?
+                ''', (session.get('user'), f"Reason: {reason}, New Track: {return_tracking}", original_tracking))
+            invalidate_stats_cache()
+            flash("Return Initiated")
         except Exception as e:
+            logger.error(f"Error initiating return for {original_tracking}: {e}")
             flash(f"Error: {e}")
-        finally:
-            conn.close()
             
     return redirect(url_for('main.return_mode'))
 
 @main_bp.route('/mark_refunded/<tracking>', methods=['POST'])
 @login_required
 def mark_refunded(tracking):
-    conn = get_db_connection()
+    conn = get_request_db()
     try:
-        today = datetime.datetime.now().strftime('%Y-%m-%d')
-        conn.execute("UPDATE packages SET status='refunded', refund_date=? WHERE tracking_number=?", (today, tracking))
-        
-        # Log Logic?
-        res = conn.execute("SELECT id FROM packages WHERE tracking_number=?", (tracking,)).fetchone()
-        if res:
-             conn.execute("INSERT INTO history (package_id, user_id, action) VALUES (?, (SELECT id FROM users WHERE username=?), 'refunded')", 
-                          (res['id'], session.get('user')))
-        conn.commit()
+        with write_transaction(conn):
+            # Local date computed by SQLite, same value as datetime.now() on this host
+            conn.execute("UPDATE packages SET status='refunded', refund_date=date('now', 'localtime') WHERE tracking_number=?", (tracking,))
+            conn.execute('''
+                INSERT INTO history (package_id, user_id, action)
+                SELECT id, (SELECT id FROM users WHERE username=?), 'refunded'
+                FROM packages WHERE tracking_number=?
+            ''', (session.get('user'), tracking))
+        invalidate_stats_cache()
     except Exception as e:
-        print(e)
-    finally:
-         conn.close()
+        logger.error(f"Error marking {tracking} refunded: {e}")
+        flash(f"Error: {e}")
     return redirect(url_for('main.open_returns_view'))
 
 @main_bp.route('/open_returns')
 @login_required
 def open_returns_view():
-    conn = get_db_connection()
-    try:
-        # We need join to get recent return reason?
-        # Or did we add columns to Package? We didn't. 
-        # History table has the reason.
-        # Complex query: Get package, and Latest 'return_initiated' history log.
-        # Simplification: Just show package name/tracking for now.
-        
-        rows = conn.execute("SELECT * FROM packages WHERE status='return_pending'").fetchall()
-        items = []
-        for r in rows:
-            items.append({
-                "name": r['item_name'], 
-                "tracking": r['tracking_number'],
-                "reason": "Check History", # Or fetch history
-                "return_track": ""
-            })
-        return render_template('open_returns.html', items=items)
-    finally:
-        conn.close()
+    conn = get_request_db()
+    # We need join to get recent return reason?
+    # Or did we add columns to Package? We didn't. 
+    # History table has the reason.
+    # Complex query: Get package, and Latest 'return_initiated' history log.
+    # Simplification: Just show package name/tracking for now.
+
+    page, offset = _page_args()
+    rows = conn.execute('''
+        SELECT item_name AS name, tracking_number AS tracking, 'Check History' AS reason, '' AS return_track
+        FROM packages WHERE status='return_pending'
+        ORDER BY id LIMIT ? OFFSET ?
+    ''', (PAGE_SIZE + 1, offset)).fetchall()
+    return render_template('open_returns.html', items=rows[:PAGE_SIZE], page=page, has_next=len(rows) > PAGE_SIZE)
 
 @main_bp.route('/refunded_log')
 @login_required
 def refunded_view():
-    conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM packages WHERE status='refunded' ORDER BY refund_date DESC").fetchall()
-    items = [{"name": r['item_name'], "tracking": r['tracking_number'], "date": r['refund_date']} for r in rows]
-    conn.close()
-    return render_template('refunded.html', items=items)
+    conn = get_request_db()
+    page, offset = _page_args()
+    rows = conn.execute('''
+        SELECT item_name AS name, tracking_number AS tracking, refund_date AS date
+        FROM packages WHERE status='refunded'
+        ORDER BY refund_date DESC LIMIT ? OFFSET ?
+    ''', (PAGE_SIZE + 1, offset)).fetchall()
+    return render_template('refunded.html', items=rows[:PAGE_SIZE], page=page, has_next=len(rows) > PAGE_SIZE)
 
 @main_bp.route('/past_due')
 @login_required
 def past_due_view():
-    conn = get_db_connection()
-    rows = conn.execute("SELECT * FROM packages WHERE status='past_due' AND date_scanned IS NULL").fetchall()
-    items = [{"name": r['item_name'], "tracking": r['tracking_number'], "date": r['date_expected']} for r in rows]
-    conn.close()
-    return render_template('past_due.html', items=items)
+    conn = get_request_db()
+    page, offset = _page_args()
+    rows = conn.execute('''
+        SELECT item_name AS name, tracking_number AS tracking, date_expected AS date
+        FROM packages WHERE status='past_due' AND date_scanned IS NULL
+        ORDER BY id LIMIT ? OFFSET ?
+    ''', (PAGE_SIZE + 1, offset)).fetchall()
+    return render_template('past_due.html', items=rows[:PAGE_SIZE], page=page, has_next=len(rows) > PAGE_SIZE)
 
 @main_bp.route('/expected')
 @login_required
 def expected_view():
     from app.utils.helpers import guess_shipper
-    conn = get_db_connection()
-    today = datetime.date.today().strftime('%Y-%m-%d')
+    conn = get_request_db()
+    today = datetime.date.today().isoformat()
     # Filter for TODAY only, matching dashboard
     rows = conn.execute("SELECT * FROM packages WHERE status IN ('expected','on_time') AND date_scanned IS NULL AND date_expected = ?", (today,)).fetchall()
     items = [{"name": r['item_name'], "tracking": r['tracking_number'], "shipper": guess_shipper(r['tracking_number'])} for r in rows]
-    conn.close()
     
     # Group items by shipper
     grouped_items = {}
@@ -629,7 +635,7 @@ def link_item():
     if not tracking or not inventory_sku:
         return {"status": "error", "message": "Missing Data"}
 
-    conn = get_db_connection()
+    conn = get_request_db()
     try:
         # 1. Update Package SKU
         conn.execute("UPDATE packages SET sku = ? WHERE tracking_number = ?", (inventory_sku, tracking))
@@ -669,5 +675,3 @@ def link_item():
     except Exception as e:
         logger.error(f"Link Item Error: {e}")
         return {"status": "error", "message": str(e)}
-    finally:
-        conn.close()
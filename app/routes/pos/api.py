@@ -5,11 +5,10 @@ AJAX endpoints for cart operations and item search.
 import logging
 from flask import request, jsonify, session
 from flask_login import current_user, login_required
-from werkzeug.security import check_password_hash
 
 from app.routes.pos import pos_bp
 from app.routes.pos.core import search_inventory, get_inventory_item
-from app.services.auth import load_users
+from app.services.auth import load_users, verify_password
 
 logger = logging.getLogger(__name__)
 
@@ -83,9 +82,9 @@ def api_validate_manager():
     
     authenticated = False
     if pwd_row:
-        if password and check_password_hash(pwd_row['password_hash'], password):
+        if password and verify_password(pwd_row['password_hash'], password):
             authenticated = True
-        elif pin and pwd_row['pin_hash'] and check_password_hash(pwd_row['pin_hash'], pin):
+        elif pin and pwd_row['pin_hash'] and verify_password(pwd_row['pin_hash'], pin):
             authenticated = True
     
     if authenticated:
@@ -7,11 +7,10 @@ import time
 from collections import defaultdict
 from flask import request, redirect, url_for, flash, render_template, session
 from flask_login import login_user, current_user
-from werkzeug.security import check_password_hash
 
 from app.routes.pos import pos_bp
 from app.services.db import get_db_connection, get_request_db
-from app.services.auth import load_users, User
+from app.services.auth import load_users, User, verify_password
 
 logger = logging.getLogger(__name__)
 
@@ -95,7 +94,7 @@ def pos_login():
                 users = load_users()
                 user_data = users.get(username)
                 
-                if user_data and check_password_hash(user_data['password_hash'], password):
+                if user_data and verify_password(user_data['password_hash'], password):
                     user = User(username, user_data)
                     login_user(user)
                     session['login_time'] = time.time()
@@ -136,7 +135,7 @@ def authenticate_by_pin(username, pin):
     user_data = users.get(username)
     
     if user_data and user_data.get('pin_hash'):
-        if check_password_hash(user_data['pin_hash'], pin):
+        if verify_password(user_data['pin_hash'], pin):
             return User(username, user_data)
     
     return None
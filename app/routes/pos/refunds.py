@@ -83,7 +83,7 @@ def refunds():
 def refund_auth():
     """Manager authentication for refunds."""
     if request.method == 'POST':
-        from werkzeug.security import check_password_hash
+        from app.services.auth import verify_password
         from app.services.auth import User
         from app.utils.permissions import has_permission
         
@@ -111,9 +111,9 @@ def refund_auth():
             
             authenticated = False
             if pwd_row:
-                if password and check_password_hash(pwd_row['password_hash'], password):
+                if password and verify_password(pwd_row['password_hash'], password):
                     authenticated = True
-                elif pin and pwd_row['pin_hash'] and check_password_hash(pwd_row['pin_hash'], pin):
+                elif pin and pwd_row['pin_hash'] and verify_password(pwd_row['pin_hash'], pin):
                     authenticated = True
                 elif badge_id and pwd_row['badge_id'] == badge_id:
                     authenticated = True
@@ -138,7 +138,7 @@ def verify_manager():
     
     Returns JSON with success status and manager username.
     """
-    from werkzeug.security import check_password_hash
+    from app.services.auth import verify_password
     from app.services.auth import User
     from app.utils.permissions import has_permission
     from flask import jsonify
@@ -164,7 +164,7 @@ def verify_manager():
         
         # Check PIN
         if pin and r['pin_hash']:
-            if check_password_hash(r['pin_hash'], pin):
+            if verify_password(r['pin_hash'], pin):
                 authenticated = True
         
         # Check Badge ID
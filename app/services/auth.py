@@ -1,88 +1,238 @@
 from flask_login import UserMixin
+import json
 import logging
-from app.services.db import get_db_connection, BASE_DIR
+import os
+import threading
+import time
+from contextlib import contextmanager
+from app.services.db import BASE_DIR, get_db_path
+from app.services.db_pool import get_pool
 
 logger = logging.getLogger(__name__)
 
+# --- Password Hashing ---
+# argon2id when argon2-cffi is installed (much cheaper to verify than werkzeug's
+# default PBKDF2 at a comparable security level), werkzeug otherwise.
+# Existing werkzeug hashes (pbkdf2:/scrypt:) keep verifying and are upgraded on login.
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+    _PH = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+except ImportError:
+    _PH = None
+
+def hash_password(password):
+    """Hash a password or PIN for storage."""
+    if _PH is not None:
+        return _PH.hash(password)
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(password)
+
+def verify_password(stored_hash, password):
+    """Check a password or PIN against an argon2 or legacy werkzeug hash."""
+    if not stored_hash or password is None:
+        return False
+    if stored_hash.startswith('$argon2'):
+        if _PH is None:
+            return False
+        try:
+            return _PH.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    from werkzeug.security import check_password_hash
+    return check_password_hash(stored_hash, password)
+
+def password_needs_rehash(stored_hash):
+    """True if the hash should be upgraded to the current argon2 parameters."""
+    if _PH is None:
+        return False
+    if not stored_hash.startswith('$argon2'):
+        return True
+    return _PH.check_needs_rehash(stored_hash)
+
+# Flipped once any user exists, so index/setup don't COUNT users on every page load
+_HAS_USERS = False
+
+def has_users(conn=None):
+    """Return True if at least one user account exists."""
+    global _HAS_USERS
+    if _HAS_USERS:
+        return True
+    
+    if conn is None:
+        with get_pool().acquire() as conn:
+            _HAS_USERS = conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None
+    else:
+        _HAS_USERS = conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None
+    return _HAS_USERS
+
+# Performance: users table cache for login selection, POS login and User.get.
+# Writes go through invalidate_users_cache(), which also touches a stamp file
+# next to the database so other gunicorn workers (and CLI scripts) see the
+# change on their next lookup; the TTL is only a backstop.
+# Each load builds a new snapshot dict that is never mutated afterwards and is
+# published with one assignment, so request threads reading by_name and ids
+# from the same snapshot always see one consistent load.
+USERS_LOCK = threading.Lock()
+USERS_CACHE = {
+    # {'by_name': username -> legacy load_users() entry,
+    #  'by_id': str(id) -> User constructor args,
+    #  'ids': username -> id,
+    #  'stamp': users stamp file mtime at load,
+    #  'loaded_at': time.monotonic()}
+    'snapshot': None,
+    'ttl': 60  # seconds
+}
+
+def _users_stamp_path():
+    path = get_db_path()
+    return None if path == ':memory:' else path + '-users'
+
+def _users_stamp():
+    path = _users_stamp_path()
+    try:
+        return os.stat(path).st_mtime_ns if path else 0
+    except OSError:
+        return 0
+
+def invalidate_users_cache():
+    """Force the next users lookup (in every process) to reload from the database."""
+    USERS_CACHE['snapshot'] = None
+    path = _users_stamp_path()
+    if path:
+        try:
+            with open(path, 'a'):
+                os.utime(path, None)
+        except OSError as e:
+            logger.warning(f"Could not touch users cache stamp: {e}")
+
+# Columns the users cache needs, fetched as plain tuples (positional, no Row lookups)
+_USER_COLS = ('id', 'username', 'password_hash', 'is_admin', 'roles', 'pin_hash', 'badge_id', 'email', 'auth_provider')
+_USERS_SQL = None
+
+def _users_sql(conn):
+    """SELECT for _USER_COLS, resolved once from PRAGMA table_info.
+    
+    Columns a not-yet-migrated database lacks read as NULL; that SQL isn't
+    cached, so the full column list is picked up once ensure_db_ready() runs.
+    """
+    global _USERS_SQL
+    if _USERS_SQL is not None:
+        return _USERS_SQL
+    have = {r[1] for r in conn.execute("PRAGMA table_info(users)")}
+    sql = "SELECT " + ", ".join(c if c in have else f"NULL AS {c}" for c in _USER_COLS) + " FROM users"
+    if have.issuperset(_USER_COLS):
+        _USERS_SQL = sql
+    return sql
+
+def _parse_roles(roles_str, username):
+    """Parse the roles JSON column."""
+    try:
+        if roles_str:
+            return json.loads(roles_str)
+    except Exception as e:
+        logger.warning(f"Failed to parse roles for user {username}: {e}")
+    return []
+
+def _fresh_users_snapshot(stamp, now):
+    snap = USERS_CACHE['snapshot']
+    if (snap is not None and stamp == snap['stamp']
+            and (now - snap['loaded_at']) < USERS_CACHE['ttl']):
+        return snap
+    return None
+
+def _users_cache():
+    """Return the current users snapshot, reloading it if empty or expired."""
+    now = time.monotonic()
+    stamp = _users_stamp()
+    snap = _fresh_users_snapshot(stamp, now)
+    if snap is not None:
+        return snap
+    
+    with USERS_LOCK:
+        # Double-check after acquiring lock (another thread may have reloaded)
+        snap = _fresh_users_snapshot(stamp, now)
+        if snap is not None:
+            return snap
+        
+        with get_pool().acquire() as conn:
+            cur = conn.cursor()
+            cur.row_factory = None  # plain tuples
+            rows = cur.execute(_users_sql(conn)).fetchall()
+        
+        by_name, by_id, ids = {}, {}, {}
+        for user_id, username, pwd_hash, is_admin, roles_str, pin_hash, badge_id, email, provider in rows:
+            roles = _parse_roles(roles_str, username)
+            by_name[username] = {
+                "pin": pwd_hash, # Legacy code might expect 'pin' key
+                "password_hash": pwd_hash,
+                "pin_hash": pin_hash,
+                "is_admin": bool(is_admin),
+                "roles": roles,
+                "badge_id": badge_id
+            }
+            by_id[str(user_id)] = (user_id, username, is_admin, roles, email, provider)
+            ids[username] = user_id
+        
+        snap = {
+            'by_name': by_name,
+            'by_id': by_id,
+            'ids': ids,
+            'stamp': stamp,  # read before the SELECT, so a racing write reloads again
+            'loaded_at': time.monotonic(),
+        }
+        USERS_CACHE['snapshot'] = snap
+        return snap
+
+@contextmanager
+def _tx():
+    """Pooled connection for a single write: commits on success, rolls back on error."""
+    with get_pool().acquire() as conn:
+        yield conn
+        conn.commit()
+
+def _write_user(sql, params, error_msg):
+    """Run one users-table write and invalidate the cache. Returns True on success."""
+    try:
+        with _tx() as conn:
+            conn.execute(sql, params)
+        return True
+    except Exception as e:
+        logger.error(f"{error_msg}: {e}")
+        return False
+    finally:
+        invalidate_users_cache()
+
 # --- Shim Functions for Legacy Compatibility (main.py) ---
 def load_users():
     """Legacy function used by main.py login route."""
-    import json
-    conn = get_db_connection()
     try:
-        rows = conn.execute("SELECT * FROM users").fetchall()
-        users = {}
-        for r in rows:
-            # Parse roles from JSON (handle missing column gracefully)
-            roles = []
-            try:
-                roles_str = r['roles'] if 'roles' in r.keys() else None
-                if roles_str:
-                    roles = json.loads(roles_str)
-            except Exception as e:
-                logger.warning(f"Failed to parse roles for user {r['username']}: {e}")
-                roles = []
-            
-            users[r['username']] = {
-                "pin": r['password_hash'], # Legacy code might expect 'pin' key
-                "password_hash": r['password_hash'],
-                "pin_hash": r['pin_hash'] if 'pin_hash' in r.keys() else None,
-                "is_admin": bool(r['is_admin']),
-                "roles": roles,
-                "badge_id": r['badge_id'] if 'badge_id' in r.keys() else ''
-            }
-        return users
+        return dict(_users_cache()['by_name'])
     except Exception as e:
-        import logging
-        logging.getLogger(__name__).error(f"Error loading users: {e}")
+        logger.error(f"Error loading users: {e}")
         return {}
-    finally:
-        conn.close()
 
 def create_user(username, password_hash, is_admin=False):
     """Legacy function used by main.py setup wizard."""
-    conn = get_db_connection()
-    try:
-        conn.execute("INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)", 
-                    (username, password_hash, is_admin))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to create user '{username}': {e}")
-    finally:
-        conn.close()
+    global _HAS_USERS
+    if _write_user("INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)",
+                   (username, password_hash, is_admin), f"Failed to create user '{username}'"):
+        _HAS_USERS = True
 
 def delete_user(username):
     """Legacy function used by admin.py."""
-    conn = get_db_connection()
-    try:
-        conn.execute("DELETE FROM users WHERE username = ?", (username,))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to delete user '{username}': {e}")
-    finally:
-        conn.close()
+    _write_user("DELETE FROM users WHERE username = ?", (username,),
+                f"Failed to delete user '{username}'")
 
 def update_user_password(username, password_hash):
     """Legacy function used by admin.py."""
-    conn = get_db_connection()
-    try:
-        conn.execute("UPDATE users SET password_hash = ? WHERE username = ?", (password_hash, username))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to update password for user '{username}': {e}")
-    finally:
-        conn.close()
+    _write_user("UPDATE users SET password_hash = ? WHERE username = ?", (password_hash, username),
+                f"Failed to update password for user '{username}'")
 
 def update_user_admin_status(username, is_admin):
     """Legacy function used by admin.py."""
-    conn = get_db_connection()
-    try:
-        conn.execute("UPDATE users SET is_admin = ? WHERE username = ?", (is_admin, username))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Failed to update admin status for user '{username}': {e}")
-    finally:
-        conn.close()
+    _write_user("UPDATE users SET is_admin = ? WHERE username = ?", (is_admin, username),
+                f"Failed to update admin status for user '{username}'")
 # -------------------------------------------------------
 
 class User(UserMixin):
@@ -106,114 +256,110 @@ class User(UserMixin):
 
     @staticmethod
     def get(user_id):
-        import json
-        conn = get_db_connection()
-        user = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
-        conn.close()
-        
-        if not user:
-            return None
-        
-        # Parse roles
-        roles = []
         try:
-            if user['roles']:
-                roles = json.loads(user['roles'])
+            cached = _users_cache()['by_id'].get(str(user_id))
         except Exception as e:
-            logger.warning(f"Failed to parse roles for user ID {user_id}: {e}")
-            roles = []
+            logger.warning(f"Users cache unavailable: {e}")
+            cached = None
+        if cached:
+            return User(*cached)
         
-        # Safely get new columns (might handle migration lag)
-        email = user['email'] if 'email' in user.keys() else None
-        auth_provider = user['auth_provider'] if 'auth_provider' in user.keys() else None
+        # Cache miss (e.g. user created by another worker within the TTL)
+        with get_pool().acquire() as conn:
+            user = conn.execute(_users_sql(conn) + " WHERE id = ?", (user_id,)).fetchone()
         
-        return User(user['id'], user['username'], user['is_admin'], roles, email, auth_provider)
+        if not user:
+            return None
+        
+        return User(user['id'], user['username'], user['is_admin'],
+                    _parse_roles(user['roles'], user['username']), user['email'], user['auth_provider'])
 
     @staticmethod
     def get_by_email(email):
         """Find user by email address."""
         if not email: return None
-        conn = get_db_connection()
-        try:
+        with get_pool().acquire() as conn:
             # Check for direct email match
-            user = conn.execute("SELECT * FROM users WHERE email = ?", (email.lower(),)).fetchone()
-            if user:
-                return User.get(user['id'])
-            return None
-        finally:
-            conn.close()
+            user = conn.execute("SELECT id FROM users WHERE email = ?", (email.lower(),)).fetchone()
+        if user:
+            return User.get(user['id'])
+        return None
 
     @staticmethod
     def get_by_username(username):
         """Find user by username (case insensitive)."""
         if not username: return None
-        conn = get_db_connection()
-        try:
-            user = conn.execute("SELECT * FROM users WHERE LOWER(username) = ?", (username.lower(),)).fetchone()
-            if user:
-                return User.get(user['id'])
-            return None
-        finally:
-            conn.close()
+        with get_pool().acquire() as conn:
+            user = conn.execute("SELECT id FROM users WHERE LOWER(username) = ?", (username.lower(),)).fetchone()
+        if user:
+            return User.get(user['id'])
+        return None
 
     @staticmethod
     def create_sso_user(username, email, provider='oidc'):
         """Create a new user from SSO data."""
-        conn = get_db_connection()
         try:
             # Generate random password (they should only login via SSO)
             import secrets
             pwd_hash = "sso_managed_" + secrets.token_hex(8) 
             
-            conn.execute("""
-                INSERT INTO users (username, password_hash, is_admin, roles, email, auth_provider) 
-                VALUES (?, ?, 0, '["user"]', ?, ?)
-            """, (username, pwd_hash, email, provider))
-            conn.commit()
+            with _tx() as conn:
+                conn.execute("""
+                    INSERT INTO users (username, password_hash, is_admin, roles, email, auth_provider) 
+                    VALUES (?, ?, 0, '["user"]', ?, ?)
+                """, (username, pwd_hash, email, provider))
+            invalidate_users_cache()
             
             # Fetch and return the new user
             return User.get_by_username(username)
         except Exception as e:
             logger.error(f"Failed to create SSO user {username}: {e}")
             return None
-        finally:
-            conn.close()
 
     @staticmethod
     def link_sso_account(user_id, email, provider):
         """Link an existing user account to an SSO identity."""
-        conn = get_db_connection()
-        try:
-            conn.execute("UPDATE users SET email = ?, auth_provider = ? WHERE id = ?", (email, provider, user_id))
-            conn.commit()
-            return True
-        except Exception as e:
-            logger.error(f"Failed to link SSO account for user {user_id}: {e}")
-            return False
-        finally:
-            conn.close()
+        return _write_user("UPDATE users SET email = ?, auth_provider = ? WHERE id = ?", (email, provider, user_id),
+                           f"Failed to link SSO account for user {user_id}")
 
     @staticmethod
     def authenticate(username, password):
-        conn = get_db_connection()
-        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
-        conn.close()
+        cache = _users_cache()
+        entry = cache['by_name'].get(username)
+        if entry is not None:
+            user_id, stored_hash = cache['ids'][username], entry['password_hash']
+        else:
+            with get_pool().acquire() as conn:
+                user = conn.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,)).fetchone()
+            if not user:
+                return None
+            user_id, stored_hash = user['id'], user['password_hash']
         
-        if not user:
+        # Block SSO-only users from password login if password starts with sso_managed
+        if not stored_hash or stored_hash.startswith('sso_managed_'):
             return None
-            
-        # For now, simplistic password check (assumes plain hash or similar)
-        # In production, use werkzeug.security.check_password_hash
         
-        from werkzeug.security import check_password_hash
-        # Block SSO-only users from password login if password starts with sso_managed
-        if user['password_hash'] and user['password_hash'].startswith('sso_managed_'):
+        if not verify_password(stored_hash, password):
             return None
-
-        if user['password_hash'] and check_password_hash(user['password_hash'], password):
-             return User.get(user['id']) # Use get() to return full object
-             
-        return None
+        
+        # Upgrade legacy / outdated hashes while we have the plaintext
+        if password_needs_rehash(stored_hash):
+            _write_user("UPDATE users SET password_hash = ? WHERE id = ?", (hash_password(password), user_id),
+                        f"Password rehash failed for user {username}")
+        
+        return User.get(user_id) # Use get() to return full object
 
 def load_user(user_id):
+    """Flask-Login user loader. Resolves each user id at most once per request."""
+    try:
+        from flask import g, has_app_context
+        if has_app_context():
+            cached = g.get('_auth_user')
+            if cached is not None and cached.id == str(user_id):
+                return cached
+            user = User.get(user_id)
+            g._auth_user = user
+            return user
+    except RuntimeError:
+        pass
     return User.get(user_id)
@@ -9,10 +9,13 @@ Uses APScheduler for reliable job scheduling with:
 - Graceful shutdown handling
 """
 import os
+import csv
 import logging
 import datetime
 import sqlite3
 import atexit
+import threading
+from collections import deque
 from app.services.data_manager import load_config, MANIFEST_FILE, sync_manifest
 from app.services.file_handler import SimpleFileLock, atomic_write
 
@@ -47,18 +50,46 @@ SYNC_STATUS = {
     'email_check_count': 0,
     'manifest_failures': 0,
     'email_failures': 0,
-    'errors': [],
+    'errors': deque(maxlen=10),  # last 10 job errors, oldest dropped on append
     'scheduler_running': False
 }
+# Jobs write SYNC_STATUS from scheduler threads while get_sync_status() reads it;
+# counters are read-modify-write, so every update happens under the lock
+STATUS_LOCK = threading.Lock()
 
 # Configuration
 MAX_CONSECUTIVE_FAILURES = 5
 MANIFEST_SYNC_INTERVAL_MINUTES = 5
 EMAIL_CHECK_INTERVAL_MINUTES = 15
 
+INGEST_INSERT_SQL = '''
+    INSERT INTO packages (tracking_number, item_name, date_expected, quantity, status, source, image_url)
+    VALUES (?, ?, ?, 1, ?, 'auto-email', ?)
+    ON CONFLICT(tracking_number) DO NOTHING
+    RETURNING tracking_number
+'''
+
 # Global scheduler instance
 scheduler = None
 
+# Threading fallback coordination: loops park on these instead of time.sleep,
+# so shutdown is immediate and an email check can be requested early
+_stop_event = threading.Event()
+_wake_email = threading.Event()
+
+def _stop_threads():
+    _stop_event.set()
+    _wake_email.set()
+
+
+def _record_error(job, error):
+    with STATUS_LOCK:
+        SYNC_STATUS['errors'].append({
+            'time': datetime.datetime.now().isoformat(),
+            'job': job,
+            'error': str(error)
+        })
+
 
 def manifest_sync_job():
     """Background job to sync manifest.csv.
@@ -73,32 +104,48 @@ def manifest_sync_job():
         sync_manifest()
         
         # Success - reset failure count
-        SYNC_STATUS['last_manifest_sync'] = datetime.datetime.now().isoformat()
-        SYNC_STATUS['manifest_sync_count'] += 1
-        SYNC_STATUS['manifest_failures'] = 0
+        with STATUS_LOCK:
+            SYNC_STATUS['last_manifest_sync'] = datetime.datetime.now().isoformat()
+            SYNC_STATUS['manifest_sync_count'] += 1
+            SYNC_STATUS['manifest_failures'] = 0
         logger.debug("[Manifest Sync] ✓ Background sync completed.")
         
     except Exception as e:
-        SYNC_STATUS['manifest_failures'] += 1
-        error_msg = f"[Manifest Sync] Error (failure {SYNC_STATUS['manifest_failures']}/{MAX_CONSECUTIVE_FAILURES}): {e}"
+        with STATUS_LOCK:
+            SYNC_STATUS['manifest_failures'] += 1
+            failures = SYNC_STATUS['manifest_failures']
+        error_msg = f"[Manifest Sync] Error (failure {failures}/{MAX_CONSECUTIVE_FAILURES}): {e}"
         logger.error(error_msg)
         
-        SYNC_STATUS['errors'].append({
-            'time': datetime.datetime.now().isoformat(),
-            'job': 'manifest_sync',
-            'error': str(e)
-        })
-        # Keep only last 10 errors
-        if len(SYNC_STATUS['errors']) > 10:
-            SYNC_STATUS['errors'] = SYNC_STATUS['errors'][-10:]
+        _record_error('manifest_sync', e)
         
         # If too many failures, pause the job
-        if SYNC_STATUS['manifest_failures'] >= MAX_CONSECUTIVE_FAILURES:
+        if failures >= MAX_CONSECUTIVE_FAILURES:
             logger.error(f"[Manifest Sync] ⚠ Pausing job after {MAX_CONSECUTIVE_FAILURES} consecutive failures")
             if scheduler and scheduler.get_job('manifest_sync'):
                 scheduler.pause_job('manifest_sync')
 
 
+def _get_ingest_state(key):
+    from app.services.db import get_db_connection
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT v FROM ingest_state WHERE k = ?", (key,)).fetchone()
+        return row['v'] if row else None
+    finally:
+        conn.close()
+
+
+def _set_ingest_state(key, value):
+    from app.services.db import get_db_connection
+    conn = get_db_connection()
+    try:
+        conn.execute("INSERT OR REPLACE INTO ingest_state (k, v) VALUES (?, ?)", (key, value))
+        conn.commit()
+    finally:
+        conn.close()
+
+
 def email_ingest_job():
     """Background job to check for Amazon shipping emails."""
     global SYNC_STATUS
@@ -120,49 +167,62 @@ def email_ingest_job():
             logger.warning("[Auto-Ingest] email_ingest module not available")
             return
             
-        logger.info(f"[Auto-Ingest] Checking {usr} on {srv}...")
-        items = email_ingest.check_amazon_emails(srv, usr, pwd)
+        logger.info("[Auto-Ingest] Checking %s on %s...", usr, srv)
+        # Only ask IMAP for UIDs above the last one we processed for this mailbox
+        state_key = f"imap_cursor:{usr}@{srv}"
+        since = _get_ingest_state(state_key)
+        items, cursor, seen = email_ingest.fetch_order_emails(srv, usr, pwd, since=since, keep_alive=True)
         
         if items:
-            count = 0
             conn = get_db_connection()
             try:
                 today = datetime.date.today()
+                # date_str -> status; a batch shares a handful of dates, so each is parsed once
+                statuses = {'Pending': 'on_time'}
                 
+                rows = []
                 for item in items:
-                    tracking = item['tracking']
-                    name = item.get('name', 'Amazon Item')
                     date_str = item.get('date', 'Pending')
-                    image = item.get('image_url')
                     
                     # Determine Status
-                    status = 'on_time'
-                    try:
-                        if date_str != 'Pending':
-                            d_dt = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-                            if d_dt == today: status = 'expected'
-                            elif d_dt < today: status = 'past_due'
-                    except ValueError:
-                        pass  # Date parsing failed
+                    status = statuses.get(date_str)
+                    if status is None:
+                        try:
+                            d_dt = datetime.date.fromisoformat(date_str)
+                            status = 'expected' if d_dt == today else ('past_due' if d_dt < today else 'on_time')
+                        except (TypeError, ValueError):
+                            status = 'on_time'  # Date parsing failed
+                        statuses[date_str] = status
                     
-                    # Insert or Ignore
-                    try:
-                        conn.execute('''
-                            INSERT INTO packages (tracking_number, item_name, date_expected, quantity, status, source, image_url)
-                            VALUES (?, ?, ?, 1, ?, 'auto-email', ?)
-                        ''', (tracking, name, date_str, status, image))
-                        count += 1
-                    except sqlite3.IntegrityError:
-                        pass  # Already exists
-                        
-                conn.commit()
+                    rows.append((item['tracking'], item.get('name', 'Amazon Item'), date_str, status, item.get('image_url')))
                 
-                # Append to Manifest CSV for record keeping
+                # Explicit write transaction: take the lock up front, one commit for the batch.
+                # ON CONFLICT skips existing tracking numbers without raising; RETURNING
+                # reports exactly which rows were new (executemany can't return rows,
+                # so the cached statement is stepped once per row).
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    inserted = set()
+                    for row in rows:
+                        inserted.update(r[0] for r in conn.execute(INGEST_INSERT_SQL, row))
+                    count = len(inserted)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+                
+                # Append to Manifest CSV for record keeping (new packages only)
                 if os.path.exists(MANIFEST_FILE) and count > 0:
+                    # First occurrence of each tracking number is the row that was inserted
+                    new_rows, pending = [], set(inserted)
+                    for item in items:
+                        if item['tracking'] in pending:
+                            pending.discard(item['tracking'])
+                            new_rows.append((item['tracking'], item.get('name', 'Item'), 1, item.get('date', 'Pending'), item.get('image_url', '')))
                     try:
-                        with open(MANIFEST_FILE, 'a') as f:
-                            for item in items:
-                                f.write(f"{item['tracking']},{item.get('name','Item')},1,{item.get('date','Pending')},{item.get('image_url','')}\n")
+                        # One buffered writerows call; csv quotes names containing commas
+                        with open(MANIFEST_FILE, 'a', newline='', encoding='utf-8') as f:
+                            csv.writer(f, lineterminator='\n').writerows(new_rows)
                     except IOError as e:
                         logger.warning(f"[Auto-Ingest] Could not update manifest CSV: {e}")
                     
@@ -174,25 +234,28 @@ def email_ingest_job():
             else:
                 logger.info("[Auto-Ingest] No new packages found (Duplicates).")
         
+        if cursor and cursor != since:
+            _set_ingest_state(state_key, cursor)
+        # Only now mark them read: had the writes above failed, they would still
+        # be unread for a first-run (cursor-less) UNSEEN search
+        email_ingest.mark_emails_seen(srv, usr, pwd, cursor, seen, keep_alive=True)
+        
         # Success - reset failure count
-        SYNC_STATUS['last_email_check'] = datetime.datetime.now().isoformat()
-        SYNC_STATUS['email_check_count'] += 1
-        SYNC_STATUS['email_failures'] = 0
+        with STATUS_LOCK:
+            SYNC_STATUS['last_email_check'] = datetime.datetime.now().isoformat()
+            SYNC_STATUS['email_check_count'] += 1
+            SYNC_STATUS['email_failures'] = 0
         
     except Exception as e:
-        SYNC_STATUS['email_failures'] += 1
-        error_msg = f"[Auto-Ingest] Error (failure {SYNC_STATUS['email_failures']}/{MAX_CONSECUTIVE_FAILURES}): {e}"
+        with STATUS_LOCK:
+            SYNC_STATUS['email_failures'] += 1
+            failures = SYNC_STATUS['email_failures']
+        error_msg = f"[Auto-Ingest] Error (failure {failures}/{MAX_CONSECUTIVE_FAILURES}): {e}"
         logger.error(error_msg)
         
-        SYNC_STATUS['errors'].append({
-            'time': datetime.datetime.now().isoformat(),
-            'job': 'email_ingest',
-            'error': str(e)
-        })
-        if len(SYNC_STATUS['errors']) > 10:
-            SYNC_STATUS['errors'] = SYNC_STATUS['errors'][-10:]
+        _record_error('email_ingest', e)
         
-        if SYNC_STATUS['email_failures'] >= MAX_CONSECUTIVE_FAILURES:
+        if failures >= MAX_CONSECUTIVE_FAILURES:
             logger.error(f"[Auto-Ingest] ⚠ Pausing job after {MAX_CONSECUTIVE_FAILURES} consecutive failures")
             if scheduler and scheduler.get_job('email_ingest'):
                 scheduler.pause_job('email_ingest')
@@ -252,11 +315,48 @@ def eod_email_job():
         logger.error(f"[Auto-Email] Job error: {e}")
 
 
+SCHEDULER_LOCK_FILE = '/tmp/rscp_scheduler.lock'
+_scheduler_lock_fd = None
+
+def _acquire_scheduler_lock():
+    """Take an exclusive flock on SCHEDULER_LOCK_FILE for the life of this process.
+    
+    The kernel drops the lock when its holder exits, so a crashed or recycled
+    worker never leaves a stale lock behind (no PID checks, no PID reuse
+    races). Returns False if another process holds it.
+    """
+    global _scheduler_lock_fd
+    if _scheduler_lock_fd is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        return True  # Windows: single-process dev server
+    fd = os.open(SCHEDULER_LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())  # informational only
+    _scheduler_lock_fd = fd
+    return True
+
+
+def _release_scheduler_lock():
+    global _scheduler_lock_fd
+    if _scheduler_lock_fd is not None:
+        os.close(_scheduler_lock_fd)  # closing the fd releases the flock
+        _scheduler_lock_fd = None
+        logger.debug("[Background] Scheduler lock released")
+
+
 def start_scheduler():
     """Start the APScheduler with all background jobs.
     
     Called once at application startup from app.py.
-    Uses a file-based lock to ensure only one worker starts the scheduler
+    Uses a file lock (flock) to ensure only one worker starts the scheduler
     when running with multiple gunicorn workers.
     """
     global scheduler, SYNC_STATUS
@@ -267,34 +367,11 @@ def start_scheduler():
         return
     
     # Try to acquire lock (only one worker should start scheduler)
-    lock_file_path = '/tmp/rscp_scheduler.lock'
-    
     try:
-        # Try to create lock file exclusively
-        lock_fd = os.open(lock_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-        os.write(lock_fd, str(os.getpid()).encode())
-        os.close(lock_fd)
-        logger.info("[Background] This worker acquired scheduler lock")
-    except FileExistsError:
-        # Another worker already has the lock - check if it's still running
-        try:
-            with open(lock_file_path, 'r') as f:
-                pid = int(f.read().strip())
-            # Check if that process is still alive
-            os.kill(pid, 0)  # Doesn't actually kill, just checks
-            logger.info(f"[Background] Scheduler owned by worker PID {pid}, skipping")
+        if not _acquire_scheduler_lock():
+            logger.info("[Background] Scheduler owned by another worker, skipping")
             return
-        except (ProcessLookupError, ValueError, FileNotFoundError):
-            # Process died or lock file is stale, take over
-            try:
-                os.remove(lock_file_path)
-                lock_fd = os.open(lock_file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
-                os.write(lock_fd, str(os.getpid()).encode())
-                os.close(lock_fd)
-                logger.info("[Background] Took over stale scheduler lock")
-            except OSError:
-                logger.info("[Background] Could not acquire lock, skipping scheduler")
-                return
+        logger.info("[Background] This worker acquired scheduler lock")
     except Exception as e:
         logger.warning(f"[Background] Lock error: {e}, starting scheduler anyway (dev mode?)")
     
@@ -356,42 +433,40 @@ def shutdown_scheduler():
     if scheduler and SYNC_STATUS['scheduler_running']:
         logger.info("[Background] Shutting down scheduler...")
         scheduler.shutdown(wait=False)
+        _stop_threads()
         SYNC_STATUS['scheduler_running'] = False
         
-        # Clean up lock file
-        lock_file_path = '/tmp/rscp_scheduler.lock'
-        try:
-            if os.path.exists(lock_file_path):
-                os.remove(lock_file_path)
-                logger.debug("[Background] Scheduler lock file removed")
-        except Exception as e:
-            logger.warning(f"[Background] Could not remove lock file: {e}")
+        # Release the lock so a replacement worker can take over right away
+        _release_scheduler_lock()
         
         logger.info("[Background] Scheduler stopped.")
 
 
 def _start_threading_fallback():
     """Fallback to simple threading if APScheduler is not available."""
-    import time
-    import threading
-    
     global SYNC_STATUS
     
     def manifest_loop():
-        while True:
+        while not _stop_event.is_set():
             try:
                 manifest_sync_job()
             except Exception as e:
                 logger.error(f"[Manifest Sync] Thread error: {e}")
-            time.sleep(MANIFEST_SYNC_INTERVAL_MINUTES * 60)
+            if _stop_event.wait(timeout=MANIFEST_SYNC_INTERVAL_MINUTES * 60):
+                return
     
     def email_loop():
-        while True:
+        while not _stop_event.is_set():
             try:
                 email_ingest_job()
             except Exception as e:
                 logger.error(f"[Auto-Ingest] Thread error: {e}")
-            time.sleep(EMAIL_CHECK_INTERVAL_MINUTES * 60)
+            # Woken early by trigger_email_check() or shutdown
+            _wake_email.wait(timeout=EMAIL_CHECK_INTERVAL_MINUTES * 60)
+            _wake_email.clear()
+    
+    _stop_event.clear()
+    atexit.register(_stop_threads)
     
     manifest_thread = threading.Thread(target=manifest_loop, daemon=True, name="ManifestSync")
     manifest_thread.start()
@@ -403,6 +478,24 @@ def _start_threading_fallback():
     logger.info("[Background] Threading fallback started (APScheduler not available)")
 
 
+def trigger_email_check():
+    """Run the email ingest job as soon as possible (e.g. after settings change).
+    
+    Only affects the scheduler in this process; other workers pick the
+    change up on their next interval.
+    """
+    if scheduler and APSCHEDULER_AVAILABLE and SYNC_STATUS['scheduler_running']:
+        job = scheduler.get_job('email_ingest')
+        if job and job.next_run_time is not None:
+            job.modify(next_run_time=datetime.datetime.now(job.next_run_time.tzinfo))
+            return True
+        return False
+    if SYNC_STATUS['scheduler_running']:
+        _wake_email.set()
+        return True
+    return False
+
+
 # Legacy compatibility
 def start_background_tasks():
     """Legacy function - now uses start_scheduler()."""
@@ -418,7 +511,9 @@ def get_sync_status():
     """Get current background sync status for monitoring."""
     global scheduler
     
-    status = SYNC_STATUS.copy()
+    with STATUS_LOCK:
+        status = SYNC_STATUS.copy()
+        status['errors'] = list(SYNC_STATUS['errors'])  # JSON-serializable snapshot
     
     # Add scheduler-specific info if available
     if scheduler and APSCHEDULER_AVAILABLE:
@@ -444,10 +539,11 @@ def resume_job(job_id):
     
     if scheduler and scheduler.get_job(job_id):
         scheduler.resume_job(job_id)
-        if job_id == 'manifest_sync':
-            SYNC_STATUS['manifest_failures'] = 0
-        elif job_id == 'email_ingest':
-            SYNC_STATUS['email_failures'] = 0
+        with STATUS_LOCK:
+            if job_id == 'manifest_sync':
+                SYNC_STATUS['manifest_failures'] = 0
+            elif job_id == 'email_ingest':
+                SYNC_STATUS['email_failures'] = 0
         logger.info(f"[Background] Resumed job: {job_id}")
         return True
     return False
@@ -1,13 +1,56 @@
-import secrets
+import hashlib
+import hmac
 import logging
-from flask import session, request, abort, current_app
+import secrets
+from flask import session, request, abort, current_app, g
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 
 logger = logging.getLogger(__name__)
 
+# Signed tokens: SECRET_KEY (salt 'csrf') over the login session identity plus a
+# random per-session nonce. The nonce is the only thing kept in the session; it
+# is created with the first token and dropped by session.clear() on logout, so
+# tokens die with the session and anonymous sessions don't share a binding.
+# Long default lifetime (RSCP_CSRF_TIME_LIMIT overrides, in seconds; the older
+# WTF_CSRF_TIME_LIMIT is still honoured): POS and receiving pages stay open for
+# a whole shift.
+DEFAULT_TIME_LIMIT = 24 * 3600
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='csrf')
+
+def _binding(create=False):
+    """Short digest of Flask-Login's user id + session identifier + the session's
+    CSRF nonce. Returns None if the session has no nonce and create is False."""
+    nonce = session.get('_csrf_nonce')
+    if nonce is None:
+        if not create:
+            return None
+        nonce = session['_csrf_nonce'] = secrets.token_urlsafe(16)
+    ident = f"{session.get('_user_id', '')}:{session.get('_id', '')}:{nonce}"
+    return hashlib.blake2b(ident.encode(), digest_size=8).hexdigest()
+
 def generate_csrf_token():
-    if '_csrf_token' not in session:
-        session['_csrf_token'] = secrets.token_hex(16)
-    return session['_csrf_token']
+    # Memoized per request: templates call csrf_token() once per form.
+    # May write the session (first nonce), so a view that streams its body must
+    # call this before building the Response, while the cookie can still be set.
+    token = g.get('_csrf_token')
+    if token is None:
+        token = g._csrf_token = _serializer().dumps(_binding(create=True))
+    return token
+
+def _token_valid(token):
+    config = current_app.config
+    max_age = config.get('RSCP_CSRF_TIME_LIMIT', config.get('WTF_CSRF_TIME_LIMIT', DEFAULT_TIME_LIMIT))
+    try:
+        binding = _serializer().loads(token, max_age=max_age)  # SignatureExpired is a BadSignature
+    except BadSignature:
+        # Pages rendered before signed tokens still carry the old per-session token
+        legacy = session.get('_csrf_token')
+        return (bool(legacy) and len(token) == len(legacy)
+                and hmac.compare_digest(token.encode(), legacy.encode()))
+    current = _binding()
+    return current is not None and hmac.compare_digest(str(binding).encode(), current.encode())
 
 def verify_csrf_token():
     # Allow disabling CSRF for tests
@@ -20,11 +63,8 @@ def verify_csrf_token():
 
     # Helper to check if it's an API call or Form
     token = request.form.get('csrf_token') or request.headers.get('X-CSRFToken')
-    session_token = session.get('_csrf_token')
-    
+
     # Security: Don't log actual tokens, only validation status
-    if not token or token != session_token:
-        logger.warning(f"[CSRF] Token validation failed for {request.path}")
+    if not token or not _token_valid(token):
+        logger.warning("[CSRF] Token validation failed for %s", request.path)
         abort(403, description="CSRF Token Mismatch")
-    
-    logger.debug(f"[CSRF] Token verified for {request.path}")
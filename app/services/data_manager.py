@@ -6,10 +6,13 @@ import time
 import csv # Replaced pandas with csv
 import re
 import threading
+import atexit
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, List, Optional, Set
 import sqlite3
 
-from app.services.db import get_db_connection, BASE_DIR, get_request_db
+from app.services.db import get_db_connection, BASE_DIR, get_request_db, write_transaction
 from app.utils.helpers import parse_date
 
 logger = logging.getLogger(__name__)
@@ -25,17 +28,66 @@ DATA_CACHE = {
     'last_sync_date': None
 }
 
-# Performance: Config cache with TTL to avoid disk I/O on every request
+# Performance: Config cache keyed on config.json's stat, so a hit costs one
+# os.stat() and edits (from any worker) are picked up on the next call.
 # Lock to prevent race conditions during concurrent load/save
 CONFIG_LOCK = threading.Lock()
 CONFIG_CACHE = {
     'data': None,
-    'loaded_at': 0,
-    'ttl': 5  # seconds (reduced from 60 for more responsive updates)
+    'stamp': None  # _config_stamp() (file mtime/size + override env) when 'data' was parsed
 }
 
+# Performance: Dashboard/analytics cache so polling clients don't re-run the
+# same aggregate queries every few seconds. Cleared on writes that move the counts.
+STATS_LOCK = threading.Lock()
+STATS_CACHE = {
+    'data': {},
+    'ttl': 30  # seconds
+}
+
+def get_cached_stats(loader, *args):
+    """Return loader(*args), served from STATS_CACHE until the TTL expires."""
+    key = (loader.__name__, args)
+    now = time.time()
+    entry = STATS_CACHE['data'].get(key)
+    if entry is not None and (now - entry[0]) < STATS_CACHE['ttl']:
+        return entry[1]
+    
+    value = loader(*args)
+    with STATS_LOCK:
+        STATS_CACHE['data'][key] = (now, value)
+    return value
+
+def invalidate_stats_cache() -> None:
+    """Drop cached dashboard/analytics results (call after receipts, returns, syncs)."""
+    with STATS_LOCK:
+        STATS_CACHE['data'].clear()
+
+# Environment variable overrides for sensitive values (config key -> env var)
+# These take priority over config.json values
+CONFIG_ENV_OVERRIDES = {
+    'WEBHOOK_URL': 'RSCP_WEBHOOK_URL',
+    'IMAP_SERVER': 'RSCP_IMAP_SERVER',
+    'EMAIL_USER': 'RSCP_EMAIL_USER',
+    'EMAIL_PASS': 'RSCP_EMAIL_PASS',
+    'SECRET_KEY': 'RSCP_SECRET_KEY',
+    'SSO_CLIENT_ID': 'RSCP_SSO_CLIENT_ID',
+    'SSO_CLIENT_SECRET': 'RSCP_SSO_CLIENT_SECRET',
+    'SSO_DISCOVERY_URL': 'RSCP_SSO_DISCOVERY_URL',
+}
+
+def _config_stamp():
+    """config.json mtime/size plus the override env values - the cache key."""
+    env = tuple(os.environ.get(var) for var in CONFIG_ENV_OVERRIDES.values())
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        return (None, env)
+    return (st.st_mtime_ns, st.st_size, env)
+
 def load_config(force_reload: bool = False) -> Dict[str, Any]:
-    """Load configuration with caching. Uses 5s TTL to avoid disk I/O.
+    """Load configuration with caching. Only re-parses config.json when its
+    mtime/size or one of the RSCP_* override env vars changes.
     
     Thread-safe: Uses CONFIG_LOCK to prevent race conditions.
     
@@ -43,18 +95,19 @@ def load_config(force_reload: bool = False) -> Dict[str, Any]:
         force_reload: If True, bypasses cache and reloads from disk.
     """
     global CONFIG_CACHE
-    now = time.time()
+    stamp = _config_stamp()
     
-    # Return cached config if valid and not forcing reload (no lock needed for read)
+    # Return cached config if unchanged on disk and not forcing reload (no lock needed for read)
     if not force_reload and CONFIG_CACHE['data'] is not None:
-        if (now - CONFIG_CACHE['loaded_at']) < CONFIG_CACHE['ttl']:
+        if CONFIG_CACHE['stamp'] == stamp:
             return CONFIG_CACHE['data'].copy()  # Return copy to prevent mutation
     
     # Lock for disk I/O and cache update
     with CONFIG_LOCK:
         # Double-check cache after acquiring lock (another thread may have updated)
+        stamp = _config_stamp()
         if not force_reload and CONFIG_CACHE['data'] is not None:
-            if (now - CONFIG_CACHE['loaded_at']) < CONFIG_CACHE['ttl']:
+            if CONFIG_CACHE['stamp'] == stamp:
                 return CONFIG_CACHE['data'].copy()
         
         config = {}
@@ -68,27 +121,15 @@ def load_config(force_reload: bool = False) -> Dict[str, Any]:
                 logger.error(f"[Config] Failed to load {CONFIG_FILE}: {e}")
                 config = {}
         
-        # Environment variable overrides for sensitive values
-        # These take priority over config.json values
-        env_overrides = {
-            'WEBHOOK_URL': os.environ.get('RSCP_WEBHOOK_URL'),
-            'IMAP_SERVER': os.environ.get('RSCP_IMAP_SERVER'),
-            'EMAIL_USER': os.environ.get('RSCP_EMAIL_USER'),
-            'EMAIL_PASS': os.environ.get('RSCP_EMAIL_PASS'),
-            'EMAIL_PASS': os.environ.get('RSCP_EMAIL_PASS'),
-            'SECRET_KEY': os.environ.get('RSCP_SECRET_KEY'),
-            'SSO_CLIENT_ID': os.environ.get('RSCP_SSO_CLIENT_ID'),
-            'SSO_CLIENT_SECRET': os.environ.get('RSCP_SSO_CLIENT_SECRET'),
-            'SSO_DISCOVERY_URL': os.environ.get('RSCP_SSO_DISCOVERY_URL'),
-        }
-        
-        for key, env_val in env_overrides.items():
+        # Environment variable overrides (CONFIG_ENV_OVERRIDES) win over config.json
+        for key, var in CONFIG_ENV_OVERRIDES.items():
+            env_val = os.environ.get(var)
             if env_val:
                 config[key] = env_val
         
         # Update cache
         CONFIG_CACHE['data'] = config
-        CONFIG_CACHE['loaded_at'] = time.time()
+        CONFIG_CACHE['stamp'] = stamp
         
         return config.copy()
 
@@ -121,9 +162,8 @@ def save_config(new_config: Dict[str, Any]) -> bool:
             # Replace original with temp (atomic on most file systems)
             os.replace(temp_file, CONFIG_FILE)
             
-            # Update cache with new data immediately
-            CONFIG_CACHE['data'] = current
-            CONFIG_CACHE['loaded_at'] = time.time()
+            # Invalidate; the next load_config() re-applies env overrides
+            CONFIG_CACHE['stamp'] = None
             
             return True
         except Exception as e:
@@ -138,6 +178,62 @@ def get_file_age(filepath: str) -> float:
     except OSError:
         return 999.0
 
+_ISO_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def _is_iso_date(value) -> bool:
+    """Cheap shape check for YYYY-MM-DD strings (anything else is treated as pending)."""
+    return isinstance(value, str) and _ISO_DATE_RE.fullmatch(value) is not None
+
+# Columns sync_manifest prefetches for every package (read positionally)
+PREFETCH_PACKAGES_COLS = ('id', 'tracking_number', 'item_name', 'manual_date', 'status', 'date_scanned', 'sku')
+PREFETCH_PACKAGES_SQL = f"SELECT {', '.join(PREFETCH_PACKAGES_COLS)} FROM packages"
+
+# Fixed statements for the sync write phase. Kept as module constants so every
+# executemany reuses the same cached prepared statement on the connection.
+SYNC_DELETE_SQL = "DELETE FROM packages WHERE id = ?"
+# One UPSERT serves both new and matched packages, keyed on tracking_number
+# (UNIQUE) like the prefetch. For rows matched in the prefetch the
+# Python-computed values already follow these rules. A row stored under a
+# different item name is never renamed: sync_manifest skips those, and the
+# WHERE clause below guards the conflict path as well.
+SYNC_UPSERT_SQL = '''
+    INSERT INTO packages (tracking_number, item_name, date_expected, quantity, image_url, status, asin, source_url, sku)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(tracking_number) DO UPDATE SET
+        date_expected=COALESCE(packages.manual_date, excluded.date_expected),
+        quantity=excluded.quantity,
+        image_url=excluded.image_url,
+        status=CASE
+            WHEN packages.date_scanned IS NOT NULL
+             AND packages.status IN ('expected', 'past_due', 'pending', 'on_time', 'received')
+            THEN 'received' ELSE excluded.status END,
+        asin=excluded.asin,
+        source_url=excluded.source_url,
+        sku=COALESCE(NULLIF(packages.sku, ''), excluded.sku)
+    -- Unchanged rows are skipped so a re-sync only writes real changes to the WAL
+    WHERE packages.item_name IS excluded.item_name
+      AND (packages.date_expected, packages.quantity, packages.image_url,
+           packages.status, packages.asin, packages.source_url, packages.sku)
+      IS NOT (COALESCE(packages.manual_date, excluded.date_expected),
+              excluded.quantity, excluded.image_url,
+              CASE
+                WHEN packages.date_scanned IS NOT NULL
+                 AND packages.status IN ('expected', 'past_due', 'pending', 'on_time', 'received')
+                THEN 'received' ELSE excluded.status END,
+              excluded.asin, excluded.source_url,
+              COALESCE(NULLIF(packages.sku, ''), excluded.sku))
+'''
+
+def _stream_manifest_rows(path):
+    """Yield manifest data rows (header and blank lines skipped, as DictReader did)
+    as plain lists; sync_manifest resolves columns to indexes once."""
+    with open(path, mode='r', encoding='utf-8-sig', errors='replace', newline='') as f:
+        csv_reader = csv.reader(f)
+        next(csv_reader, None)
+        for row in csv_reader:
+            if row:
+                yield row
+
 def sync_manifest():
     """Reads manifest.csv and updates the packages table (Uses CSV module)."""
     global DATA_CACHE
@@ -151,6 +247,7 @@ def sync_manifest():
     # Check if sync is needed
     if mtime > DATA_CACHE['manifest_mtime'] or DATA_CACHE['last_sync_date'] != today:
         logger.info("Syncing Manifest to DB...")
+        conn = None
         try:
             # Robust CSV Reading
             with open(MANIFEST_FILE, mode='r', encoding='utf-8-sig', errors='replace') as f:
@@ -191,30 +288,77 @@ def sync_manifest():
                          seen_headers[h_clean] = 0
                     clean_headers.append(h_clean)
                 
-                reader = csv.DictReader(f, fieldnames=clean_headers)
-                rows = list(reader)
+            # Data rows are streamed by the loop below rather than materialized
+            rows = _stream_manifest_rows(MANIFEST_FILE)
             
             conn = get_db_connection()
             cur = conn.cursor()
             
             c = load_config()
             do_trim = c.get('AUTO_TRIM', False)
-            sixty_days_ago = today - datetime.timedelta(days=60)
+            # Dates are normalized to ISO YYYY-MM-DD, so plain string comparison orders them
+            today_str = today.isoformat()
+            sixty_str = (today - datetime.timedelta(days=60)).isoformat()
             
             skipped_count = 0
             
-            # Helper to get value from aliases
-            def get_val(row_dict, aliases):
+            # Resolve header aliases to column indexes once (first alias present wins)
+            col_idx = {h: i for i, h in enumerate(clean_headers)}
+            def first_col(aliases):
                 for a in aliases:
-                    if a in row_dict:
-                        return str(row_dict[a]).strip()
-                return ""
+                    if a in col_idx:
+                        return col_idx[a]
+                return None
+            def cols(aliases):
+                return [col_idx[a] for a in aliases if a in col_idx]
+            def cell(row, i):
+                return row[i].strip() if i is not None and i < len(row) else ""
+            
+            i_tracking = first_col(['TrackingNumber', 'Carrier Tracking #', 'Tracking Number', 'Tracking'])
+            i_order = first_col(['Order ID', 'Order Number', 'Order #', 'Reference Number'])
+            i_name = first_col(['ItemName', 'Title', 'Product Name', 'Item Description'])
+            i_date = first_col(['Date', 'Order Date', 'Purchase Date', 'Time'])
+            i_qty = first_col(['Quantity', 'Item Quantity', 'Qty', 'Order Quantity'])
+            i_img = first_col(['Image', 'ImageUrl', 'Photo', 'Image URL'])
+            i_asin = first_col(['ASIN', 'Item ID', 'ItemID'])
+            ebay_tracking_cols = cols(['TrackingNumber_1', 'TrackingNumber_2', 'TrackingNumber.1', 'TrackingNumber.2', 'TrackingNumber.3'])
+            url_cols = cols(['SourceURL', 'URL', 'PurchaseURL', 'Link', 'ProductLink', 'Product URL', 'View Order Detail'])
+            order_id_cols = cols(['Order ID', 'Order Number', 'Order #', 'Reference Number', 'Reference #', 'Ref Number', 'Order'])
+            
+            # Helper: expected / past_due / on_time relative to today
+            # (memoized per sync, since 'today' is fixed for the run)
+            @functools.lru_cache(maxsize=None)
+            def math_status(date_s):
+                if _is_iso_date(date_s):
+                    if date_s == today_str: return 'expected'
+                    elif date_s < today_str: return 'past_due'
+                return 'on_time'
 
             # Check for eBay duplicate headers
             has_duplicate_headers = 'TrackingNumber.1' in clean_headers
             
             ids_to_clean = set()
             
+            # Write lock for the whole sync, so the prefetched rows stay current
+            conn.execute('BEGIN IMMEDIATE')
+            
+            # Prefetch packages and mappings once instead of SELECTs per manifest row.
+            # Plain tuples: this walks the whole packages table, and zipping onto
+            # fixed keys is cheaper than building a Row and then dict(Row).
+            raw = conn.cursor()
+            raw.row_factory = None
+            # Keyed on tracking_number alone: it is UNIQUE, and the upsert conflicts on it
+            existing_by_tracking = {r[1]: dict(zip(PREFETCH_PACKAGES_COLS, r))
+                                    for r in raw.execute(PREFETCH_PACKAGES_SQL)}
+            mappings = {}
+            for package_name, inventory_sku in raw.execute("SELECT package_name, inventory_sku FROM product_mappings"):
+                mappings.setdefault(package_name, inventory_sku)
+            
+            # Writes are collected and applied with executemany after the loop
+            writes = {}  # tracking -> SYNC_UPSERT_SQL params, matched and new, in manifest order
+            delete_ids = set()
+            conflicting = []  # tracking numbers listed under a second item name
+            
             for row in rows:
                 tracking = ""
                 is_placeholder_manifest = False
@@ -228,13 +372,13 @@ def sync_manifest():
                     
                     real_tracking = ""
                     # Check the deduced duplicate names first
-                    for key in ['TrackingNumber_1', 'TrackingNumber_2', 'TrackingNumber.1', 'TrackingNumber.2', 'TrackingNumber.3']:
-                        val = str(row.get(key, '')).strip().replace('="', '').replace('"', '')
+                    for i in ebay_tracking_cols:
+                        val = cell(row, i).replace('="', '').replace('"', '')
                         if val:
                             real_tracking = val
                             break
                             
-                    order_id = str(row.get('TrackingNumber', '')).strip().replace('="', '').replace('"', '')
+                    order_id = cell(row, col_idx.get('TrackingNumber')).replace('="', '').replace('"', '')
                     
                     if real_tracking:
                         tracking = real_tracking
@@ -247,13 +391,13 @@ def sync_manifest():
                 else:
                     # Generic Format (Amazon, etc)
                     # Try known tracking aliases
-                    raw_tracking = get_val(row, ['TrackingNumber', 'Carrier Tracking #', 'Tracking Number', 'Tracking'])
+                    raw_tracking = cell(row, i_tracking)
                     tracking = raw_tracking.replace('="', '').replace('"', '').strip()
 
                 # Fallback: Use Order ID as tracking if tracking is missing?
                 if not tracking:
                      # Check Order ID
-                     oid = get_val(row, ['Order ID', 'Order Number', 'Order #', 'Reference Number'])
+                     oid = cell(row, i_order)
                      if oid:
                          tracking = oid.replace('="', '').replace('"', '').strip()
                          if tracking: is_placeholder_manifest = True
@@ -264,68 +408,71 @@ def sync_manifest():
                 
                 # Clean other fields
                 # Item Name Support
-                item_name = get_val(row, ['ItemName', 'Title', 'Product Name', 'Item Description']).replace('="', '').replace('"', '')
+                item_name = cell(row, i_name).replace('="', '').replace('"', '')
                 if not item_name: item_name = 'Unknown'
                 
                 # Date Support
-                date_val = get_val(row, ['Date', 'Order Date', 'Purchase Date', 'Time'])
+                date_val = cell(row, i_date)
                 date_str = parse_date(date_val)
                 
                 # Quantity Support
-                qty_val = get_val(row, ['Quantity', 'Item Quantity', 'Qty', 'Order Quantity'])
+                qty_val = cell(row, i_qty)
                 try:
                     qty = int(float(qty_val or 1))
                 except ValueError:
                     qty = 1
                 
                 # Image Support
-                img = get_val(row, ['Image', 'ImageUrl', 'Photo', 'Image URL'])
+                img = cell(row, i_img)
                 if img.lower() == 'nan': img = ""
                 
                 # ASIN Support
-                asin = get_val(row, ['ASIN', 'Item ID', 'ItemID']).replace('="', '').replace('"', '')
+                asin = cell(row, i_asin).replace('="', '').replace('"', '')
                 if asin.lower() == 'nan': asin = ""
                 
                 # Source URL Support
                 source_url = ""
-                for key in ['SourceURL', 'URL', 'PurchaseURL', 'Link', 'ProductLink', 'Product URL', 'View Order Detail']:
-                    if key in row:
-                        val = str(row[key]).strip()
-                        if val and val.lower() != 'nan':
-                            source_url = val
-                            break
-
-                # Composite Key Match: Strict sync to avoid merging different items
-                # We match on Tracking + Item Name to allows multiple items per tracking number
-                cur.execute("SELECT id, manual_date, status, date_scanned, quantity, item_name, sku FROM packages WHERE tracking_number = ? AND item_name = ?", (tracking, item_name))
-                existing = cur.fetchone()
+                for i in url_cols:
+                    val = cell(row, i)
+                    if val and val.lower() != 'nan':
+                        source_url = val
+                        break
+
+                # Match on tracking number. tracking_number is UNIQUE, so a second item
+                # under the same tracking can't get its own row; skip it rather than
+                # renaming the stored package (which flip-flopped on every sync)
+                existing = existing_by_tracking.get(tracking)
+                pending = writes.get(tracking)
+                known_name = existing['item_name'] if existing else (pending[1] if pending else None)
+                if known_name is not None and known_name != item_name:
+                    conflicting.append(tracking)
+                    continue
                 
-                status = 'on_time'
                 date_final = date_str
                 
-                if existing:
+                if existing is None and pending:
+                    # Listed again in this manifest: later row's values win (as an UPDATE would)
+                    sku = pending[8]
+                    if not sku:
+                        sku = mappings.get(item_name, sku)
+                    writes[tracking] = (tracking, item_name, date_str, qty, img, math_status(date_str), asin, source_url, sku)
+                    
+                elif existing:
                     # Update Existing Record
                     if existing['manual_date']:
                         date_final = existing['manual_date']
                     
                     # Calculate Math Status
-                    try:
-                         if date_final != "Pending":
-                            d_dt = datetime.datetime.strptime(date_final, '%Y-%m-%d').date()
-                            if d_dt == today: status = 'expected'
-                            elif d_dt < today: status = 'past_due'
-                    except ValueError:
-                        pass 
+                    status = math_status(date_final)
                     
                     # Trim Check logic ...
                     if do_trim and status == 'past_due' and existing['date_scanned']: 
-                        try:
-                            d_dt = datetime.datetime.strptime(date_final, '%Y-%m-%d').date()
-                            if d_dt < sixty_days_ago: 
-                                cur.execute("DELETE FROM packages WHERE id = ?", (existing['id'],))
-                                continue
-                        except ValueError:
-                            pass
+                        # past_due implies date_final is a valid ISO date
+                        if date_final < sixty_str:
+                            delete_ids.add(existing['id'])
+                            del existing_by_tracking[tracking]
+                            writes.pop(tracking, None)
+                            continue
 
                     if existing['status'] in ['expected', 'past_due', 'pending', 'on_time', 'received']:
                          if existing['date_scanned']:
@@ -334,40 +481,27 @@ def sync_manifest():
                     # Check mapping for update as well
                     sku = existing['sku']
                     if not sku:
-                         mapping = conn.execute("SELECT inventory_sku FROM product_mappings WHERE package_name = ?", (item_name,)).fetchone()
-                         if mapping: sku = mapping['inventory_sku']
+                         sku = mappings.get(item_name, sku)
 
                     # Update strict match
-                    cur.execute('''
-                        UPDATE packages SET 
-                        date_expected=?, quantity=?, image_url=?, status=?, asin=?, source_url=?, sku=?
-                        WHERE id=?
-                    ''', (date_final, qty, img, status, asin, source_url, sku, existing['id']))
+                    writes[tracking] = (tracking, item_name, date_final, qty, img, status, asin, source_url, sku)
+                    existing['status'] = status
+                    existing['sku'] = sku
                     
                 else:
                     # New Package (Distinct Item)
-                    try:
-                        if date_str != "Pending":
-                            d_dt = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-                            if d_dt == today: status = 'expected'
-                            elif d_dt < today: status = 'past_due'
-                            else: status = 'on_time'
-                    except ValueError:
-                        pass 
+                    status = math_status(date_str)
 
                     # Auto-Map Check
-                    sku = None
-                    mapping = conn.execute("SELECT inventory_sku FROM product_mappings WHERE package_name = ?", (item_name,)).fetchone()
-                    if mapping:
-                        sku = mapping['inventory_sku']
+                    sku = mappings.get(item_name)
 
                     # --- ORDER ID MERGE LOGIC ---
                     current_order_id = None
                     
                     # 1. Explicit Column Lookup (The User Asked for This!)
                     # Check for generic "Order ID" keys
-                    for key in ['Order ID', 'Order Number', 'Order #', 'Reference Number', 'Reference #', 'Ref Number', 'Order']:
-                        val = str(row.get(key, '')).strip()
+                    for i in order_id_cols:
+                        val = cell(row, i)
                         if val and val.lower() != 'nan' and len(val) > 4:
                             # Clean it up slightly?
                             current_order_id = val.replace('="', '').replace('"', '').strip()
@@ -383,7 +517,8 @@ def sync_manifest():
                     if current_order_id:
                         placeholder = f"ORDER-{current_order_id}%" # Use wildcard
                         # Find all email records for this order (suffix 01, 02, etc)
-                        email_recs = conn.execute("SELECT * FROM packages WHERE tracking_number LIKE ?", (placeholder,)).fetchall()
+                        email_recs = [r for r in conn.execute("SELECT * FROM packages WHERE tracking_number LIKE ?", (placeholder,))
+                                      if r['id'] not in delete_ids]
                         
                         if email_recs:
                             best_match = None
@@ -415,7 +550,7 @@ def sync_manifest():
                                     img = best_match['image_url']
                                 
                                 # Trust Email Quantity
-                                email_qty = best_match.get('quantity', 1)
+                                email_qty = best_match['quantity']
                                 if email_qty and email_qty > 0:
                                     qty = email_qty
 
@@ -427,18 +562,19 @@ def sync_manifest():
                                 # If 'ORDER-123' is gone, '1Z999' can't find the image.
                                 # So, if is_placeholder_manifest, we KEEP the 'ORDER-123' record so it can serve the REAL tracking later.
                                 if not is_placeholder_manifest:
-                                    try:
-                                        cur.execute("DELETE FROM packages WHERE id = ?", (best_match['id'],))
-                                    except Exception as c_e:
-                                        logger.error(f"Failed to cleanup placeholder {best_match['tracking_number']}: {c_e}")
-
-                    cur.execute('''
-                        INSERT INTO packages (tracking_number, item_name, date_expected, quantity, image_url, status, asin, source_url, sku)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (tracking, item_name, date_str, qty, img, status, asin, source_url, sku))
+                                    delete_ids.add(best_match['id'])
+
+                    writes[tracking] = (tracking, item_name, date_str, qty, img, status, asin, source_url, sku)
+            
+            if delete_ids:
+                cur.executemany(SYNC_DELETE_SQL, [(i,) for i in delete_ids])
+            cur.executemany(SYNC_UPSERT_SQL, writes.values())
             
             if skipped_count > 0:
                 logger.info(f"Manifest Sync: Skipped {skipped_count} rows due to missing tracking numbers.")
+            if conflicting:
+                logger.warning(f"Manifest Sync: Skipped {len(conflicting)} rows whose tracking number is already "
+                               f"used by a different item: {', '.join(sorted(set(conflicting))[:10])}")
             
             # Batch Cleanup of Invalid Order IDs
             if ids_to_clean:
@@ -454,14 +590,36 @@ def sync_manifest():
             
             conn.commit()
             conn.close()
+            conn = None
             
             DATA_CACHE['manifest_mtime'] = mtime
             DATA_CACHE['last_sync_date'] = today
+            invalidate_stats_cache()
             
         except Exception as e:
             logger.error(f"Sync Manifest Error: {e}")
-
-
+            if conn is not None:
+                conn.rollback()
+                conn.close()
+
+
+
+# All dashboard counters in one statement. Scalar subqueries (rather than one
+# CASE-aggregate table scan) keep each count an index search on
+# date_expected / status.
+DASHBOARD_STATS_SQL = """
+    SELECT
+        e.total AS exp_total,
+        e.scanned AS exp_scanned,
+        (SELECT count(*) FROM packages WHERE status = 'past_due' AND date_scanned IS NULL) AS past_due,
+        (SELECT count(*) FROM packages WHERE status = 'return_pending') AS returns,
+        (SELECT count(*) FROM packages WHERE status = 'refunded' AND refund_date > ?3) AS refunded
+    FROM (
+        SELECT count(*) AS total, count(date_scanned) AS scanned FROM packages
+        WHERE date_expected = ?1
+          AND (date_scanned IS NULL OR date(date_scanned, 'localtime') = ?2)
+    ) AS e
+"""
 
 def get_dashboard_stats() -> Dict[str, Any]:
     # Note: sync_manifest() is now called by background task scheduler (every 5 min)
@@ -474,45 +632,24 @@ def get_dashboard_stats() -> Dict[str, Any]:
         "refunded": {"count": 0, "status": "green"}
     }
     
-    conn = get_db_connection()
     today_str = datetime.date.today().strftime('%Y-%m-%d')
     thirty_days_ago = (datetime.date.today() - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
 
-    # Expected
     # Expected Today
     # Total = count of items where date_expected == today
     #   BUT exclude packages already scanned on a PRIOR day (they arrived early)
     # Scanned = count of those items that have date_scanned today
+    conn = get_db_connection()
+    try:
+        row = conn.execute(DASHBOARD_STATS_SQL, (today_str, today_str, thirty_days_ago)).fetchone()
+    finally:
+        conn.close()
     
-    expected_rows = conn.execute("""
-        SELECT date_scanned, status FROM packages 
-        WHERE date_expected = ?
-          AND (date_scanned IS NULL OR date(date_scanned, 'localtime') = ?)
-    """, (today_str, today_str)).fetchall()
-    
-    total_expected = len(expected_rows)
-    scanned_count = 0
-    
-    for r in expected_rows:
-        if r['date_scanned']:
-            scanned_count += 1
-            
-    stats["expected"]["total"] = total_expected
-    stats["expected"]["scanned"] = scanned_count
-            
-    # Past Due
-    pd_count = conn.execute("SELECT count(*) as c FROM packages WHERE status='past_due' AND date_scanned IS NULL").fetchone()['c']
-    stats["past_due"]["count"] = pd_count
-    
-    # Returns
-    ret_count = conn.execute("SELECT count(*) as c FROM packages WHERE status='return_pending'").fetchone()['c']
-    stats["returns"]["open"] = ret_count
-    
-    # Refunded
-    ref_count = conn.execute("SELECT count(*) as c FROM packages WHERE status='refunded' AND refund_date > ?", (thirty_days_ago,)).fetchone()['c']
-    stats["refunded"]["count"] = ref_count
-    
-    conn.close()
+    stats["expected"]["total"] = row['exp_total']
+    stats["expected"]["scanned"] = row['exp_scanned']
+    stats["past_due"]["count"] = row['past_due']
+    stats["returns"]["open"] = row['returns']
+    stats["refunded"]["count"] = row['refunded']
     
     # Colors
     e = stats["expected"]
@@ -530,6 +667,13 @@ def get_dashboard_stats() -> Dict[str, Any]:
     
     return stats
 
+def _local_day_start_utc(day: datetime.date) -> str:
+    """Local midnight of `day` as a UTC 'YYYY-MM-DD HH:MM:SS' string, matching
+    CURRENT_TIMESTAMP columns, so `ts >= ?` replaces date(ts, 'localtime') >= ?
+    and can use the timestamp index."""
+    local_midnight = datetime.datetime.combine(day, datetime.time()).astimezone()
+    return local_midnight.astimezone(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
 def get_analytics_stats(days: int = 14) -> List[Dict[str, Any]]:
     """Returns daily scan counts for the last N days."""
     conn = get_db_connection()
@@ -548,10 +692,10 @@ def get_analytics_stats(days: int = 14) -> List[Dict[str, Any]]:
             SELECT date(timestamp, 'localtime') as day, count(*) as c 
             FROM history 
             WHERE action='received' 
-            AND date(timestamp, 'localtime') >= ? 
+            AND timestamp >= ? 
             GROUP BY day
         """
-        rows = conn.execute(query, (start_date.strftime('%Y-%m-%d'),)).fetchall()
+        rows = conn.execute(query, (_local_day_start_utc(start_date),)).fetchall()
         
         for r in rows:
             if r['day'] in results:
@@ -565,12 +709,22 @@ def get_analytics_stats(days: int = 14) -> List[Dict[str, Any]]:
     # Convert to sorted list
     return [{"date": k, "count": v} for k, v in results.items()]
 
+# Reused across alerts so bursts share one TCP/TLS connection to the webhook host
+_WEBHOOK_SESSION = None
+
+def _webhook_session():
+    global _WEBHOOK_SESSION
+    if _WEBHOOK_SESSION is None:
+        import requests
+        session = requests.Session()
+        session.headers['User-Agent'] = 'RSCP-Bot'
+        _WEBHOOK_SESSION = session
+    return _WEBHOOK_SESSION
+
 def send_priority_alert(tracking: str, item_name: str, quantity: str, user: str, webhook_url_enc: str, secret_key: str):
     """Sends a Webhook POST request (Async)."""
     try:
         from app.utils.helpers import reveal_string
-        import urllib.request
-        import json
         
         # 1. Reveal URL
         url = reveal_string(webhook_url_enc, secret_key)
@@ -585,18 +739,36 @@ def send_priority_alert(tracking: str, item_name: str, quantity: str, user: str,
             "text": msg     # Slack
         }
         
-        req = urllib.request.Request(
-            url, 
-            data=json.dumps(payload).encode('utf-8'),
-            headers={'Content-Type': 'application/json', 'User-Agent': 'RSCP-Bot'}
-        )
-        
-        urllib.request.urlopen(req, timeout=5)
+        resp = _webhook_session().post(url, json=payload, timeout=5)
+        resp.raise_for_status()
         logger.info(f"Webhook alert sent for {tracking}")
         
     except Exception as e:
         logger.error(f"Webhook error: {e}")
 
+# Priority alerts go out on a small shared pool instead of a new thread per scan
+_WEBHOOK_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='webhook')
+atexit.register(_WEBHOOK_POOL.shutdown, wait=False)
+
+# Statuses that become 'received' when scanned
+RECEIVABLE_STATUSES = ('expected', 'past_due', 'pending', 'on_time')
+INSERT_HISTORY_SQL = "INSERT INTO history (package_id, user_id, action, details) VALUES (?, ?, ?, ?)"
+# User id + every package on the tracking number in one round-trip. The LEFT
+# JOIN always yields a row, so user_id is available even when id is NULL
+# (no package yet -> auto-manifest).
+RECEIPT_LOOKUP_SQL = """
+    SELECT (SELECT id FROM users WHERE username = ?) AS user_id,
+           p.id, p.status, p.priority, p.quantity
+    FROM (SELECT 1) LEFT JOIN packages p ON p.tracking_number = ?
+"""
+RECEIPT_AUTO_INSERT_SQL = """
+    INSERT INTO packages (tracking_number, item_name, quantity, status, source, date_expected, date_scanned, sku)
+    VALUES (?, ?, ?, 'received', 'scan', CURRENT_DATE, CURRENT_TIMESTAMP,
+            (SELECT inventory_sku FROM product_mappings WHERE package_name = ?))
+    RETURNING id
+"""
+RECEIPT_UPDATE_SQL = "UPDATE packages SET date_scanned=CURRENT_TIMESTAMP, status=? WHERE id=?"
+
 def log_receipt(tracking: str, item_name: str, quantity: str, user: str, conn=None) -> None:
     # 1. Add to History Table
     # 2. Update Package as Scanned
@@ -612,79 +784,52 @@ def log_receipt(tracking: str, item_name: str, quantity: str, user: str, conn=No
         except ImportError:
             conn = get_db_connection()
             close_conn = True
+    priority_count = 0
     try:
-        # Get User ID
-        res = conn.execute("SELECT id FROM users WHERE username = ?", (user,)).fetchone()
-        user_id = res['id'] if res else None
+        # One write transaction for the lookup and all items on this tracking number
+        with write_transaction(conn):
+            # Get User ID + ALL matching packages (Handle multiple items with same tracking)
+            rows = conn.execute(RECEIPT_LOOKUP_SQL, (user, tracking)).fetchall()
+            user_id = rows[0]['user_id']
+            packages = [r for r in rows if r['id'] is not None]
         
-        # Get ALL matching packages (Handle multiple items with same tracking)
-        packages = conn.execute("SELECT id, status, priority, quantity FROM packages WHERE tracking_number = ?", (tracking,)).fetchall()
-        
-        if packages:
-            for pkg in packages:
-                pkg_id = pkg['id']
-                is_priority = bool(pkg['priority']) if pkg['priority'] else False
-                qty = pkg['quantity'] or 1
-                
-                # Update Package
-                current_status = pkg['status']
-                new_status = current_status
-                if current_status in ['expected', 'past_due', 'pending', 'on_time']:
-                     new_status = 'received'
-                
-                conn.execute("UPDATE packages SET date_scanned=CURRENT_TIMESTAMP, status=? WHERE id=?", (new_status, pkg_id))
-                
-                # Log History for EACH item
-                conn.execute("INSERT INTO history (package_id, user_id, action, details) VALUES (?, ?, ?, ?)", 
-                             (pkg_id, user_id, 'received', f"Qty: {qty}"))
-                
-                # Trigger Webhook if Priority (for each priority item)
-                if is_priority:
-                     conf = load_config()
-                     if conf.get('WEBHOOK_ENABLED') and conf.get('WEBHOOK_URL'):
-                         enc_url = conf.get('WEBHOOK_URL')
-                         key = conf.get('SECRET_KEY', 'dev_key_fallback')
-                         
-                         import threading
-                         # Use item_name passed or fetch? main.py passes "Unknown" usually if not found? 
-                         # But here we found it. We should fetch name if we want accurate alerts.
-                         # Since this loop updates IDs, let's fetch name?
-                         # Or just pass the generic 'item_name' from arg (which comes from main.py's fetchone).
-                         # Simplest: use arg.
-                         t = threading.Thread(target=send_priority_alert, args=(tracking, item_name, quantity, user, enc_url, key))
-                         t.start()
-
-        else:
-            # Create Package (Auto-Manifest)
-            # Check mapping for auto-manifest items too
-            sku = None
-            mapping = conn.execute("SELECT inventory_sku FROM product_mappings WHERE package_name = ?", (item_name,)).fetchone()
-            if mapping: sku = mapping['inventory_sku']
-
-            conn.execute('''
-                INSERT INTO packages (tracking_number, item_name, quantity, status, source, date_expected, date_scanned, sku)
-                VALUES (?, ?, ?, 'received', 'scan', CURRENT_DATE, CURRENT_TIMESTAMP, ?)
-            ''', (tracking, item_name, quantity, sku))
+            if packages:
+                updates = []
+                history_rows = []
+                for pkg in packages:
+                    # Update Package
+                    current_status = pkg['status']
+                    new_status = 'received' if current_status in RECEIVABLE_STATUSES else current_status
+                    updates.append((new_status, pkg['id']))
+                    # Log History for EACH item
+                    history_rows.append((pkg['id'], user_id, 'received', f"Qty: {pkg['quantity'] or 1}"))
             
-            # Get the new ID
-            pkg_id = conn.execute("SELECT id FROM packages WHERE tracking_number = ?", (tracking,)).fetchone()['id']
+                conn.executemany(RECEIPT_UPDATE_SQL, updates)
+                conn.executemany(INSERT_HISTORY_SQL, history_rows)
             
-            # Log History
-            conn.execute("INSERT INTO history (package_id, user_id, action, details) VALUES (?, ?, ?, ?)", 
-                         (pkg_id, user_id, 'received', f"Qty: {quantity}"))
+                # Webhook fires once per priority item, after the commit below
+                priority_count = sum(1 for pkg in packages if pkg['priority'])
+
+            else:
+                # Create Package (Auto-Manifest)
+                # Check mapping for auto-manifest items too (sku subquery); RETURNING gives the new ID
+                pkg_id = conn.execute(RECEIPT_AUTO_INSERT_SQL, (tracking, item_name, quantity, item_name)).fetchone()['id']
+            
+                # Log History
+                conn.execute(INSERT_HISTORY_SQL, (pkg_id, user_id, 'received', f"Qty: {quantity}"))
         
-        conn.commit()
+        invalidate_stats_cache()
         
         # Trigger Webhook if Priority
-        if is_priority:
+        if priority_count:
             conf = load_config()
             if conf.get('WEBHOOK_ENABLED') and conf.get('WEBHOOK_URL'):
                 enc_url = conf.get('WEBHOOK_URL')
                 key = conf.get('SECRET_KEY', 'dev_key_fallback')
                 
-                import threading
-                t = threading.Thread(target=send_priority_alert, args=(tracking, item_name, quantity, user, enc_url, key))
-                t.start()
+                # Use the generic 'item_name' from arg (which comes from main.py's fetchone).
+                for _ in range(priority_count):
+                    _WEBHOOK_POOL.submit(send_priority_alert, tracking, item_name, quantity, user, enc_url, key)
         
     except Exception as e:
         logger.error(f"Log receipt error: {e}")
@@ -696,17 +841,26 @@ def get_scan_count(days: int = 1) -> int:
     conn = get_db_connection()
     try:
         # Calculate start date
-        start_date = (datetime.date.today() - datetime.timedelta(days=days-1)).strftime('%Y-%m-%d')
+        start_date = datetime.date.today() - datetime.timedelta(days=days-1)
         
         count = conn.execute("""
             SELECT count(*) as c FROM history 
             WHERE action='received' 
-            AND date(timestamp, 'localtime') >= ?
-        """, (start_date,)).fetchone()['c']
+            AND timestamp >= ?
+        """, (_local_day_start_utc(start_date),)).fetchone()['c']
         return count
     finally:
         conn.close()
 
+# EXISTS stops at the first history row; both sides are index point lookups
+# (packages.tracking_number UNIQUE, idx_history_pkg)
+CHECK_HISTORY_SQL = """
+    SELECT EXISTS(
+        SELECT 1 FROM packages p JOIN history h ON h.package_id = p.id
+        WHERE p.tracking_number = ?
+    )
+"""
+
 def check_history(tracking: str, conn=None) -> bool:
     close_conn = False
     if conn is None:
@@ -721,14 +875,13 @@ def check_history(tracking: str, conn=None) -> bool:
             conn = get_db_connection()
             close_conn = True
     try:
-        res = conn.execute("SELECT count(*) as c FROM history h JOIN packages p ON h.package_id = p.id WHERE p.tracking_number = ?", (tracking,)).fetchone()
-        return res['c'] > 0
+        return bool(conn.execute(CHECK_HISTORY_SQL, (tracking,)).fetchone()[0])
     finally:
         if close_conn:
             conn.close()
 
 # --- EMAIL INGEST INTEGRATION ---
-from email_ingest import check_amazon_emails
+from email_ingest import fetch_order_emails, mark_emails_seen
 
 def sync_email_ingest():
     """Run the email ingest process."""
@@ -749,10 +902,11 @@ def sync_email_ingest():
         logger.info(f"Starting Email Ingest for {user}...")
         
         # 1. Fetch Emails
-        # We use check_amazon_emails which handles both Amazon and eBay logic now
-        results = check_amazon_emails(imap_server, user, password)
+        # Handles both Amazon and eBay; emails are marked read once saved (step 3)
+        results, cursor, seen = fetch_order_emails(imap_server, user, password)
         
         if not results:
+            mark_emails_seen(imap_server, user, password, cursor, seen)
             logger.info("No new email orders found.")
             return {"status": "success", "count": 0, "message": "No new emails found"}
             
@@ -789,6 +943,9 @@ def sync_email_ingest():
         conn.commit()
         conn.close()
         
+        # 3. Mark the handled emails read
+        mark_emails_seen(imap_server, user, password, cursor, seen)
+        
         logger.info(f"Email Ingest Complete. Imported {count} new items.")
         return {"status": "success", "count": count, "message": f"Imported {count} items"}
         
@@ -1,53 +1,105 @@
 import sqlite3
 import os
 import logging
+from contextlib import contextmanager
 from app.utils.helpers import parse_date
 
 logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
 import sys
-if 'pytest' in sys.modules or os.environ.get('TESTING') == 'True':
+if os.environ.get('RSCP_DB_PATH'):
+    # Explicit override, e.g. a per-session temp file for a test run
+    DB_PATH = os.environ['RSCP_DB_PATH']
+elif 'pytest' in sys.modules or os.environ.get('TESTING') == 'True':
     DB_PATH = os.path.join(BASE_DIR, 'tests', 'test_fallback.db')
 else:
     DB_PATH = os.path.join(BASE_DIR, 'rscp.db')
 
-def get_db_connection():
+# journal_mode=WAL is stored in the database file, so it is issued once per path
+# per process; the rest are per-connection and must run on every new connection.
+_WAL_PATHS = set()
+_CONN_PRAGMAS = '''
+    PRAGMA synchronous=NORMAL;
+    PRAGMA wal_autocheckpoint=1000;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+'''
+
+def get_db_path():
+    """Database file for the current app (app.config['DATABASE']), else DB_PATH."""
+    try:
+        from flask import current_app
+        if current_app:
+            return current_app.config.get('DATABASE', DB_PATH)
+    except Exception:
+        pass
+    return DB_PATH
+
+def get_db_connection(check_same_thread=True):
     """Returns a NEW connection to the SQLite database.
     
     Performance optimizations:
-    - timeout=10: Prevents indefinite blocking on locked database
+    - timeout=10: Busy timeout, writers wait on a locked database instead of
+      failing immediately with SQLITE_BUSY
     - WAL mode: Allows concurrent reads during writes
+    - synchronous=NORMAL: Safe under WAL, avoids an fsync on every commit
+    - wal_autocheckpoint: Keeps the WAL file bounded under steady writes
+    - temp_store=MEMORY / cache_size=-65536 (64MB): Sorts and temp b-trees
+      stay in RAM, hot pages stay cached
+    - mmap_size=256MB: Reads come straight from the page cache via mmap
+    - cached_statements=256: Room for the fixed hot-path SQL strings so
+      repeated queries on a connection skip the SQL compiler
     
     Note: For request-scoped connections, use get_request_db() instead
-    to avoid creating multiple connections per request.
+    to avoid creating multiple connections per request. Pass
+    check_same_thread=False only for connections handed between threads
+    (see app.services.db_pool).
     """
-    path = DB_PATH
-    try:
-        from flask import current_app
-        if current_app:
-            path = current_app.config.get('DATABASE', DB_PATH)
-    except Exception:
-        pass
-        
-    conn = sqlite3.connect(path, timeout=10)
+    path = get_db_path()
+    conn = sqlite3.connect(path, timeout=10, cached_statements=256,
+                           check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
     # Enable WAL mode for better concurrency (only needs to be set once per DB)
     # WAL mode doesn't work with :memory: databases
     if path != ':memory:':
         try:
-            conn.execute('PRAGMA journal_mode=WAL')
-            conn.execute('PRAGMA synchronous=NORMAL')
+            if path not in _WAL_PATHS:
+                conn.execute('PRAGMA journal_mode=WAL')  # persistent in the DB file
+                _WAL_PATHS.add(path)
+            conn.executescript(_CONN_PRAGMAS)  # per-connection settings, one call
         except sqlite3.OperationalError as e:
             logger.warning(f"Failed to enable WAL mode or synchronous NORMAL: {e}. Falling back to default journal mode.")
     return conn
 
 
+@contextmanager
+def write_transaction(conn):
+    """Explicit BEGIN IMMEDIATE ... COMMIT around a batch of writes.
+
+    Taking the write lock up front avoids a deferred transaction failing with
+    SQLITE_BUSY when it upgrades from read to write. If the connection already
+    has a transaction open it is joined, and committed along with this one.
+    Rolls back and re-raises on error.
+    """
+    if not conn.in_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
 def get_request_db():
     """Get a database connection scoped to the current Flask request.
     
     Uses Flask's g object to share a single connection per request,
-    reducing connection overhead significantly.
+    reducing connection overhead significantly. The connection is borrowed
+    from the process pool (app.services.db_pool), so requests reuse warm
+    connections instead of reopening the .db/-wal/-shm files each time.
     
     Usage:
         from app.services.db import get_request_db
@@ -59,7 +111,8 @@ def get_request_db():
         from flask import g, has_app_context
         if has_app_context():
             if 'db' not in g:
-                g.db = get_db_connection()
+                from app.services.db_pool import get_pool
+                g.db = get_pool().borrow()
             return g.db
     except RuntimeError:
         # Not in app context (background thread, CLI, etc.)
@@ -70,15 +123,18 @@ def get_request_db():
 
 
 def close_request_db(error=None):
-    """Close the request-scoped database connection.
+    """Return the request-scoped database connection to the pool.
     
     Called automatically by Flask teardown if init_app() was called.
+    Uncommitted work is rolled back; a connection the handler closed
+    itself is discarded rather than pooled.
     """
     try:
         from flask import g
         db = g.pop('db', None)
         if db is not None:
-            db.close()
+            from app.services.db_pool import get_pool
+            get_pool().release(db)
     except RuntimeError:
         pass
 
@@ -149,10 +205,8 @@ def init_db():
         
         # Indexes for performance
         cur.execute('CREATE INDEX IF NOT EXISTS idx_tracking ON packages (tracking_number)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_status ON packages (status)')
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_date_expected ON packages (date_expected)')
-        
-        cur.execute('CREATE INDEX IF NOT EXISTS idx_date_expected ON packages (date_expected)')
+        # Covers the dashboard "expected today" count (date_expected + date_scanned only)
+        cur.execute('CREATE INDEX IF NOT EXISTS idx_pkg_expected_scanned ON packages (date_expected, date_scanned)')
         
         # 4. Product Mappings (V2.5.0)
         cur.execute('''
@@ -0,0 +1,138 @@
+import os
+import queue
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from app.services.db import get_db_connection, get_db_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 5
+# Run PRAGMA optimize on a pooled connection every this many borrows, so planner
+# stats keep up with tables that grow steadily (error_logs, inventory_transactions)
+OPTIMIZE_EVERY = 1000
+
+class SQLiteConnectionPool:
+    """Small pool of reusable SQLite connections.
+
+    Connections come from get_db_connection(), so the pragmas are applied once
+    when a connection is opened rather than on every use. Connections are opened
+    lazily up to `size`; if the pool is empty a temporary connection is opened
+    and closed on release instead of blocking the caller.
+
+    Fork-safe: a pool inherited by a gunicorn worker is discarded and refilled
+    in the child, since SQLite connections must not cross a fork.
+
+    Usage:
+        with get_pool().acquire() as conn:
+            conn.execute(...)
+            conn.commit()
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = max(1, int(size))
+        self._queue = queue.LifoQueue(maxsize=self.size)
+        self._pid = os.getpid()
+        # Borrowed connections: id(conn) -> (path, uses), for release()
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+
+    def _reset_after_fork(self):
+        # Drop (don't close) connections owned by the parent process
+        self._queue = queue.LifoQueue(maxsize=self.size)
+        self._leases = {}
+        self._leases_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _get(self, path):
+        """Return (conn, uses) - uses counts borrows since the last PRAGMA optimize."""
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+        while True:
+            try:
+                conn_path, conn, uses = self._queue.get_nowait()
+            except queue.Empty:
+                return get_db_connection(check_same_thread=False), 0
+            if conn_path == path:
+                return conn, uses
+            # DB path changed (e.g. app.config['DATABASE'] in tests) - discard
+            conn.close()
+
+    def _put(self, path, conn, uses):
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        uses += 1
+        if uses >= OPTIMIZE_EVERY:
+            # Cheap: only re-analyzes tables whose stats look stale
+            try:
+                conn.execute('PRAGMA optimize')
+            except sqlite3.Error as e:
+                logger.warning(f"PRAGMA optimize failed: {e}")
+            uses = 0
+        try:
+            self._queue.put_nowait((path, conn, uses))
+        except queue.Full:
+            conn.close()
+
+    def borrow(self):
+        """Take a connection out of the pool; hand it back with release()."""
+        path = get_db_path()
+        conn, uses = self._get(path)
+        with self._leases_lock:
+            self._leases[id(conn)] = (path, uses)
+        return conn
+
+    def release(self, conn):
+        """Return a borrowed connection. Anything left open is rolled back."""
+        with self._leases_lock:
+            lease = self._leases.pop(id(conn), None)
+        if lease is None:
+            conn.close()  # not borrowed here (e.g. taken before a fork)
+            return
+        path, uses = lease
+        # Uncommitted work (e.g. after an IntegrityError) never leaks to the next borrower
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()  # broken connection, don't pool it
+        else:
+            self._put(path, conn, uses)
+
+    @contextmanager
+    def acquire(self):
+        """Borrow a connection. Commit inside the block; anything left open is rolled back."""
+        conn = self.borrow()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close every idle pooled connection."""
+        while True:
+            try:
+                _, conn, _ = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool():
+    """Process-wide pool, sized from config['DB_POOL_SIZE'] (default 5)."""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                size = DEFAULT_POOL_SIZE
+                try:
+                    from app.services.data_manager import load_config
+                    size = int(load_config().get('DB_POOL_SIZE', DEFAULT_POOL_SIZE))
+                except Exception as e:
+                    logger.warning(f"Using default DB pool size: {e}")
+                _POOL = SQLiteConnectionPool(size)
+    return _POOL
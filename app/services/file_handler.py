@@ -3,50 +3,83 @@ import os
 import contextlib
 from typing import Generator, TextIO, Union
 
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
 class SimpleFileLock:
-    """Simple cross-platform file locking using a .lock file."""
+    """Cross-platform exclusive lock on a .lock file (fcntl.flock / msvcrt.locking).
+
+    The kernel drops the lock when the holder's fd closes or its process dies,
+    so there is no stale-lock cleanup. The .lock file itself is left in place.
+    """
+    POLL_INTERVAL = 0.01  # seconds between non-blocking attempts while waiting
+
     def __init__(self, file_path: str, timeout: int = 5):
         self.lock_file = file_path + ".lock"
         self.timeout = timeout
+        self._fd = None
 
-    def __enter__(self):
-        start_time = time.time()
-        while os.path.exists(self.lock_file):
-            # Check for stale lock (older than 30s)
-            try:
-                if time.time() - os.path.getmtime(self.lock_file) > 30:
-                    os.remove(self.lock_file)
-                    break
-            except OSError: 
-                pass
-            
-            if time.time() - start_time > self.timeout:
-                raise TimeoutError(f"Could not acquire lock for {self.lock_file}")
-            time.sleep(0.1)
-        
-        # Acquire lock
+    def _try_lock(self, fd: int) -> bool:
         try:
-            with open(self.lock_file, 'w') as f:
-                f.write(str(os.getpid()))
+            if os.name == 'nt':
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
         except OSError:
-            pass # Race condition potential, but acceptable for this scale
+            return False
+
+    def __enter__(self):
+        fd = os.open(self.lock_file, os.O_CREAT | os.O_RDWR)
+        deadline = time.monotonic() + self.timeout
+        while not self._try_lock(fd):
+            if time.monotonic() >= deadline:
+                os.close(fd)
+                raise TimeoutError(f"Could not acquire lock for {self.lock_file}")
+            time.sleep(self.POLL_INTERVAL)
+        self._fd = fd
+        return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
         try:
-            if os.path.exists(self.lock_file):
-                os.remove(self.lock_file)
-        except OSError: 
+            if os.name == 'nt':
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        except OSError:
             pass
+        finally:
+            os.close(fd)
+
+def _fsync_dir(dir_path: str) -> None:
+    """Persist a rename by fsyncing its directory (POSIX only)."""
+    if os.name != 'posix':
+        return
+    fd = os.open(dir_path or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 @contextlib.contextmanager
 def atomic_write(file_path: str, mode: str = 'w', encoding: str = 'utf-8') -> Generator[TextIO, None, None]:
-    """Safe write: Write to .tmp then rename to target."""
+    """Safe write: Write to .tmp, fsync, then rename to target."""
     temp_path = file_path + ".tmp"
     try:
         with open(temp_path, mode, encoding=encoding) as f:
             yield f
+            # Data must be on disk before the rename, or a crash can leave an empty file
+            f.flush()
+            os.fsync(f.fileno())
         # Atomic rename (replace)
         os.replace(temp_path, file_path)
+        _fsync_dir(os.path.dirname(file_path))
     except Exception as e:
         if os.path.exists(temp_path):
             try: os.remove(temp_path)
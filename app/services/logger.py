@@ -1,14 +1,90 @@
+import atexit
+import datetime
+import queue
+import threading
+import time
 import traceback
 import logging
 from flask import g
-from app.services.db import get_db_connection
+from app.services.db import write_transaction
+from app.services.db_pool import get_pool
+from app.utils.errors import RscpError
 
 # Configure standard logger fallback
 logger = logging.getLogger(__name__)
 
+# Background writer: error_logs rows are queued and committed in batches by a
+# daemon thread, so the request that logged them doesn't wait on the DB.
+# Bounded so an error storm can't grow memory without limit; overflow rows
+# only reach the standard logger.
+_ERROR_QUEUE = queue.Queue(maxsize=10000)
+_BATCH_SIZE = 500
+_FLUSH_INTERVAL = 0.25  # seconds
+_INSERT_SQL = '''
+    INSERT INTO error_logs (timestamp, level, source, message, trace, user_id, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+_writer_lock = threading.Lock()
+_writer_thread = None
+
+def bulk_insert_logs(rows):
+    """
+    Insert many error_logs rows in one transaction (executemany, one commit).
+    Each row is (timestamp, level, source, message, trace, user_id, status).
+    Use this instead of an INSERT + commit per row when seeding or importing logs.
+    Returns True on success.
+    """
+    try:
+        # Pooled connection: the writer reuses one configured connection across batches
+        with get_pool().acquire() as conn, write_transaction(conn):
+            conn.executemany(_INSERT_SQL, rows)
+        return True
+    except Exception as e:
+        # Fallback if DB fails
+        logger.error(f"CRITICAL: Failed to write {len(rows)} row(s) to error_logs DB: {e}")
+        return False
+
+def _writer_loop():
+    while True:
+        # Block for the first row, then gather more for up to _FLUSH_INTERVAL
+        batch = [_ERROR_QUEUE.get()]
+        deadline = time.monotonic() + _FLUSH_INTERVAL
+        while len(batch) < _BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_ERROR_QUEUE.get(timeout=remaining))
+            except queue.Empty:
+                break
+        bulk_insert_logs(batch)
+
+def _ensure_writer():
+    """Start the writer thread lazily (after gunicorn forks, once per worker)."""
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name='error-log-writer', daemon=True)
+            _writer_thread.start()
+
+def flush_error_logs():
+    """Synchronously write any rows still waiting in the queue."""
+    batch = []
+    while True:
+        try:
+            batch.append(_ERROR_QUEUE.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        bulk_insert_logs(batch)
+
+atexit.register(flush_error_logs)
+
 def log_error(message, level="ERROR", source="Backend", user_id=None, trace=None, status="Open"):
     """
-    Logs an error to the database and standard logging.
+    Logs an error to standard logging and queues it for the error_logs table.
     """
     try:
         # 1. Fallback to standard logging first (always works)
@@ -21,14 +97,14 @@ def log_error(message, level="ERROR", source="Backend", user_id=None, trace=None
         else:
             logger.info(log_msg)
 
-        # 2. Write to DB (using local time instead of UTC)
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO error_logs (timestamp, level, source, message, trace, user_id, status)
-            VALUES (datetime('now', 'localtime'), ?, ?, ?, ?, ?, ?)
-        ''', (level, source, message, trace, user_id, status))
-        conn.commit()
-        conn.close()
+        # 2. Queue the DB write (timestamp taken now, in local time instead of UTC)
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        _ensure_writer()
+        try:
+            _ERROR_QUEUE.put_nowait((timestamp, level, source, message, trace, user_id, status))
+        except queue.Full:
+            logger.warning("error_logs queue full; entry kept in standard log only")
+            return False
         return True
     except Exception as e:
         # Fallback if DB fails
@@ -51,12 +127,18 @@ def log_exception(e, source="System"):
     # But for now, let's keep it consistent with the original log_error's message parameter
     # and let log_error handle its own formatting.
     
-    # Get traceback
-    full_trace = traceback.format_exc()
+    # Get traceback - skipped for client errors (RscpError with a 4xx status):
+    # formatting walks every frame and reads source lines, and a validation
+    # failure's stack adds nothing to the error code and message
+    if isinstance(e, RscpError) and e.status_code < 500:
+        full_trace = None
+    else:
+        full_trace = traceback.format_exc()
 
     # Log to standard logger (already configured as 'logger')
     logger.error(log_msg_for_std_log)
-    logger.error(full_trace)
+    if full_trace:
+        logger.error(full_trace)
 
     # Log to DB via log_error function
     # We pass the original exception message, and the full trace.
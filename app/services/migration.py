@@ -4,56 +4,47 @@ from app.services.db import get_db_connection, init_db, DB_PATH
 
 logger = logging.getLogger(__name__)
 
+# Column names per table, read once per ensure_db_ready() run
+_TABLE_COLUMNS = {}
+
+def _table_columns(conn, table):
+    cols = _TABLE_COLUMNS.get(table)
+    if cols is None:
+        cols = _TABLE_COLUMNS[table] = {c[1] for c in conn.execute(f"PRAGMA table_info({table})")}
+    return cols
+
 def _safe_add_column(conn, table, column, column_def):
     """
     Safely adds a column to an existing table if it does not already exist.
-    Checks column existence first via table_info to prevent redundant and slow ALTER TABLE statements.
-    Retries automatically with randomized exponential backoff and jitter if the database is locked.
+    Checks the cached table_info first so existing columns cost no ALTER TABLE.
+    Runs inside ensure_db_ready's write transaction, so there is no lock to retry
+    and nothing is committed here.
     """
-    import time
-    import random
-    
-    # 1. Read table columns with lock retries
-    cursor = conn.cursor()
-    cols = []
-    for attempt in range(10):
-        try:
-            cursor.execute(f"PRAGMA table_info({table})")
-            cols = [c[1] for c in cursor.fetchall()]
-            break
-        except sqlite3.OperationalError as e:
-            if "locked" in str(e).lower() and attempt < 9:
-                time.sleep(0.05 + random.random() * 0.15)
-                continue
-            raise
-            
+    cols = _table_columns(conn, table)
     if column in cols:
         return
         
-    # 2. Alter table with lock retries
-    sql = f"ALTER TABLE {table} ADD COLUMN {column} {column_def}"
-    for attempt in range(10):
-        try:
-            conn.execute(sql)
-            conn.commit()
-            logger.info(f"Successfully added column '{column}' to table '{table}'.")
-            return
-        except sqlite3.OperationalError as e:
-            err_msg = str(e).lower()
-            if "duplicate column name" in err_msg or "already exists" in err_msg:
-                return
-            if "locked" in err_msg and attempt < 9:
-                time.sleep(0.05 + random.random() * 0.15)
-                continue
-            logger.error(f"Error adding column '{column}' to table '{table}' (attempt {attempt}): {e}")
+    try:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_def}")
+        logger.info(f"Successfully added column '{column}' to table '{table}'.")
+    except sqlite3.OperationalError as e:
+        # Cached column list can predate a CREATE TABLE earlier in the same run
+        if "duplicate column name" not in str(e).lower():
+            logger.error(f"Error adding column '{column}' to table '{table}': {e}")
             raise
+    cols.add(column)
 
 def ensure_db_ready():
     """Initializes the database and applies any pending schema updates."""
     init_db()
     
     conn = get_db_connection()
+    _TABLE_COLUMNS.clear()
     try:
+        # All schema updates run as one transaction: a single commit at the end,
+        # and concurrent workers starting up wait here instead of racing ALTERs.
+        conn.execute('BEGIN IMMEDIATE')
+        
         # Schema Update Check (Phase 9 - PIN Support)
         _safe_add_column(conn, 'users', 'pin_hash', 'TEXT')
         
@@ -75,7 +66,6 @@ def ensure_db_ready():
                 SET roles = '["operator"]' 
                 WHERE is_admin = 0 AND (roles IS NULL OR roles = '[]' OR roles = '')
             """)
-            conn.commit()
             logger.info("Migrated existing users to role-based system.")
         except Exception as e:
             logger.warning(f"Role migration note: {e}")
@@ -85,6 +75,32 @@ def ensure_db_ready():
         _safe_add_column(conn, 'packages', 'asin', 'TEXT')
         _safe_add_column(conn, 'packages', 'source_url', 'TEXT')
         
+        # Case-insensitive tracking lookups (scan exact match + long-barcode suffix match)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tracking_nocase ON packages(tracking_number COLLATE NOCASE)')
+        # History page: ORDER BY timestamp DESC LIMIT n walks this index instead of sorting
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_history_ts_user ON history(timestamp DESC, user_id)')
+        # Scan counts / analytics: action='received' AND timestamp >= ? is a range seek
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_history_action_ts ON history(action, timestamp)')
+        # "Already in history?" checks on scan look history up by package
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_history_pkg ON history(package_id)')
+        # Return mode "Recent Shipments" list
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pkg_returnable_expected ON packages(date_expected DESC)
+            WHERE status NOT IN ('return_pending', 'refunded')
+        """)
+        # Status list views / dashboard counts: expected + past due (unscanned only),
+        # refunded log ordered by refund_date
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_pkg_status_exp ON packages(status, date_expected)
+            WHERE date_scanned IS NULL
+        """)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_pkg_status_refund ON packages(status, refund_date DESC)')
+        # Dashboard past-due count: status + date_scanned without touching the table
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_pkg_status_scanned ON packages(status, date_scanned)')
+        # Superseded by the compound indexes above / idx_pkg_expected_scanned (same leading column)
+        conn.execute('DROP INDEX IF EXISTS idx_status')
+        conn.execute('DROP INDEX IF EXISTS idx_date_expected')
+        
         # Inventory Module Tables (V1.16)
         _create_inventory_tables(conn)
         
@@ -101,7 +117,6 @@ def ensure_db_ready():
                 status TEXT
             )
         ''')
-        conn.commit()
         
         # Notifications Table (V1.20)
         conn.execute('''
@@ -119,13 +134,19 @@ def ensure_db_ready():
         ''')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications(user_id, is_read)')
-        conn.commit()
+        
+        # Background job cursors, e.g. last IMAP UID seen by email ingest
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingest_state (
+                k TEXT PRIMARY KEY,
+                v TEXT
+            )
+        ''')
         
         # V1.18: Add badge_id to users table for POS badge scanning
         _safe_add_column(conn, 'users', 'badge_id', 'TEXT')
         try:
             conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_badge_id ON users(badge_id)')
-            conn.commit()
         except Exception as e:
             logger.warning(f"Error creating unique index on users(badge_id): {e}")
         
@@ -143,7 +164,6 @@ def ensure_db_ready():
         _safe_add_column(conn, 'users', 'email', 'TEXT')
         try:
             conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email)')
-            conn.commit()
         except Exception as e:
             logger.warning(f"Error creating unique index on users(email): {e}")
         _safe_add_column(conn, 'users', 'auth_provider', 'TEXT')
@@ -161,11 +181,18 @@ def ensure_db_ready():
             )
         ''')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_mapping_pkg_name ON product_mappings(package_name)')
+        
+        # Refresh planner statistics so the indexes above get picked.
+        # analysis_limit keeps this a quick sample on large databases.
+        conn.execute('PRAGMA analysis_limit=400')
+        conn.execute('ANALYZE')
         conn.commit()
             
     except Exception as e:
+        conn.rollback()
         logger.error(f"Migration Schema Check Error: {e}")
     finally:
+        _TABLE_COLUMNS.clear()
         conn.close()
 
 
@@ -260,7 +287,10 @@ def _create_inventory_tables(conn):
         ''')
         
         # Performance: Indexes for inventory_transactions (used in sales trend queries)
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_trans_item ON inventory_transactions(inventory_item_id)')
+        # Item history (WHERE inventory_item_id = ? ORDER BY created_at DESC) reads this in order;
+        # it also covers plain item lookups, so the single-column idx_trans_item is dropped
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_trans_item_date ON inventory_transactions(inventory_item_id, created_at)')
+        conn.execute('DROP INDEX IF EXISTS idx_trans_item')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_trans_date ON inventory_transactions(created_at)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_trans_reason ON inventory_transactions(reason)')
         
@@ -295,7 +325,6 @@ def _create_inventory_tables(conn):
             )
         ''')
         
-        conn.commit()
         logger.info("Inventory tables initialized.")
         
     except Exception as e:
@@ -502,7 +531,6 @@ def _create_pos_tables(conn):
             )
         ''')
 
-        conn.commit()
         logger.info("POS tables and terminal pairing schemas initialized.")
         
         # ========================================
@@ -572,7 +600,6 @@ def _create_pos_tables(conn):
         conn.execute('CREATE INDEX IF NOT EXISTS idx_pos_redemption_coupon ON pos_coupon_redemptions(coupon_id)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_pos_redemption_order ON pos_coupon_redemptions(order_id)')
         
-        conn.commit()
         logger.info("POS Coupon tables initialized.")
         
         # ========================================
@@ -624,7 +651,6 @@ def _create_pos_tables(conn):
         conn.execute('CREATE INDEX IF NOT EXISTS idx_federation_transfer_peer ON federation_transfers(peer_id)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_federation_transfer_expires ON federation_transfers(expires_at)')
         
-        conn.commit()
         logger.info("Federation tables initialized.")
         
     except Exception as e:
@@ -648,13 +674,11 @@ def _create_timeclock_tables(conn):
                 FOREIGN KEY (edited_by) REFERENCES users (id)
             )
         ''')
-        conn.commit()
         
         # Index for faster queries
         conn.execute('''
         CREATE INDEX IF NOT EXISTS idx_time_entries_user_date ON time_entries(user_id, clock_in);
     ''')
-        conn.commit()
         
         logger.info("Timeclock tables initialized.")
     except Exception as e:
@@ -674,7 +698,6 @@ def _create_scheduled_shifts_table(conn):
     conn.execute('''
         CREATE INDEX IF NOT EXISTS idx_shifts_user_start ON scheduled_shifts(user_id, start_time);
     ''')
-    conn.commit()
 
 def _create_recurring_rules_table(conn):
     conn.execute('''
@@ -689,4 +712,3 @@ def _create_recurring_rules_table(conn):
             FOREIGN KEY (user_id) REFERENCES users (id)
         );
     ''')
-    conn.commit()
@@ -11,24 +11,25 @@ from flask import current_app
 
 logger = logging.getLogger(__name__)
 
-_cipher_suite = None
-_last_secret_key = None
+# (secret, cipher) pair, replaced with one assignment so a request thread can
+# never pair a new secret with the old cipher
+_CIPHER = None
 
 def get_cipher():
     """Get or create the Fernet cipher suite based on current app secret."""
-    global _cipher_suite, _last_secret_key
+    global _CIPHER
     
     secret = current_app.config.get('SECRET_KEY', 'default-insecure-key')
     
     # Re-initialize if secret changed (unlikely but safe)
-    if _cipher_suite is None or secret != _last_secret_key:
+    cached = _CIPHER
+    if cached is None or secret != cached[0]:
         # Derive a 32-byte url-safe base64 key from the secret
         # We use SHA256 digest of the secret
         key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
-        _cipher_suite = Fernet(key)
-        _last_secret_key = secret
+        cached = _CIPHER = (secret, Fernet(key))
         
-    return _cipher_suite
+    return cached[1]
 
 def encrypt(data):
     """
@@ -1,35 +1,64 @@
 import datetime
+import functools
+import re
 from typing import Optional
+from itsdangerous import URLSafeSerializer, BadData
 
+_PENDING_VALUES = frozenset(['pending', 'nan', 'none', ''])
+# ISO (2024-01-05), US/EU slash (1/5/2024), and Y/M/D slash (2024/01/05)
+_DATE_RE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})|(\d{1,2})/(\d{1,2})/(\d{4})|(\d{4})/(\d{1,2})/(\d{1,2})')
+
+def _ymd(y, m, d):
+    try:
+        return datetime.date(int(y), int(m), int(d)).isoformat()
+    except ValueError:
+        return None
+
+@functools.lru_cache(maxsize=4096)
 def parse_date(value: str) -> str:
-    """Robust date parser handling pending, empty, and various formats."""
-    if not value or str(value).lower() in ['pending', 'nan', 'none', '']:
+    """Robust date parser handling pending, empty, and various formats.
+
+    Same formats as before ('%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%Y/%m/%d', tried
+    in that order) but matched with one regex instead of a strptime per format.
+    Cached, since bulk imports repeat the same few date strings.
+    """
+    if not value or str(value).lower() in _PENDING_VALUES:
         return "Pending"
     
-    val_str = str(value).strip()
-    if val_str.lower() == 'pending': 
-        return "Pending"
-
-    for fmt in ['%Y-%m-%d', '%m/%d/%Y', '%-m/%-d/%Y', '%d/%m/%Y', '%Y/%m/%d']:
-        try:
-            dt = datetime.datetime.strptime(val_str, fmt)
-            return dt.strftime('%Y-%m-%d')
-        except ValueError:
-            continue
+    m = _DATE_RE.fullmatch(str(value).strip())
+    if m:
+        iso_y, iso_m, iso_d, a, b, sl_y, ymd_y, ymd_m, ymd_d = m.groups()
+        if iso_y:
+            result = _ymd(iso_y, iso_m, iso_d)
+        elif sl_y:
+            result = _ymd(sl_y, a, b) or _ymd(sl_y, b, a)  # month-first, then day-first
+        else:
+            result = _ymd(ymd_y, ymd_m, ymd_d)
+        if result:
+            return result
     
     return "Pending"
 
+# Commas become spaces; a leading formula character gets a quote prefix
+_CSV_TRANS = str.maketrans({',': ' '})
+_CSV_DANGER = frozenset('=+-@')
+
 def sanitize_for_csv(text: str) -> str:
     """Prepares text for CSV injection safety."""
     if text is None: return ""
-    text_str = str(text).replace(",", " ").strip()
-    if text_str.startswith(('=', '+', '-', '@')):
-        return f"'{text_str}" 
+    text_str = str(text).translate(_CSV_TRANS).strip()
+    if text_str and text_str[0] in _CSV_DANGER:
+        return f"'{text_str}"
     return text_str
 
 def format_date_filter(value: str, fmt_type: str = 'US') -> str:
     """Jinja filter to format YYYY-MM-DD string to readable format."""
     if not value or value == 'Pending': return value
+    return _format_date(value, fmt_type)
+
+@functools.lru_cache(maxsize=2048)
+def _format_date(value: str, fmt_type: str) -> str:
+    # Cached: list views repeat the same few dates on every row
     try:
         dt = datetime.datetime.strptime(value, '%Y-%m-%d')
         if fmt_type in ('EU', 'UK'):  # Support both EU and UK for DD/MM/YYYY
@@ -38,6 +67,11 @@ def format_date_filter(value: str, fmt_type: str = 'US') -> str:
     except ValueError:
         return value
 
+@functools.lru_cache(maxsize=8)
+def _sensitive_serializer(key: str) -> URLSafeSerializer:
+    """One serializer per key (in practice just the app secret)."""
+    return URLSafeSerializer(key, salt='rscp-sensitive-data')
+
 def obscure_string(text: str, key: str) -> str:
     """
     Securely encrypt sensitive strings using itsdangerous (comes with Flask).
@@ -46,9 +80,7 @@ def obscure_string(text: str, key: str) -> str:
     """
     if not text or not key: return ""
     try:
-        from itsdangerous import URLSafeSerializer
-        s = URLSafeSerializer(key, salt='rscp-sensitive-data')
-        return s.dumps(text)
+        return _sensitive_serializer(key).dumps(text)
     except Exception:
         # Fallback to base64 if itsdangerous fails
         import base64
@@ -63,18 +95,24 @@ def reveal_string(obfuscated_text: str, key: str) -> str:
     
     # Try new itsdangerous format first
     try:
-        from itsdangerous import URLSafeSerializer
-        s = URLSafeSerializer(key, salt='rscp-sensitive-data')
-        return s.loads(obfuscated_text)
-    except Exception:
-        pass
+        return _sensitive_serializer(key).loads(obfuscated_text)
+    except BadData:
+        pass  # Not a signed token (or signed with another key): try legacy
     
     # Fallback to legacy XOR format for backwards compatibility
     import base64
     try:
         xor_bytes = base64.b64decode(obfuscated_text)
         key_cycle = (key * (len(xor_bytes) // len(key) + 1))[:len(xor_bytes)]
-        return "".join([chr(a ^ ord(b)) for a, b in zip(xor_bytes, key_cycle)])
+        try:
+            key_bytes = key_cycle.encode('latin-1')
+        except UnicodeEncodeError:
+            # Key chars above U+00FF don't fit a byte; keep the per-char XOR
+            return "".join([chr(a ^ ord(b)) for a, b in zip(xor_bytes, key_cycle)])
+        # Whole-buffer XOR as one big-int op; latin-1 maps each byte back to chr(byte)
+        n = len(xor_bytes)
+        plain = (int.from_bytes(xor_bytes, 'big') ^ int.from_bytes(key_bytes, 'big')).to_bytes(n, 'big')
+        return plain.decode('latin-1')
     except (ValueError, TypeError):
         return ""
 
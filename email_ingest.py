@@ -5,6 +5,7 @@ import re
 import datetime
 import time
 import logging
+import threading
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -16,6 +17,25 @@ try:
 except ImportError:
     BS4_AVAILABLE = False
 
+# lxml's C parser is much faster than the pure-Python html.parser on long
+# order emails; optional, so fall back when it isn't installed.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Patterns used per message / per item, compiled once
+_AMAZON_ORDER_RE = re.compile(r'\b\d{3}-\d{7}-\d{7}\b')
+_EBAY_ORDER_RE = re.compile(r'\b\d{2}-\d{5}-\d{5}\b')
+_QTY_RE = re.compile(r'(?:Qty|Quantity)\s*[:.\-]\s*(\d+)', re.IGNORECASE)
+_QTY_TEXT_RE = re.compile(r'Qty\s*[:.\-]\s*\d+', re.IGNORECASE)
+_REVIEW_TEXT_RE = re.compile(r'Write a product review', re.IGNORECASE)
+_PRODUCT_LINK_RE = re.compile(r'/(?:dp|gp/product)/([A-Z0-9]{10})')
+_AMAZON_IMG_RE = re.compile(r'images-amazon\.com|ssl-images-amazon\.com')
+_ITEM_IMG_RE = re.compile(r'amazon|ebayimg', re.IGNORECASE)
+_EBAY_IMG_RE = re.compile(r'ebayimg\.com')
+
 def get_html_body(msg):
     """Extract HTML body from email message."""
     if msg.is_multipart():
@@ -34,13 +54,13 @@ def extract_order_id(text, subject):
     eBay: 12-12345-12345 (User example: 26-14075-32104)
     """
     # Amazon Pattern (3-7-7 digits)
-    amzn_match = re.search(r'\b\d{3}-\d{7}-\d{7}\b', text) or re.search(r'\b\d{3}-\d{7}-\d{7}\b', subject)
+    amzn_match = _AMAZON_ORDER_RE.search(text) or _AMAZON_ORDER_RE.search(subject)
     if amzn_match:
         return amzn_match.group(0), 'Amazon'
 
     # eBay Pattern (2-5-5 digits based on manifest example 26-14075-32104)
     # Also generic support for "Order #12345" if labeled explicitly
-    ebay_match = re.search(r'\b\d{2}-\d{5}-\d{5}\b', text) or re.search(r'\b\d{2}-\d{5}-\d{5}\b', subject)
+    ebay_match = _EBAY_ORDER_RE.search(text) or _EBAY_ORDER_RE.search(subject)
     if ebay_match:
         return ebay_match.group(0), 'eBay'
         
@@ -50,7 +70,7 @@ def extract_order_id(text, subject):
 def extract_qty(text):
     """Attempt to find quantity in text like 'Qty: 2' or 'Quantity: 3'."""
     # Look for explicit label
-    match = re.search(r'(?:Qty|Quantity)\s*[:.\-]\s*(\d+)', text, re.IGNORECASE)
+    match = _QTY_RE.search(text)
     if match:
         return int(match.group(1))
     return 1
@@ -67,17 +87,17 @@ def parse_amazon_items(soup):
     # Amazon emails vary, but product images are often wrapped in 'a' tags linking to /dp/ or /gp/product/
     
     # Find all links to products
-    product_links = soup.find_all('a', href=re.compile(r'/(dp|gp/product)/[A-Z0-9]{10}'))
+    product_links = soup.find_all('a', href=_PRODUCT_LINK_RE)
     
     # Deduplicate by ASIN to avoid grabbing the same item twice (image link + text link)
     seen_asins = set()
     
     for link in product_links:
         href = link.get('href', '')
-        asin_match = re.search(r'/(dp|gp/product)/([A-Z0-9]{10})', href)
+        asin_match = _PRODUCT_LINK_RE.search(href)
         if not asin_match: continue
         
-        asin = asin_match.group(2)
+        asin = asin_match.group(1)
         if asin in seen_asins: continue
         seen_asins.add(asin)
         
@@ -89,7 +109,7 @@ def parse_amazon_items(soup):
         if not img_tag:
             row = container.find_parent(['tr', 'div'])
             if row:
-                img_tag = row.find('img', src=re.compile(r'images-amazon\.com|ssl-images-amazon\.com'))
+                img_tag = row.find('img', src=_AMAZON_IMG_RE)
         
         image_url = img_tag.get('src') if img_tag else ""
         if not image_url:
@@ -100,7 +120,7 @@ def parse_amazon_items(soup):
             if img_tag and img_tag.get('alt'):
                 title = img_tag.get('alt')
         
-        title = re.sub(r'Write a product review', '', title, flags=re.IGNORECASE).strip()
+        title = _REVIEW_TEXT_RE.sub('', title).strip()
         
         # Extract Qty
         qty = 1
@@ -134,7 +154,7 @@ def parse_using_qty_heuristic(soup):
     items = []
     # Find all text nodes matching Qty pattern
     # We use a regex compile to find the element containing the text
-    qty_pattern = re.compile(r'(?:Qty|Quantity)\s*[:.\-]\s*(\d+)', re.IGNORECASE)
+    qty_pattern = _QTY_RE
     
     # Find all elements that contain this text directly? 
     # soup.find_all(string=...) returns NavigableStrings.
@@ -146,7 +166,9 @@ def parse_using_qty_heuristic(soup):
          # print(f"DEBUG: No Qty nodes found. All strings: {[str(s) for s in soup.strings]}")
          pass
     
+    seen_names = set()
     for node in qty_nodes:
+        parent = None  # wider row/table, only looked up when the container has no image
         qty_match = qty_pattern.search(node)
         if not qty_match: continue
         qty = int(qty_match.group(1))
@@ -160,7 +182,7 @@ def parse_using_qty_heuristic(soup):
         
         # Image Search
         # Broader regex to catch m.media-amazon.com, images-na.ssl..., etc.
-        img_regex = re.compile(r'amazon|ebayimg', re.IGNORECASE)
+        img_regex = _ITEM_IMG_RE
         
         img = container.find('img', src=img_regex)
         if not img:
@@ -189,12 +211,13 @@ def parse_using_qty_heuristic(soup):
             if bold: title = bold.get_text(strip=True)
             
         # Cleanup Title
-        title = re.sub(r'Qty\s*[:.\-]\s*\d+', '', title, flags=re.IGNORECASE).strip()
-        title = re.sub(r'Write a product review', '', title, flags=re.IGNORECASE).strip()
+        title = _QTY_TEXT_RE.sub('', title).strip()
+        title = _REVIEW_TEXT_RE.sub('', title).strip()
         
         if title and len(title) > 3:
             # Deduplicate
-            if any(i['name'] == title for i in items): continue
+            if title in seen_names: continue
+            seen_names.add(title)
             
             items.append({
                 'name': title,
@@ -210,7 +233,8 @@ def parse_ebay_items(soup):
     eBay structure: Often <table> with <img> in one col and Title in another.
     """
     items = []
-    images = soup.find_all('img', src=re.compile(r'ebayimg\.com'))
+    images = soup.find_all('img', src=_EBAY_IMG_RE)
+    seen_names = set()
     
     for img in images:
         src = img.get('src', '')
@@ -234,7 +258,8 @@ def parse_ebay_items(soup):
                         title = text_link.get_text(strip=True)
         
         if title:
-            if any(i['name'] == title for i in items): continue
+            if title in seen_names: continue
+            seen_names.add(title)
             
             items.append({
                 'name': title,
@@ -248,29 +273,131 @@ def check_amazon_emails(imap_server, user, password):
     """
     Connects to IMAP, searches for unread emails, extracts Order IDs and Items.
     Generalized for Amazon AND eBay.
+    
+    Handled emails are marked read straight away; callers that persist the
+    items should use fetch_order_emails + mark_emails_seen instead.
+    """
+    items, cursor, seen = fetch_order_emails(imap_server, user, password)
+    mark_emails_seen(imap_server, user, password, cursor, seen)
+    return items
+
+# Persistent IMAP session for the background poller (keep_alive=True):
+# one TLS handshake + LOGIN, then a SELECT per poll. Guarded by _IMAP_LOCK.
+_IMAP_LOCK = threading.Lock()
+_IMAP = {'key': None, 'mail': None}
+
+# Failed attempts per (UIDVALIDITY, UID), so one unparseable email can't pin
+# the cursor forever. Entries are dropped once the email is handled or skipped.
+MAX_EMAIL_ATTEMPTS = 3
+_FAILED_ATTEMPTS = {}
+
+def _open_mailbox(imap_server, user, password):
+    mail = imaplib.IMAP4_SSL(imap_server)
+    mail.login(user, password)
+    mail.select("inbox")
+    return mail
+
+def _uidvalidity(mail):
+    validity = (mail.response('UIDVALIDITY')[1] or [None])[0]
+    return validity.decode() if isinstance(validity, bytes) else str(validity)
+
+def _drop_session():
+    mail = _IMAP['mail']
+    _IMAP['key'] = _IMAP['mail'] = None
+    if mail is not None:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+def _shared_mailbox(imap_server, user, password):
+    key = (imap_server, user, password)
+    if _IMAP['mail'] is not None and _IMAP['key'] == key:
+        try:
+            # Re-SELECT refreshes UIDVALIDITY and fails if the server dropped us
+            _IMAP['mail'].select("inbox")
+            return _IMAP['mail']
+        except (imaplib.IMAP4.error, OSError) as e:
+            logger.info(f"IMAP session lost ({e}), reconnecting")
+    _drop_session()
+    _IMAP['mail'] = _open_mailbox(imap_server, user, password)
+    _IMAP['key'] = key
+    return _IMAP['mail']
+
+def fetch_order_emails(imap_server, user, password, since=None, keep_alive=False):
+    """
+    Like check_amazon_emails, but only considers messages newer than `since`.
+    
+    `since` is the cursor returned by a previous call ("<UIDVALIDITY>:<UID>").
+    The server does a UID SEARCH for UIDs above it, so a poll with no new mail
+    costs one round-trip and fetches no bodies. Without a cursor the unread
+    messages are taken instead. Either way the oldest 20 are processed per
+    call, and the returned cursor only moves past messages that were handled:
+    processing stops at the first email that fails, so it is retried (with
+    everything after it) on the next call. An email that fails
+    MAX_EMAIL_ATTEMPTS times is logged and skipped.
+    
+    Returns (items, cursor, uids): the UIDs the cursor moved past. Bodies are
+    fetched without setting \\Seen; pass cursor and uids to mark_emails_seen
+    once the items and cursor are stored, so mail from a poll whose write
+    failed is still unread (and found again by a first-run UNSEEN search).
+    On error the cursor is unchanged and uids is empty.
+    
+    keep_alive=True reuses one logged-in session across calls (reconnecting
+    on error) instead of a TLS handshake + LOGIN per poll.
     """
+    if not keep_alive:
+        return _fetch_order_emails(imap_server, user, password, since, False)
+    with _IMAP_LOCK:
+        return _fetch_order_emails(imap_server, user, password, since, True)
+
+def _fetch_order_emails(imap_server, user, password, since, keep_alive):
     if not BS4_AVAILABLE:
         logger.error("Missing dependency: beautifulsoup4")
-        return []
+        return [], since, []
 
     results = []
     mail = None
 
     try:
-        mail = imaplib.IMAP4_SSL(imap_server)
-        mail.login(user, password)
-        mail.select("inbox")
+        if keep_alive:
+            mail = _shared_mailbox(imap_server, user, password)
+        else:
+            mail = _open_mailbox(imap_server, user, password)
+        
+        validity = _uidvalidity(mail)
+        last_uid = None
+        if since:
+            since_validity, _, since_uid = since.partition(':')
+            if since_validity == validity and since_uid.isdigit():
+                last_uid = int(since_uid)  # else the mailbox was rebuilt, start over
 
-        # Search UNREAD
-        status, messages = mail.search(None, 'UNSEEN')
-        if status != "OK": return []
+        # First run: UNREAD. Afterwards everything above the cursor, read or not:
+        # the cursor alone records what was ingested, so mail fetched by a poll
+        # whose DB write failed is picked up again.
+        criteria = 'UNSEEN' if last_uid is None else f'UID {last_uid + 1}:*'
+        status, messages = mail.uid('search', None, criteria)
+        if status != "OK": return [], since, []
         
-        email_ids = messages[0].split()
+        # "n:*" always matches the newest message, even below n
+        uids = [int(u) for u in messages[0].split()]
+        if last_uid is not None:
+            uids = [u for u in uids if u > last_uid]
+        if not uids:
+            if not keep_alive:
+                mail.close()
+                mail.logout()
+            return [], since, []
         
-        for email_id in email_ids[-20:]: # Process last 20 unread
+        # Oldest 20 first, the rest next poll
+        batch = sorted(uids)[:20]
+        handled = []
+        
+        for uid in batch:
+            email_id = str(uid).encode()
             try:
-                # Fetch full content
-                res, msg_data = mail.fetch(email_id, "(RFC822)")
+                # Fetch full content; PEEK leaves it unread (see mark_emails_seen)
+                res, msg_data = mail.uid('fetch', email_id, "(BODY.PEEK[])")
                 msg = email.message_from_bytes(msg_data[0][1])
                 
                 # Subject
@@ -282,9 +409,11 @@ def check_amazon_emails(imap_server, user, password):
                 body_html = get_html_body(msg)
                 if not body_html: 
                     logger.debug(f"Email {email_id} skipped: No HTML body.")
+                    _FAILED_ATTEMPTS.pop((validity, uid), None)
+                    handled.append(uid)
                     continue
                 
-                soup = BeautifulSoup(body_html, 'html.parser')
+                soup = BeautifulSoup(body_html, HTML_PARSER)
                 text_content = soup.get_text(separator=' ')
                 
                 # 1. Identify Order ID
@@ -347,17 +476,62 @@ def check_amazon_emails(imap_server, user, password):
                             'source': 'Auto-Email',
                             'status': 'incoming'
                         })
+                
+                _FAILED_ATTEMPTS.pop((validity, uid), None)
+                handled.append(uid)
                     
             except Exception as e:
-                logger.error(f"Error processing email {email_id}: {e}")
-                continue
+                attempts = _FAILED_ATTEMPTS.get((validity, uid), 0) + 1
+                if attempts < MAX_EMAIL_ATTEMPTS:
+                    _FAILED_ATTEMPTS[(validity, uid)] = attempts
+                    logger.error(f"Error processing email {email_id} (attempt {attempts}), retrying next poll: {e}")
+                    break
+                logger.error(f"Error processing email {email_id}, giving up after {attempts} attempts: {e}")
+                _FAILED_ATTEMPTS.pop((validity, uid), None)
+                handled.append(uid)
                 
-        mail.close()
-        mail.logout()
+        if not keep_alive:
+            mail.close()
+            mail.logout()
         
     except Exception as e:
         logger.error(f"IMAP Error: {e}")
-        return []
+        if keep_alive:
+            _drop_session()
+        return [], since, []
 
-    return results
+    if not handled:
+        return results, since, []
+    return results, f"{validity}:{handled[-1]}", handled
 
+def mark_emails_seen(imap_server, user, password, cursor, uids, keep_alive=False):
+    """
+    Set \\Seen on the UIDs returned by fetch_order_emails, in one STORE.
+    
+    Skipped if the mailbox's UIDVALIDITY no longer matches the cursor (the
+    UIDs would name other messages). Best effort: failures are logged, the
+    cursor already records progress.
+    """
+    if not uids or not cursor:
+        return
+    if not keep_alive:
+        return _mark_emails_seen(imap_server, user, password, cursor, uids, False)
+    with _IMAP_LOCK:
+        return _mark_emails_seen(imap_server, user, password, cursor, uids, True)
+
+def _mark_emails_seen(imap_server, user, password, cursor, uids, keep_alive):
+    try:
+        if keep_alive:
+            mail = _shared_mailbox(imap_server, user, password)
+        else:
+            mail = _open_mailbox(imap_server, user, password)
+        validity = _uidvalidity(mail)
+        if cursor.partition(':')[0] == validity:
+            mail.uid('store', ','.join(map(str, uids)), '+FLAGS', '(\\Seen)')
+        if not keep_alive:
+            mail.close()
+            mail.logout()
+    except Exception as e:
+        logger.warning(f"Could not mark {len(uids)} emails read: {e}")
+        if keep_alive:
+            _drop_session()
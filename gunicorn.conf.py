@@ -5,9 +5,11 @@ Usage: gunicorn -c gunicorn.conf.py wsgi:app
 import multiprocessing
 
 # Calculate workers based on CPU cores
-# Formula: (2 * cores) + 1, with a minimum of 2
+# One process per core (clamped 2-4); concurrency comes from threads instead, so
+# each worker's caches, DB pool and scheduler are shared by its request threads
 cpu_cores = multiprocessing.cpu_count()
-workers = min(max((2 * cpu_cores) + 1, 2), 8)  # Clamp between 2 and 8
+workers = min(max(cpu_cores, 2), 4)  # Clamp between 2 and 4
+threads = 4
 
 # Binding
 bind = "0.0.0.0:5000"
@@ -21,8 +23,11 @@ errorlog = "-"   # stderr
 loglevel = "info"
 
 # Performance
-worker_class = "sync"  # Default sync workers
-keepalive = 2
+# gthread: requests mostly wait on SQLite I/O, so threads overlap that wait.
+# Request handlers use their own connection per request; the shared pool
+# (db_pool.py) opens connections with check_same_thread=False.
+worker_class = "gthread"
+keepalive = 5
 
 # Print config on startup
-print(f"[Gunicorn Config] CPU Cores: {cpu_cores}, Workers: {workers}")
+print(f"[Gunicorn Config] CPU Cores: {cpu_cores}, Workers: {workers}, Threads: {threads}")
@@ -1,22 +1,23 @@
 import sys
 import argparse
-from werkzeug.security import generate_password_hash
 from app.services.db import get_db_connection
+from app.services.auth import hash_password, invalidate_users_cache
 
 def reset_password(username, new_password):
     print(f"Resetting password for user: {username}")
     conn = get_db_connection()
     try:
         # Check if user exists
-        user = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        user = conn.execute("SELECT 1 FROM users WHERE username = ? LIMIT 1", (username,)).fetchone()
         if not user:
             print(f"Error: User '{username}' not found.")
             return
 
         # Update password
-        p_hash = generate_password_hash(new_password)
+        p_hash = hash_password(new_password)
         conn.execute("UPDATE users SET password_hash = ? WHERE username = ?", (p_hash, username))
         conn.commit()
+        invalidate_users_cache()
         print(f"Success: Password for '{username}' has been updated.")
         
     except Exception as e:
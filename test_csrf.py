@@ -0,0 +1,104 @@
+import unittest
+from flask import Flask, session
+
+from app.services.csrf import generate_csrf_token, verify_csrf_token
+
+
+def make_app():
+    app = Flask(__name__)
+    app.secret_key = 'test-secret'
+
+    @app.route('/token')
+    def token():
+        return generate_csrf_token()
+
+    @app.route('/submit', methods=['POST'])
+    def submit():
+        verify_csrf_token()
+        return 'ok'
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return 'bye'
+
+    return app
+
+
+class TestCsrfTokens(unittest.TestCase):
+    def setUp(self):
+        self.app = make_app()
+
+    def post(self, client, token):
+        return client.post('/submit', data={'csrf_token': token}).status_code
+
+    def test_token_valid_in_its_own_session(self):
+        client = self.app.test_client()
+        token = client.get('/token').get_data(as_text=True)
+        self.assertEqual(self.post(client, token), 200)
+        self.assertEqual(client.post('/submit', headers={'X-CSRFToken': token}).status_code, 200)
+
+    def test_missing_or_garbage_token_rejected(self):
+        client = self.app.test_client()
+        client.get('/token')
+        self.assertEqual(client.post('/submit').status_code, 403)
+        self.assertEqual(self.post(client, 'not-a-token'), 403)
+
+    def test_anonymous_sessions_do_not_share_tokens(self):
+        a, b = self.app.test_client(), self.app.test_client()
+        token_a = a.get('/token').get_data(as_text=True)
+        b.get('/token')
+        self.assertEqual(self.post(b, token_a), 403)
+
+    def test_token_from_another_session_of_same_user_rejected(self):
+        a, b = self.app.test_client(), self.app.test_client()
+        for client in (a, b):
+            with client.session_transaction() as sess:
+                sess['_user_id'] = '1'
+                sess['_id'] = 'same-identifier'
+        token_a = a.get('/token').get_data(as_text=True)
+        b.get('/token')
+        self.assertEqual(self.post(b, token_a), 403)
+
+    def test_token_dies_with_logout(self):
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = '1'
+        token = client.get('/token').get_data(as_text=True)
+        client.get('/logout')
+        with client.session_transaction() as sess:
+            sess['_user_id'] = '1'  # logs back in as the same user
+        self.assertEqual(self.post(client, token), 403)
+
+    def test_token_rejected_after_login(self):
+        client = self.app.test_client()
+        token = client.get('/token').get_data(as_text=True)
+        with client.session_transaction() as sess:
+            sess['_user_id'] = '1'
+        self.assertEqual(self.post(client, token), 403)
+
+    def test_time_limit_uses_rscp_config_key(self):
+        client = self.app.test_client()
+        token = client.get('/token').get_data(as_text=True)
+        self.app.config['RSCP_CSRF_TIME_LIMIT'] = -1
+        self.assertEqual(self.post(client, token), 403)
+        self.app.config['WTF_CSRF_TIME_LIMIT'] = 3600  # RSCP_ wins over the old name
+        self.assertEqual(self.post(client, token), 403)
+
+    def test_time_limit_falls_back_to_wtf_config_key(self):
+        client = self.app.test_client()
+        token = client.get('/token').get_data(as_text=True)
+        self.assertEqual(self.post(client, token), 200)
+        self.app.config['WTF_CSRF_TIME_LIMIT'] = -1
+        self.assertEqual(self.post(client, token), 403)
+
+    def test_legacy_session_token_still_accepted(self):
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['_csrf_token'] = 'legacy-token-value'
+        self.assertEqual(self.post(client, 'legacy-token-value'), 200)
+        self.assertEqual(self.post(client, 'legacy-token-valuX'), 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+import app.services.db as db
+from app.services import db_pool
+from app.services.db_pool import SQLiteConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.db_path = os.path.join(self.tmp, 'pool.db')
+        patch = mock.patch.object(db, 'DB_PATH', self.db_path)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        self.pool = SQLiteConnectionPool(size=2)
+        self.addCleanup(self.pool.close_all)
+        with self.pool.acquire() as conn:
+            conn.execute('CREATE TABLE t (x INTEGER)')
+            conn.commit()
+
+    def borrow(self):
+        with self.pool.acquire() as conn:
+            return conn
+
+    def test_returned_connection_is_reused(self):
+        first = self.borrow()
+        self.assertIs(self.borrow(), first)
+
+    def test_concurrent_borrows_get_distinct_connections(self):
+        with self.pool.acquire() as a, self.pool.acquire() as b:
+            self.assertIsNot(a, b)
+        # LIFO: the last one returned is handed out next
+        self.assertIs(self.borrow(), a)
+
+    def test_overflow_connection_is_closed_not_pooled(self):
+        with self.pool.acquire() as a, self.pool.acquire() as b, self.pool.acquire() as c:
+            pass
+        # Returned c, b, a: the pool holds two, so a (returned last) is closed
+        self.assertEqual([entry[1] for entry in self.pool._queue.queue], [c, b])
+        with self.assertRaises(sqlite3.ProgrammingError):
+            a.execute('SELECT 1')
+
+    def test_uncommitted_work_is_rolled_back_on_return(self):
+        with self.pool.acquire() as conn:
+            conn.execute('INSERT INTO t VALUES (1)')
+            self.assertTrue(conn.in_transaction)
+        with self.pool.acquire() as again:
+            self.assertIs(again, conn)
+            self.assertFalse(again.in_transaction)
+            self.assertEqual(again.execute('SELECT count(*) FROM t').fetchone()[0], 0)
+
+    def test_rolled_back_after_exception(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            with self.pool.acquire() as conn:
+                conn.execute('INSERT INTO t VALUES (1)')
+                raise sqlite3.IntegrityError('simulated')
+        self.assertIs(self.borrow(), conn)
+        self.assertEqual(conn.execute('SELECT count(*) FROM t').fetchone()[0], 0)
+
+    def test_connection_closed_by_caller_is_discarded(self):
+        with self.pool.acquire() as conn:
+            conn.close()
+        self.assertEqual(self.pool._queue.qsize(), 0)
+        self.assertIsNot(self.borrow(), conn)
+
+    def test_db_path_change_discards_pooled_connection(self):
+        old = self.borrow()
+        with mock.patch.object(db, 'DB_PATH', os.path.join(self.tmp, 'other.db')):
+            new = self.borrow()
+            self.assertIsNot(new, old)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            old.execute('SELECT 1')
+
+    def test_child_after_fork_does_not_reuse_parent_connections(self):
+        parent_conn = self.borrow()
+        child_pid = os.getpid() + 1
+        with mock.patch.object(db_pool.os, 'getpid', return_value=child_pid):
+            with self.pool.acquire() as child_conn:
+                self.assertIsNot(child_conn, parent_conn)
+            self.assertEqual(self.pool._pid, child_pid)
+            self.assertIs(self.borrow(), child_conn)
+        # Dropped, not closed: the parent still owns it
+        self.assertEqual(parent_conn.execute('SELECT 1').fetchone()[0], 1)
+        parent_conn.close()
+
+    def test_connection_borrowed_before_fork_is_not_pooled_by_child(self):
+        self.pool.close_all()
+        fork = mock.patch.object(db_pool.os, 'getpid', return_value=os.getpid() + 1)
+        with self.pool.acquire() as conn:
+            fork.start()  # the process forks while the connection is out
+        fork.stop()
+        self.assertEqual(self.pool._queue.qsize(), 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+    def test_borrow_and_release(self):
+        conn = self.pool.borrow()
+        self.assertEqual(self.pool._queue.qsize(), 0)
+        conn.execute('INSERT INTO t VALUES (1)')
+        self.pool.release(conn)
+        self.assertFalse(conn.in_transaction)
+        self.assertIs(self.pool.borrow(), conn)
+
+    def test_release_of_unknown_connection_closes_it(self):
+        stranger = db.get_db_connection(check_same_thread=False)
+        self.pool.release(stranger)
+        self.assertEqual(self.pool._queue.qsize(), 1)  # only the setUp connection
+        with self.assertRaises(sqlite3.ProgrammingError):
+            stranger.execute('SELECT 1')
+
+    def test_request_connection_is_shared_and_returned_on_teardown(self):
+        app = Flask(__name__)
+        db.init_app(app)
+        with mock.patch.object(db_pool, '_POOL', self.pool):
+            pooled = self.borrow()
+            with app.app_context():
+                conn = db.get_request_db()
+                self.assertIs(conn, pooled)
+                self.assertIs(db.get_request_db(), conn)
+                conn.execute('INSERT INTO t VALUES (1)')
+            self.assertIs(self.borrow(), conn)
+            self.assertEqual(conn.execute('SELECT count(*) FROM t').fetchone()[0], 0)
+
+    def test_optimize_runs_every_n_borrows(self):
+        with mock.patch.object(db_pool, 'OPTIMIZE_EVERY', 3):
+            self.borrow()  # the table-creating borrow in setUp was the first
+            self.assertEqual(self.pool._queue.queue[-1][2], 2)
+            self.borrow()
+            self.assertEqual(self.pool._queue.queue[-1][2], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
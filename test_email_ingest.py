@@ -1,6 +1,11 @@
 
 import unittest
-from email_ingest import extract_order_id, parse_amazon_items, parse_ebay_items
+from email.mime.text import MIMEText
+from unittest import mock
+
+import email_ingest
+from email_ingest import (extract_order_id, parse_amazon_items, parse_ebay_items,
+                          fetch_order_emails, mark_emails_seen)
 from bs4 import BeautifulSoup
 
 class TestEmailIngest(unittest.TestCase):
@@ -105,5 +110,137 @@ class TestEmailIngest(unittest.TestCase):
         self.assertEqual(items[0]['name'], "eBay Item Title")
         self.assertEqual(items[0]['image_url'], "https://i.ebayimg.com/images/g/test/s-l500.jpg")
 
+def order_email(order_id):
+    msg = MIMEText(f"<html><body>Your order # {order_id} has shipped</body></html>", 'html')
+    msg['Subject'] = f"Order {order_id}"
+    return msg.as_bytes()
+
+
+class FakeMailbox:
+    """Just enough of imaplib.IMAP4 for fetch_order_emails."""
+
+    def __init__(self, messages, validity=b'7'):
+        self.messages = messages  # uid -> raw bytes (None makes the fetch fail)
+        self.validity = validity
+        self.unseen = set(messages)
+        self.fetched = []
+
+    def response(self, code):
+        return code, [self.validity]
+
+    def select(self, mailbox):
+        return 'OK', [str(len(self.messages)).encode()]
+
+    def uid(self, command, *args):
+        if command == 'search':
+            criteria = args[1]
+            uids = sorted(self.messages)
+            if criteria.startswith('UID '):
+                low = int(criteria.split()[1].split(':')[0])
+                uids = [u for u in uids if u >= low] or uids[-1:]
+            else:
+                uids = [u for u in uids if u in self.unseen]
+            return 'OK', [' '.join(map(str, uids)).encode()]
+        if command == 'fetch':
+            uid = int(args[0])
+            self.fetched.append(uid)
+            raw = self.messages[uid]
+            if raw is None:
+                raise ValueError('unreadable message')
+            return 'OK', [(b'', raw)]
+        if command == 'store':
+            self.unseen.difference_update(int(u) for u in args[0].split(','))
+            return 'OK', [b'']
+
+    def close(self):
+        pass
+
+    def logout(self):
+        pass
+
+
+class TestImapCursor(unittest.TestCase):
+    def setUp(self):
+        email_ingest._FAILED_ATTEMPTS.clear()
+
+    def fetch(self, mailbox, since=None):
+        with mock.patch.object(email_ingest, '_open_mailbox', return_value=mailbox):
+            return fetch_order_emails('imap.test', 'user', 'pw', since=since)
+
+    def poll(self, mailbox, since=None):
+        """fetch + mark_emails_seen, as the ingest job does after a successful write."""
+        items, cursor, seen = self.fetch(mailbox, since)
+        with mock.patch.object(email_ingest, '_open_mailbox', return_value=mailbox):
+            mark_emails_seen('imap.test', 'user', 'pw', cursor, seen)
+        return items, cursor
+
+    def orders(self, items):
+        return [i['tracking'] for i in items]
+
+    def test_first_run_takes_oldest_unseen_first(self):
+        mailbox = FakeMailbox({uid: order_email(f"113-{uid:07d}-0000000") for uid in range(1, 26)})
+        items, cursor = self.poll(mailbox)
+        self.assertEqual(self.orders(items)[0], 'ORDER-113-0000001-0000000')
+        self.assertEqual(len(items), 20)
+        self.assertEqual(cursor, '7:20')
+        self.assertEqual(mailbox.unseen, set(range(21, 26)))
+
+        items, cursor = self.poll(mailbox, since=cursor)
+        self.assertEqual(self.orders(items), [f'ORDER-113-{uid:07d}-0000000' for uid in range(21, 26)])
+        self.assertEqual(cursor, '7:25')
+
+        self.assertEqual(self.poll(mailbox, since=cursor), ([], '7:25'))
+
+    def test_fetch_leaves_mail_unread_until_marked(self):
+        mailbox = FakeMailbox({1: order_email("113-0000001-0000000"), 2: order_email("113-0000002-0000000")})
+        items, cursor, seen = self.fetch(mailbox)
+        self.assertEqual((cursor, seen), ('7:2', [1, 2]))
+        self.assertEqual(mailbox.unseen, {1, 2})
+
+        # The write failed, so nothing was stored or marked: a first run finds them again
+        self.assertEqual(self.fetch(mailbox), (items, '7:2', [1, 2]))
+
+    def test_mark_skipped_after_uidvalidity_change(self):
+        mailbox = FakeMailbox({1: order_email("113-0000001-0000000")}, validity=b'8')
+        with mock.patch.object(email_ingest, '_open_mailbox', return_value=mailbox):
+            mark_emails_seen('imap.test', 'user', 'pw', '7:1', [1])
+        self.assertEqual(mailbox.unseen, {1})
+
+    def test_cursor_stops_before_failed_email(self):
+        messages = {uid: order_email(f"113-{uid:07d}-0000000") for uid in (1, 2, 3, 4)}
+        messages[3] = None
+        mailbox = FakeMailbox(messages)
+        items, cursor = self.poll(mailbox)
+        self.assertEqual(self.orders(items), ['ORDER-113-0000001-0000000', 'ORDER-113-0000002-0000000'])
+        self.assertEqual(cursor, '7:2')
+        self.assertEqual(mailbox.unseen, {3, 4})
+
+        # Recovers on the next poll: the failed email and everything after it
+        messages[3] = order_email("113-0000003-0000000")
+        items, cursor = self.poll(mailbox, since=cursor)
+        self.assertEqual(self.orders(items), ['ORDER-113-0000003-0000000', 'ORDER-113-0000004-0000000'])
+        self.assertEqual(cursor, '7:4')
+
+    def test_first_email_failing_keeps_cursor(self):
+        mailbox = FakeMailbox({1: None, 2: order_email("113-0000002-0000000")})
+        self.assertEqual(self.fetch(mailbox), ([], None, []))
+        self.assertEqual(self.fetch(mailbox, since='7:0'), ([], '7:0', []))
+
+    def test_persistently_failing_email_is_eventually_skipped(self):
+        mailbox = FakeMailbox({5: None, 6: order_email("113-0000006-0000000")})
+        cursor = '7:4'
+        for _ in range(email_ingest.MAX_EMAIL_ATTEMPTS - 1):
+            items, cursor = self.poll(mailbox, since=cursor)
+            self.assertEqual((items, cursor), ([], '7:4'))
+        items, cursor = self.poll(mailbox, since=cursor)
+        self.assertEqual(self.orders(items), ['ORDER-113-0000006-0000000'])
+        self.assertEqual(cursor, '7:6')
+
+    def test_new_uidvalidity_starts_over(self):
+        mailbox = FakeMailbox({1: order_email("113-0000001-0000000")}, validity=b'8')
+        items, cursor = self.poll(mailbox, since='7:50')
+        self.assertEqual(self.orders(items), ['ORDER-113-0000001-0000000'])
+        self.assertEqual(cursor, '8:1')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import app.services.auth as auth
+import app.services.data_manager as dm
+import app.services.db as db
+from app import create_app
+from app.routes.inventory import alerts
+from app.services.migration import ensure_db_ready
+
+
+class TestAlertsPage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.db_path = os.path.join(self.tmp, 'test.db')
+        config = os.path.join(self.tmp, 'config.json')
+        with open(config, 'w') as f:
+            json.dump({'SECRET_KEY': 'test', 'INVENTORY_ENABLED': True, 'LOW_STOCK_THRESHOLD': 3}, f)
+
+        for patch in (mock.patch.object(db, 'DB_PATH', self.db_path),
+                      mock.patch.object(dm, 'CONFIG_FILE', config),
+                      mock.patch.dict(dm.CONFIG_CACHE, {'data': None, 'stamp': None}),
+                      mock.patch.dict(auth.USERS_CACHE, {'snapshot': None})):
+            patch.start()
+            self.addCleanup(patch.stop)
+        ensure_db_ready()
+
+        conn = db.get_db_connection()
+        try:
+            conn.executemany('INSERT INTO inventory_items (sku, name, quantity) VALUES (?, ?, ?)',
+                             [(f'SKU-{i:03d}', f'Item {i:03d}', i) for i in range(150)])
+            conn.execute("INSERT INTO users (username, password_hash, is_admin, roles) "
+                         "VALUES ('admin', 'unused', 1, '[\"super_admin\"]')")
+            user_id = conn.execute("SELECT id FROM users WHERE username = 'admin'").fetchone()['id']
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.app = create_app({'TESTING': True, 'SECRET_KEY': 'test', 'DATABASE': self.db_path})
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as sess:
+            # Fresh login (e.g. remember-me): no CSRF nonce in the session yet
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+
+    def test_streams_all_rows_and_closes_connection(self):
+        opened = []
+
+        def tracking_connection(*args, **kwargs):
+            conn = db.get_db_connection(*args, **kwargs)
+            opened.append(conn)
+            return conn
+
+        with mock.patch.object(alerts, 'get_db_connection', tracking_connection):
+            response = self.client.get('/inventory/alerts')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_streamed)
+            body = response.get_data(as_text=True)
+            self.assertEqual(len(opened), 1)
+            opened[0].execute('SELECT 1')  # still open until the response closes
+            response.close()
+
+        for i in range(150):
+            self.assertIn(f'SKU-{i:03d}', body)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            opened[0].execute('SELECT 1')
+
+    def test_token_on_streamed_page_validates(self):
+        body = self.client.get('/inventory/alerts').get_data(as_text=True)
+        tokens = set(re.findall(r'name="csrf_token" value="([^"]+)"', body))
+        self.assertEqual(len(tokens), 1)
+
+        response = self.client.post('/inventory/alerts/config',
+                                    data={'csrf_token': tokens.pop(), 'low_stock_threshold': '7'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(dm.load_config().get('LOW_STOCK_THRESHOLD'), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
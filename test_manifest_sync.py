@@ -0,0 +1,108 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import app.services.db as db
+import app.services.data_manager as dm
+from app.services.migration import ensure_db_ready
+
+
+class TestManifestSync(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, 'test.db')
+        self.manifest = os.path.join(self.tmp, 'manifest.csv')
+        config = os.path.join(self.tmp, 'config.json')
+        with open(config, 'w') as f:
+            json.dump({'SECRET_KEY': 'test'}, f)
+
+        for patch in (mock.patch.object(db, 'DB_PATH', self.db_path),
+                      mock.patch.object(dm, 'MANIFEST_FILE', self.manifest),
+                      mock.patch.object(dm, 'CONFIG_FILE', config),
+                      mock.patch.dict(dm.CONFIG_CACHE, {'data': None, 'stamp': None})):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        ensure_db_ready()
+
+    def sync(self, csv_text):
+        with open(self.manifest, 'w') as f:
+            f.write(csv_text)
+        dm.DATA_CACHE['manifest_mtime'] = 0  # force a sync
+        dm.sync_manifest()
+
+    def packages(self):
+        conn = db.get_db_connection()
+        try:
+            return {r['tracking_number']: dict(r) for r in conn.execute('SELECT * FROM packages')}
+        finally:
+            conn.close()
+
+    def test_shared_tracking_keeps_first_item(self):
+        manifest = ("TrackingNumber,ItemName,Quantity,Date\n"
+                    "1ZSHARED,First Item,1,2099-01-01\n"
+                    "1ZSHARED,Second Item,2,2099-01-01\n"
+                    "1ZOTHER,Other Item,1,2099-01-01\n")
+        with self.assertLogs('app.services.data_manager', level='WARNING') as logs:
+            self.sync(manifest)
+        self.assertIn('1ZSHARED', '\n'.join(logs.output))
+
+        pkgs = self.packages()
+        self.assertEqual(set(pkgs), {'1ZSHARED', '1ZOTHER'})
+        self.assertEqual(pkgs['1ZSHARED']['item_name'], 'First Item')
+        self.assertEqual(pkgs['1ZSHARED']['quantity'], 1)
+
+    def test_shared_tracking_is_stable_across_syncs(self):
+        manifest = ("TrackingNumber,ItemName,Quantity,Date\n"
+                    "1ZSHARED,Second Item,2,2099-01-01\n"
+                    "1ZSHARED,First Item,1,2099-01-01\n")
+        self.sync(manifest)
+        first = self.packages()['1ZSHARED']
+
+        self.sync(manifest)
+        second = self.packages()['1ZSHARED']
+        self.assertEqual(second, first)
+        self.assertEqual(second['item_name'], 'Second Item')
+
+    def test_unchanged_resync_writes_nothing(self):
+        manifest = ("TrackingNumber,ItemName,Quantity,Date\n"
+                    "1ZA,Item A,1,2099-01-01\n")
+        self.sync(manifest)
+        conn = db.get_db_connection()
+        try:
+            conn.executescript('''
+                CREATE TABLE pkg_updates (n INTEGER);
+                CREATE TRIGGER count_pkg_updates AFTER UPDATE ON packages
+                BEGIN INSERT INTO pkg_updates VALUES (1); END;
+            ''')
+            self.sync(manifest)
+            self.assertEqual(conn.execute('SELECT count(*) FROM pkg_updates').fetchone()[0], 0)
+        finally:
+            conn.close()
+
+    def test_existing_row_is_not_renamed(self):
+        self.sync("TrackingNumber,ItemName,Quantity,Date\n1ZA,Original,1,2099-01-01\n")
+        with self.assertLogs('app.services.data_manager', level='WARNING'):
+            self.sync("TrackingNumber,ItemName,Quantity,Date\n1ZA,Renamed,3,2099-01-01\n")
+        pkg = self.packages()['1ZA']
+        self.assertEqual(pkg['item_name'], 'Original')
+        self.assertEqual(pkg['quantity'], 1)
+
+    def test_matched_and_new_rows(self):
+        today = datetime.date.today().isoformat()
+        self.sync(f"TrackingNumber,ItemName,Quantity,Date\n1ZA,Item A,1,{today}\n")
+        self.sync("TrackingNumber,ItemName,Quantity,Date\n"
+                  "1ZNEW,New Item,2,2099-01-01\n"
+                  "1ZA,Item A,4,2099-01-01\n")
+        pkgs = self.packages()
+        self.assertEqual(pkgs['1ZA']['quantity'], 4)
+        self.assertEqual(pkgs['1ZA']['status'], 'on_time')
+        self.assertEqual(pkgs['1ZNEW']['item_name'], 'New Item')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,7 +35,7 @@ def test_protection():
     conn.commit()
     
     # 3. Verify
-    row = cur.execute("SELECT * FROM packages WHERE tracking_number = ?", (manual_tracking,)).fetchone()
+    row = cur.execute("SELECT 1 FROM packages WHERE tracking_number = ? LIMIT 1", (manual_tracking,)).fetchone()
     
     if row:
         print("✅ SUCCESS: Manual item was NOT deleted.")
@@ -1,6 +1,6 @@
 """
 WSGI Entry Point for Production Deployment
-Use with Gunicorn: gunicorn -w 4 -b 0.0.0.0:5000 wsgi:app
+Use with Gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
 """
 from app import create_app
 from app.services.background_tasks import start_background_tasks